@@ -1,71 +1,87 @@
-import requests
-import zipfile
+import argparse
+import logging
 import shutil
 from tqdm import tqdm
 import config
+from core.downloader import ensure_file
+from core.archive import StreamUnsupported, stream_extract, parallel_extract
 
-# Временный файл будет лежать внутри папки temp_download
+# Временный файл будет лежать внутри папки temp_download (только если потоковая распаковка невозможна)
 ZIP_FILE = config.TEMP_DIR / "coco_backgrounds.zip"
 
-def download_and_extract():
+def extract_streaming():
+    """Архив из сети сразу в backgrounds/: без zip на диске и без переноса файлов."""
+    print(f"📥 Качаем и распаковываем на лету в: {config.BACKGROUNDS_DIR}")
+    with tqdm(desc="Downloading", unit='iB', unit_scale=True, unit_divisor=1024) as bar:
+        return stream_extract(config.BACKGROUNDS_URL, config.BACKGROUNDS_DIR, progress=bar.update)
+
+def extract_from_file():
+    """Запасной путь: архив целиком в temp_download (с докачкой и SHA-256), потом распаковка в потоках."""
+    print(f"📥 Скачиваем архив в: {ZIP_FILE}")
+    # Скачиваем (докачка, параллельные куски, проверка SHA-256 — core/downloader.py)
+    ensure_file(ZIP_FILE, config.BACKGROUNDS_URL, config.BACKGROUNDS_SHA256)
+
+    print("📦 Распаковка архива прямо в backgrounds...")
+    with tqdm(desc="Extracting", unit="img") as bar:
+        stats = parallel_extract(ZIP_FILE, config.BACKGROUNDS_DIR, progress=bar.update)
+
+    print("🧹 Очистка временных файлов...")
+    # Удаляем всю папку temp_download целиком
+    shutil.rmtree(config.TEMP_DIR)
+    return stats
+
+def download_and_extract(stream: bool = None, build_cache: bool = False):
     # 1. Проверка: может уже скачано?
     if config.BACKGROUNDS_DIR.exists():
         count = len(list(config.BACKGROUNDS_DIR.glob("*.jpg")))
         if count > 4000:
             print(f"✅ Фоны уже на месте ({count} шт). Скачивать не нужно.")
+            if build_cache: build_bg_cache()
             return
 
-    # Убедимся, что временная папка чиста
-    if config.TEMP_DIR.exists():
-        shutil.rmtree(config.TEMP_DIR)
-    config.TEMP_DIR.mkdir(parents=True, exist_ok=True)
-
-    print(f"📥 Скачиваем архив в: {ZIP_FILE}")
+    config.BACKGROUNDS_DIR.mkdir(parents=True, exist_ok=True)
+    stream = config.BACKGROUNDS_STREAM_EXTRACT if stream is None else stream
 
     try:
-        # Скачиваем
-        response = requests.get(config.BACKGROUNDS_URL, stream=True)
-        total_size = int(response.headers.get('content-length', 0))
-
-        with open(ZIP_FILE, "wb") as file, tqdm(
-                desc="Downloading",
-                total=total_size,
-                unit='iB',
-                unit_scale=True,
-                unit_divisor=1024,
-        ) as bar:
-            for data in response.iter_content(chunk_size=1024):
-                size = file.write(data)
-                bar.update(size)
-
-        print("📦 Распаковка архива во временную папку...")
-        with zipfile.ZipFile(ZIP_FILE, 'r') as zip_ref:
-            # Распаковываем прямо в temp_download
-            zip_ref.extractall(config.TEMP_DIR)
-
-        print("📂 Перенос файлов в backgrounds...")
-        # В архиве лежит папка "val2017". Ищем её внутри temp_download
-        extracted_folder = config.TEMP_DIR / "val2017"
-
-        if extracted_folder.exists():
-            for file_path in extracted_folder.glob("*.jpg"):
-                shutil.move(str(file_path), str(config.BACKGROUNDS_DIR / file_path.name))
-        else:
-            print("❌ Ошибка: Не нашел папку val2017 внутри архива!")
-            return
-
-        print("🧹 Очистка временных файлов...")
-        # Удаляем всю папку temp_download целиком
-        shutil.rmtree(config.TEMP_DIR)
+        stats = None
+        if stream:
+            try:
+                stats = extract_streaming()
+            except StreamUnsupported as e:
+                print(f"⚠️ Потоковая распаковка невозможна ({e}), качаем архив целиком")
+        if stats is None:
+            config.TEMP_DIR.mkdir(parents=True, exist_ok=True)
+            stats = extract_from_file()
 
         final_count = len(list(config.BACKGROUNDS_DIR.glob("*.jpg")))
-        print(f"✅ Успешно! Скачано {final_count} фото.")
+        print(f"✅ Успешно! Распаковано {stats['extracted']}, уже были {stats['skipped']}, всего {final_count} фото.")
 
     except Exception as e:
         print(f"❌ Ошибка: {e}")
-        # Если упали - не удаляем папку temp, чтобы можно было посмотреть, что скачалось
-        print(f"   Временные файлы остались в {config.TEMP_DIR}")
+        # Готовые файлы остаются в backgrounds, повторный запуск их пропустит;
+        # недокачанный архив (запасной путь) остается в temp — продолжим с места обрыва
+        print(f"   Повторный запуск продолжит загрузку")
+        return
+
+    if build_cache: build_bg_cache()
+
+def build_bg_cache():
+    """Сразу собрать кэш декодированных фонов для генератора (core/bg_cache.py)."""
+    from core import bg_cache
+    bg_files = sorted(config.BACKGROUNDS_DIR.glob("*.jpg"))
+    if bg_cache.ensure(bg_files, progress_factory=lambda n: tqdm(total=n, unit="bg")) is not None:
+        print(f"💾 Кэш фонов готов: {config.BG_CACHE_DIR}")
 
 
 if __name__ == "__main__":
-    download_and_extract()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Скачивание фонов COCO")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--stream", dest="stream", action="store_true", default=None,
+                      help="Распаковывать на лету, без архива на диске (по умолчанию config.BACKGROUNDS_STREAM_EXTRACT)")
+    mode.add_argument("--no-stream", dest="stream", action="store_false", help="Скачать архив целиком, потом распаковать")
+    parser.add_argument("--cache", action="store_true", help="Сразу собрать кэш декодированных фонов для генератора")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")  # Докачка и SHA-256 от загрузчика
+    config.setup_directories()
+    download_and_extract(args.stream, args.cache)
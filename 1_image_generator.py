@@ -1,180 +1,101 @@
 """
 Генератор Синтетических Данных для YOLOv11-seg.
 Использует 100% файлов из backgrounds + добавляет градиенты.
+
+Детерминированность: у каждого примера свой генератор случайных чисел
+np.random.default_rng(SeedSequence([config.GEN_SEED, index])), глобальный random не используется.
+Наложение ватермарки и разметка — core/synth.py (общие с обучением "на лету").
+Результат не зависит от числа процессов, а любой пример можно пересоздать отдельно:
+    python 1_image_generator.py --index 42 --index 4242
+Параллельность: config.GEN_WORKERS процессов (ProcessPoolExecutor), общий прогресс-бар.
+Инкрементальность: train_dataset/manifest.jsonl — перезапуск делает только недостающее и устаревшее.
+Фоны читаются из кэша декодированных кадров (core/bg_cache.py), а не из JPEG.
+С config.GEN_WM_ATLAS ватермарка берется из банка готовых вариантов (core/wm_atlas.py).
 """
 
+import os
+import argparse
 import cv2
-import numpy as np
-import random
 import yaml
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 import config
+from core.synth import (sample_rng, sample_split, sample_hash, watermark_hash, load_watermark,
+                        make_background, compose_sample, format_polygon)
+from core.dataset_manifest import DatasetManifest, scan_sample_files
+from core import bg_cache, wm_atlas
+
+# Состояние процесса-воркера (заполняется в _init_worker)
+_WORKER = {}
 
 
-def generate_gradient(w, h):
+def process_single_image(bg, wm_original, index, base_dir, rng, split, atlas=None, trace=None):
     """
-    Генерирует случайный градиент.
-    ИСПРАВЛЕННАЯ ВЕРСИЯ: Явно растягиваем массивы (np.tile), 
-    чтобы не получать полоски 1px шириной.
+    Логика обработки одного фона и сохранения (наложение и разметка — core/synth.py).
+    Вся случайность — только из rng. Возвращает "positive" / "negative" / "empty" (ничего не записано).
+    trace — сюда compose_sample пишет свои решения (для хэша в манифесте).
     """
-    # 1. Выбор цветов
-    if random.random() < 0.5:
-        c1 = np.random.randint(200, 256, (3,))  # Светлый 1
-        c2 = np.random.randint(150, 230, (3,))  # Светлый 2
-    else:
-        c1 = np.random.randint(50, 120, (3,))  # Темный 1
-        c2 = np.random.randint(10, 80, (3,))   # Темный 2
-
-    # 2. Создаем маску смешивания alpha (h, w, 1)
-    rnd_type = random.random()
-
-    if rnd_type < 0.7:
-        # Линейный
-        if random.random() < 0.5:
-            # Вертикальный (меняется по высоте)
-            # Создаем столбец (h, 1) и дублируем его w раз вправо
-            col = np.linspace(0, 1, h).reshape(h, 1)
-            alpha = np.tile(col, (1, w)) # -> (h, w)
-        else:
-            # Горизонтальный (меняется по ширине)
-            # Создаем строку (1, w) и дублируем её h раз вниз
-            row = np.linspace(0, 1, w).reshape(1, w)
-            alpha = np.tile(row, (h, 1)) # -> (h, w)
-    else:
-        # Диагональный
-        Y = np.linspace(0, 1, h).reshape(h, 1)
-        X = np.linspace(0, 1, w).reshape(1, w)
-        # Тут broadcasting работает корректно, создавая матрицу (h, w)
-        alpha = (Y + X) / 2.0
-
-    # Превращаем (h, w) в (h, w, 1) для умножения на RGB
-    alpha = alpha.reshape(h, w, 1)
-
-    # 3. Смешиваем цвета
-    # c1 и c2 имеют форму (3,), они растянутся на всю картинку
-    img = (1.0 - alpha) * c1 + alpha * c2
-
-    return img.astype(np.uint8)
-
-def get_yolo_polygon(mask, img_w, img_h):
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    polygons = []
-    for cnt in contours:
-        if cv2.contourArea(cnt) < 50: continue
-        epsilon = 0.002 * cv2.arcLength(cnt, True)
-        approx = cv2.approxPolyDP(cnt, epsilon, True)
-        if len(approx) < 4: continue
-        points = []
-        for point in approx:
-            x, y = point[0]
-            nx = max(0, min(1, x / img_w))
-            ny = max(0, min(1, y / img_h))
-            points.append(f"{nx:.6f} {ny:.6f}")
-        polygons.append(" ".join(points))
-    return polygons
-
-def smart_resize(img, w, h):
-    h_orig, w_orig = img.shape[:2]
-    if w > w_orig or h > h_orig: return cv2.resize(img, (w, h), interpolation=cv2.INTER_LANCZOS4)
-    else: return cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
-
-def apply_random_color(img_rgba):
-    if random.random() < config.GEN_COLOR_PROB:
-        color = np.random.randint(0, 256, (3,), dtype=np.uint8)
-        gray = cv2.cvtColor(img_rgba[:, :, :3], cv2.COLOR_BGR2GRAY) / 255.0
-        result = img_rgba.copy()
-        for c in range(3):
-            colored_layer = np.ones_like(gray) * color[c]
-            result[:, :, c] = (colored_layer * gray).astype(np.uint8)
-        return result
-    return img_rgba
-
-def apply_edge_corruption(img_rgba):
-    if random.random() > getattr(config, 'GEN_PROB_EDGE_CORRUPTION', 0.5): return img_rgba
-    b, g, r, a = cv2.split(img_rgba)
-    ksize = random.choice([3, 5])
-    kernel = np.ones((ksize, ksize), np.uint8)
-    if random.random() < 0.5: a = cv2.erode(a, kernel, iterations=1)
-    else: a = cv2.dilate(a, kernel, iterations=1)
-    if random.random() < 0.5: a = cv2.GaussianBlur(a, (3, 3), 0)
-    return cv2.merge((b, g, r, a))
-
-def process_single_image(bg, wm_original, index, base_dir):
-    """Логика обработки одного фона и сохранения"""
-    split = "train" if random.random() < config.GEN_TRAIN_RATIO else "val"
-    h_bg, w_bg = bg.shape[:2]
     filename = f"syn_{index:06d}" # 6 цифр
 
-    # === NEGATIVE SAMPLE ===
-    if random.random() < config.GEN_PROB_NEGATIVE:
-        cv2.imwrite(str(base_dir / 'images' / split / f"{filename}.jpg"), bg)
-        open(base_dir / 'labels' / split / f"{filename}.txt", "w").close()
-        return
-
-    wm_curr = wm_original.copy()
-    is_hard_mode = random.random() > config.GEN_PROB_EASY_MODE
-
-    # Трансформации
-    if random.random() < config.GEN_ROTATION_PROB:
-        wm_curr = cv2.rotate(wm_curr, cv2.ROTATE_90_CLOCKWISE)
-
-    if is_hard_mode and random.random() < config.GEN_INVERT_PROB:
-        wm_curr[:, :, :3] = cv2.bitwise_not(wm_curr[:, :, :3])
-
-    scale_ratio = random.uniform(*config.GEN_SCALE_RANGE)
-    h_wm, w_wm = wm_curr.shape[:2]
-    new_w = int(w_bg * scale_ratio)
-    new_h = int(h_wm * (new_w / w_wm))
-
-    if new_h > h_bg: new_h = int(h_bg * 0.9); new_w = int(w_wm * (new_h / h_wm))
-    if new_w < 10: return
-
-    wm_resized = smart_resize(wm_curr, new_w, new_h)
-
-    if is_hard_mode:
-        wm_resized = apply_random_color(wm_resized)
-        if random.random() < config.GEN_BLUR_PROB:
-            k = random.choice([3, 5])
-            wm_resized = cv2.GaussianBlur(wm_resized, (k, k), 0)
-        wm_resized = apply_edge_corruption(wm_resized)
-        opacity = random.uniform(*config.GEN_OPACITY_RANGE)
-    else:
-        opacity = random.uniform(0.7, 1.0)
-
-    # Наложение
-    wm_rgb = wm_resized[:, :, :3]
-    wm_alpha = wm_resized[:, :, 3] / 255.0
-    wm_alpha = wm_alpha * opacity
-
-    y_off = random.randint(0, h_bg - new_h)
-    x_off = random.randint(0, w_bg - new_w)
-
-    roi = bg[y_off:y_off+new_h, x_off:x_off+new_w]
-    for c in range(3):
-        roi[:, :, c] = (1.0 - wm_alpha) * roi[:, :, c] + \
-                       wm_alpha * wm_rgb[:, :, c]
-    bg[y_off:y_off+new_h, x_off:x_off+new_w] = roi
-
-    # Маска
-    mask_binary = np.zeros((h_bg, w_bg), dtype=np.uint8)
-    wm_shape = (wm_resized[:, :, 3] > 10).astype(np.uint8) * 255
-    mask_binary[y_off:y_off+new_h, x_off:x_off+new_w] = wm_shape
+    img, polygons = compose_sample(bg, wm_original, rng, atlas, trace)
+    if img is None:
+        return "empty"
 
-    polygons = get_yolo_polygon(mask_binary, w_bg, h_bg)
+    cv2.imwrite(str(base_dir / 'images' / split / f"{filename}.jpg"), img)
+    with open(base_dir / 'labels' / split / f"{filename}.txt", "w") as f:
+        for poly in polygons:
+            f.write(f"0 {format_polygon(poly)}\n")
+    return "positive" if polygons else "negative"
 
-    if polygons:
-        cv2.imwrite(str(base_dir / 'images' / split / f"{filename}.jpg"), bg)
-        with open(base_dir / 'labels' / split / f"{filename}.txt", "w") as f:
-            for poly in polygons:
-                f.write(f"0 {poly}\n")
+def _init_worker(wm_original, bg_files, base_dir, seed, cache, atlas):
+    cv2.setNumThreads(1)  # Параллельность — процессами, потоки OpenCV только мешают
+    _WORKER.update(wm=wm_original, bg_files=bg_files, base_dir=base_dir, seed=seed, atlas=atlas,
+                   read=cache.read if cache is not None else None)
 
-def generate_dataset():
+def generate_sample(index: int):
+    """
+    Пример с номером index: 0..len(bg_files)-1 — реальные фоны (по отсортированному списку),
+    дальше — градиенты. Результат определяется только (seed, index). -> (index, status, split, trace)
+    """
+    split = sample_split(index, _WORKER["seed"])
+    rng = sample_rng(index, _WORKER["seed"])
+    bg = make_background(index, _WORKER["bg_files"], rng, _WORKER["read"])
+    if bg is None: return index, "unreadable", split, []
+    if not bg.flags.writeable: bg = bg.copy()  # Кадр из кэша общий, а наложение — in-place
+
+    trace = []
+    status = process_single_image(bg, _WORKER["wm"], index, _WORKER["base_dir"], rng, split, _WORKER["atlas"], trace)
+    return index, status, split, trace
+
+def sample_source(index, bg_files):
+    """Что лежит в основе примера: имя и размер фона (или градиент)."""
+    if index < len(bg_files):
+        return f"{bg_files[index].name}:{bg_files[index].stat().st_size}"
+    return "gradient"
+
+def sample_files(index, status, split):
+    if status not in ("positive", "negative"):
+        return []
+    return [f"images/{split}/syn_{index:06d}.jpg", f"labels/{split}/syn_{index:06d}.txt"]
+
+def generate_dataset(workers: int = None, seed: int = None, indices: list = None, only_split: str = None):
+    """
+    Инкрементальная генерация по манифесту (core/dataset_manifest.py): готовые примеры с тем же
+    фоном, сидом и хэшем использованных ими GEN_* пропускаются, устаревшие пересоздаются,
+    попавшие в другой сплит (GEN_TRAIN_RATIO) переносятся, лишние файлы удаляются.
+    Прерванный запуск продолжается с места остановки.
+
+    workers — число процессов (None = config.GEN_WORKERS, 0/1 — в текущем процессе).
+    indices — пересоздать только эти примеры (даже если они валидны).
+    only_split — "val": только валидация (для обучения "на лету", train генерируется в даталоадере).
+    """
     # Проверки
     if not config.WATERMARK_SOURCE.exists():
         print(f"❌ Нет файла {config.WATERMARK_SOURCE}")
         return
-    bg_files = list(config.BACKGROUNDS_DIR.glob("*.jpg"))
+    # Сортировка обязательна: индекс примера = позиция фона в списке
+    bg_files = sorted(config.BACKGROUNDS_DIR.glob("*.jpg"))
     if not bg_files:
         print(f"❌ Нет фонов. Запусти 0_download_backgrounds.py")
         return
@@ -185,51 +106,98 @@ def generate_dataset():
         (base_dir / 'labels' / split).mkdir(parents=True, exist_ok=True)
 
     # Грузим исходник
-    wm_original = cv2.imread(str(config.WATERMARK_SOURCE), cv2.IMREAD_UNCHANGED)
-    if wm_original.shape[2] == 3:
-        b, g, r = cv2.split(wm_original)
-        alpha = np.ones_like(b) * 255
-        wm_original = cv2.merge((b, g, r, alpha))
-
-    # Лечение исходника
-    dil_size = getattr(config, 'GEN_SOURCE_REPAIR_DILATION', 0)
-    if dil_size > 0:
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (dil_size, dil_size))
-        b,g,r,a = cv2.split(wm_original)
-        a = cv2.dilate(a, kernel, iterations=1)
-        b = cv2.dilate(b, kernel, iterations=1)
-        g = cv2.dilate(g, kernel, iterations=1)
-        r = cv2.dilate(r, kernel, iterations=1)
-        wm_original = cv2.merge((b,g,r,a))
+    wm_original = load_watermark()
 
     # 1. Считаем, сколько нужно градиентов
     total_real = len(bg_files)
     total_solid = int(total_real * config.GEN_EXTRA_SOLID_PERCENT)
     total_count = total_real + total_solid
 
+    seed = config.GEN_SEED if seed is None else seed
+    workers = config.GEN_WORKERS if workers is None else workers
+    workers = max(1, os.cpu_count() or 1) if workers is None else max(1, workers)
+
+    # 2. Что уже готово
+    wm_hash = watermark_hash(wm_original)
+    atlas_key = wm_atlas.atlas_key(wm_original, seed) if config.GEN_WM_ATLAS else ""
+    sources = [sample_source(i, bg_files) for i in range(total_count)]
+    manifest = DatasetManifest(base_dir)
+    on_disk = scan_sample_files(base_dir)
+
+    def is_valid(i):
+        photo = sources[i] != "gradient"
+        return manifest.is_valid(i, sources[i], seed, lambda trace: sample_hash(trace, photo, wm_hash, atlas_key))
+
+    moved = 0
+    if indices is None:
+        todo = [i for i in range(total_count) if not is_valid(i)]
+        # Сплит не входит в хэш: после смены GEN_TRAIN_RATIO готовые примеры только переезжают
+        for i in sorted(set(range(total_count)) - set(todo)):
+            entry, split = manifest.entries[i], sample_split(i, seed)
+            if entry["split"] != split:
+                manifest.move(i, split, sample_files(i, entry["status"], split))
+                moved += 1
+    else:
+        todo = [i for i in indices if 0 <= i < total_count]
+    if only_split:
+        todo = [i for i in todo if sample_split(i, seed) == only_split]
+
+    # Старые файлы пересоздаваемых примеров: могли лежать в другом сплите или остаться недописанными
+    for i in todo:
+        manifest.drop(i)
+        for rel in on_disk.get(i, []):
+            (base_dir / rel).unlink(missing_ok=True)
+
     print(f"🚀 Генерация полного датасета:")
     print(f"   📸 Реальные фоны: {total_real}")
     print(f"   🎨 Градиенты:     {total_solid}")
     print(f"   ∑  Итого:         {total_count}")
-
-    counter = 0
-
-    # 2. Проходим по ВСЕМ реальным фото
-    print("   [1/2] Обработка реальных фонов...")
-    for bg_path in tqdm(bg_files):
-        bg = cv2.imread(str(bg_path))
-        if bg is None: continue
-        process_single_image(bg, wm_original, counter, base_dir)
-        counter += 1
-
-    # 3. Генерируем градиенты
-    print("   [2/2] Генерация градиентов...")
-    for _ in tqdm(range(total_solid)):
-        h = random.randint(600, 1024)
-        w = random.randint(600, 1024)
-        bg = generate_gradient(w, h)
-        process_single_image(bg, wm_original, counter, base_dir)
-        counter += 1
+    print(f"   🎲 Сид: {seed}, процессов: {workers}")
+    print(f"   ♻️  Уже готово: {total_count - len(todo)} (перенесено в другой сплит: {moved}), к генерации: {len(todo)}")
+
+    # Кэш декодированных фонов: собирается один раз, пересобирается при изменении папки
+    cache = bg_cache.ensure(bg_files, progress_factory=lambda n: tqdm(total=n, unit="bg")) if todo else None
+
+    atlas = wm_atlas.ensure(wm_original, seed) if todo else None  # config.GEN_WM_ATLAS
+
+    initargs = (wm_original, bg_files, base_dir, seed, cache, atlas)
+    counts = {}
+    executor = None
+    try:
+        with tqdm(total=len(todo), unit="img") as pbar:
+            if workers == 1 or len(todo) <= 1:
+                _init_worker(*initargs)
+                results = map(generate_sample, todo)
+            else:
+                executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs)
+                # chunksize: меньше IPC на пример, но хвост пачки не должен держать прогресс
+                results = executor.map(generate_sample, todo, chunksize=16)
+            for index, status, split, trace in results:
+                config_hash = sample_hash(trace, sources[index] != "gradient", wm_hash, atlas_key)
+                manifest.add({"index": index, "source": sources[index], "seed": seed, "trace": trace,
+                              "config": config_hash, "split": split, "status": status,
+                              "files": sample_files(index, status, split)})
+                counts[status] = counts.get(status, 0) + 1
+                pbar.update()
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        manifest.close()
+
+    # 3. Сироты: файлы, которых нет в валидных записях (старые индексы, устаревшие примеры).
+    # Только после полного прохода: --index не должен стирать остальной датасет
+    orphans = 0
+    if indices is None:
+        keep = {i for i in range(total_count) if is_valid(i)}
+        referenced = {f for i in keep for f in manifest.entries[i]["files"]}
+        for rels in scan_sample_files(base_dir).values():
+            for rel in rels:
+                if rel not in referenced:
+                    (base_dir / rel).unlink(missing_ok=True)
+                    orphans += 1
+        manifest.compact(keep)
+    else:
+        manifest.compact()
 
     # data.yaml
     yaml_data = {
@@ -241,7 +209,18 @@ def generate_dataset():
     with open(base_dir / "data.yaml", "w") as f:
         yaml.dump(yaml_data, f, sort_keys=False)
 
-    print(f"\n✅ Генерация завершена! Всего создано {counter} примеров.")
+    created = counts.get("positive", 0) + counts.get("negative", 0)
+    print(f"\n✅ Генерация завершена! Создано {created} примеров {counts}, удалено лишних файлов: {orphans}.")
 
 if __name__ == "__main__":
-    generate_dataset()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Генерация синтетического датасета")
+    parser.add_argument("--workers", type=int, default=None, help="Процессов (по умолчанию config.GEN_WORKERS)")
+    parser.add_argument("--seed", type=int, default=None, help="Мастер-сид (по умолчанию config.GEN_SEED)")
+    parser.add_argument("--index", type=int, action="append", default=None,
+                        help="Пересоздать только пример с этим номером (можно несколько раз)")
+    parser.add_argument("--split", choices=["train", "val"], default=None,
+                        help='Только один сплит. "val" — для TRAIN_DATA_FORMAT = "stream"')
+    args = parser.parse_args()
+
+    config.setup_directories()
+    generate_dataset(args.workers, args.seed, args.index, args.split)
@@ -16,23 +16,41 @@ os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 RUNS_DIR = Path("runs/segment")
 DATA_YAML = config.TRAIN_DATASET_DIR / "data.yaml"
 
-# Путь к базовой модели (с которой начинаем обучение)
-BASE_MODEL_PATH = config.MODELS_DIR / "yolo11s-seg.pt"
-
 def train():
     print(f"🚀 ЗАПУСК ОБУЧЕНИЯ")
     print("=" * 40)
 
     # 1. Проверки
+    stream = config.TRAIN_DATA_FORMAT == "stream"
     if not DATA_YAML.exists():
         print(f"❌ Ошибка: Не найден {DATA_YAML}")
-        print("   👉 Сначала запусти 1_image_generator.py!")
+        print("   👉 Сначала запусти 1_image_generator.py" + (" --split val!" if stream else "!"))
         return
 
+    trainer = None
+    if stream:
+        # Train генерируется на лету, с диска — только фиксированная валидация
+        if not any((config.TRAIN_DATASET_DIR / "images" / "val").glob("*.jpg")):
+            print("❌ Ошибка: Нет валидации для режима stream")
+            print("   👉 Запусти 1_image_generator.py --split val")
+            return
+        from core.stream_dataset import StreamingSegmentationTrainer
+        trainer = StreamingSegmentationTrainer
+        print("🌊 Режим stream: train-примеры генерируются в даталоадере, новые на каждой эпохе")
+    elif config.TRAIN_DATA_FORMAT == "packed":
+        # Перепаковка только если генератор что-то изменил (или поменялся TRAIN_IMG_SIZE)
+        from tqdm import tqdm
+        from core import packed_dataset
+        from core.packed_trainer import PackedSegmentationTrainer
+        for split in ("train", "val"):
+            packed_dataset.ensure(split, progress_factory=lambda n: tqdm(total=n, unit="img"))
+        trainer = PackedSegmentationTrainer
+        print("📦 Режим packed: кадры из шардов через memmap, без декодирования JPEG")
+
     # 2. Гарантируем наличие базовой модели
     print(f"⏳ Проверка базовой модели...")
     try:
-        ensure_model(BASE_MODEL_PATH, config.YOLO_MODEL_URL)
+        ensure_model(config.YOLO_BASE_MODEL_PATH, config.YOLO_MODEL_URL, config.YOLO_MODEL_SHA256)
     except Exception as e:
         print(f"❌ Не могу скачать базовую модель: {e}")
         return
@@ -41,9 +59,10 @@ def train():
 
     try:
         # Загружаем модель
-        model = YOLO(BASE_MODEL_PATH)
+        model = YOLO(config.YOLO_BASE_MODEL_PATH)
 
         results = model.train(
+            trainer=trainer,
             data=str(DATA_YAML),
             epochs=config.TRAIN_EPOCHS,
             imgsz=config.TRAIN_IMG_SIZE,
@@ -66,10 +85,10 @@ def train():
 
         print("\n🏁 Обучение завершено!")
         
-        # Просто сообщаем путь, ничего не копируем
+        # Просто сообщаем путь, ничего не копируем: подмена models/best.pt — через проверку порогов
         best_weight = RUNS_DIR / "train_seg_run" / "weights" / "best.pt"
         print(f"👉 Лучшие веса здесь: {best_weight}")
-        print(f"👉 Если результат устраивает — скопируй этот файл в 'models/best.pt'")
+        print(f"👉 Сравнить с текущей моделью и продвинуть в 'models/best.pt': python 5_promote_model.py")
 
     except Exception as e:
         print(f"\n❌ Критическая ошибка обучения: {e}")
@@ -137,5 +156,6 @@ def plot_training_results():
     print(f"✅ График сохранен: {output_img}")
 
 if __name__ == "__main__":
+    config.setup_directories()
     train()
     plot_training_results()
\ No newline at end of file
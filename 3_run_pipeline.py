@@ -7,6 +7,7 @@ PRODUCTION PIPELINE
 """
 
 import time
+import signal
 import shutil
 import logging
 from pathlib import Path
@@ -15,13 +16,17 @@ from concurrent.futures import ThreadPoolExecutor, wait
 from tqdm import tqdm
 
 import config
-from core.pipeline_logger import setup_logger
+from core import metrics, trace, video
+from core.pipeline_logger import setup_logger, shutdown_logger
+from core.profiler import PROFILER
 from core.detector import YourClassDetector
 from core.cleaner import ImageInpainter
+from core.startup import StartupReport
 
 # === КОНФИГ ===
 SLEEP_ON_EMPTY = 60      # Секунд сна
 IO_THREADS = 4           # Потоки записи
+MEDIA_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".gif"} | config.VIDEO_SUFFIXES
 
 # === ПУТИ ===
 DIR_RESULT_CLEAN = config.OUTPUT_DIR
@@ -34,14 +39,21 @@ def setup_structure():
     for d in [DIR_RESULT_CLEAN, DIR_RESULT_SKIPPED, DIR_SOURCE_ARCHIVE]:
         d.mkdir(parents=True, exist_ok=True)
 
-def save_and_move_worker(img_result, save_path_result, img_source_path):
+def save_and_move_worker(img_result, save_path_result, img_source_path, record=None, tracer=None):
     """
     Фоновая задача: Сохранение + Перемещение.
+    record/tracer — запись трейса, дописывается временем encode и размером результата.
     """
     try:
         # 1. Сохранение результата
         if img_result and save_path_result:
+            t0 = time.perf_counter()
             img_result.save(save_path_result, quality=95, optimize=True)
+            encode_s = time.perf_counter() - t0
+            metrics.ENCODE_SECONDS.observe(encode_s)
+            if record is not None:
+                trace.add_timing(record, "encode", encode_s)
+                record["output_bytes"] = save_path_result.stat().st_size
 
         # 2. Перемещение исходника
         if img_source_path.exists():
@@ -58,6 +70,36 @@ def save_and_move_worker(img_result, save_path_result, img_source_path):
     except Exception as e:
         # Логируем, но не крашим поток
         logger.error(f"⚠️ Ошибка I/O {img_source_path.name}: {e}")
+        if record is not None:
+            record["status"] = "failed"
+            record["error"] = str(e)
+
+    if tracer is not None and record is not None:
+        tracer.write(record)
+
+def process_media(path, detector, cleaner, record) -> bool:
+    """
+    Видео / анимация: кадры идут потоком, маска переиспользуется между кейфреймами (core/video.py).
+    True — почищено, False — ватермарки не нашлось ни в одном кейфрейме (исходник копируется в skipped).
+    """
+    save_to = DIR_RESULT_CLEAN / path.name
+    t0 = time.perf_counter()
+    stats = video.process(path, save_to, detector, cleaner)
+    trace.add_timing(record, "video", time.perf_counter() - t0)
+    trace.set_size(record, stats["width"], stats["height"])
+    record.update(frames=stats["frames"], detections=stats["detections"], cleaned_frames=stats["cleaned"])
+
+    if stats["cleaned"]:
+        metrics.CLEANED_TOTAL.inc()
+        record["status"] = "cleaned"
+        return True
+
+    # Перекодированная копия без изменений не нужна — отдаем исходник как есть
+    save_to.unlink(missing_ok=True)
+    shutil.copy2(path, DIR_RESULT_SKIPPED / path.name)
+    metrics.SKIPPED_TOTAL.inc()
+    record["status"] = "skipped"
+    return False
 
 def print_summary(start_time, total_count, skipped_count):
     """Красивый вывод итогов, как ты любишь"""
@@ -76,22 +118,56 @@ def print_summary(start_time, total_count, skipped_count):
         print(f"🏎  FPS:           {fps:.1f}")
     print("=" * 40 + "\n")
 
+def on_profile_signal(signum, frame):
+    """kill -USR1 <pid> -> захват профиля на config.PROFILE_SECONDS (файлы в logs/)"""
+    seconds = PROFILER.request()
+    if seconds is None:
+        logger.info("🔬 Профилирование уже идет, сигнал проигнорирован.")
+    else:
+        logger.info(f"🔬 Профилирование запрошено на {seconds:.0f}с (старт со следующего фото).")
+
 def main():
+    config.setup_directories()
     setup_structure()
 
+    # Профилирование по сигналу (на Windows SIGUSR1 нет)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, on_profile_signal)
+
     print("\n🚀 ЗАПУСК WATCHDOG PIPELINE")
     print(f"📂 Слежу за папкой: {config.INPUT_DIR}")
     print("⏳ Загрузка нейросетей... (подожди пару секунд)")
 
     try:
-        detector = YourClassDetector()
-        cleaner = ImageInpainter()
+        # Модели грузятся параллельно (как в API)
+        startup = StartupReport()
+
+        def load(name, factory):
+            with startup.phase(f"load.{name}"):
+                model = factory()
+            metrics.MODEL_LOAD_SECONDS.labels(name).set(startup.phases[f"load.{name}"])
+            return model
+
+        with ThreadPoolExecutor(max_workers=2) as loader:
+            detector_future = loader.submit(load, "detector", YourClassDetector)
+            cleaner_future = loader.submit(load, "cleaner", ImageInpainter)
+            detector, cleaner = detector_future.result(), cleaner_future.result()
+        logger.info(startup.summary())
         logger.info("✅ Модели загружены и готовы.")
     except Exception as e:
         logger.critical(f"🔥 Ошибка запуска: {e}")
         return
 
     io_executor = ThreadPoolExecutor(max_workers=IO_THREADS)
+    tracer = trace.open_writer()
+
+    # Мониторинг: глубина очереди записи считается в момент скрейпа
+    metrics.QUEUE_DEPTH.labels("io").set_function(io_executor._work_queue.qsize)
+    input_depth = metrics.QUEUE_DEPTH.labels("input")
+    try:
+        metrics.start_http_server()
+    except OSError as e:
+        logger.error(f"⚠️ Не удалось поднять /metrics на порту {config.METRICS_PORT}: {e}")
 
     # Флаг, чтобы не спамить "Waiting..." каждую секунду
     is_waiting_message_shown = False
@@ -104,7 +180,7 @@ def main():
                 # Фильтруем файлы, игнорируем папки
                 candidates = [
                     f for f in config.INPUT_DIR.iterdir()
-                    if f.is_file() and f.suffix.lower() in {".jpg", ".jpeg", ".png", ".webp"}
+                    if f.is_file() and f.suffix.lower() in MEDIA_SUFFIXES
                 ]
             except Exception:
                 pass # Если папка заблокирована виндой, пробуем позже
@@ -116,6 +192,7 @@ def main():
                     is_waiting_message_shown = True
 
                 time.sleep(SLEEP_ON_EMPTY)
+                PROFILER.step()  # Закрыть захват, если он истек, пока спали
                 continue
 
             # Если нашли файлы - сбрасываем флаг ожидания
@@ -138,45 +215,83 @@ def main():
             # leave=False - полоска исчезнет после завершения (чтобы не засорять консоль)
             pbar = tqdm(candidates, desc="Processing", unit="img", leave=True)
 
-            for img_path in pbar:
+            for i, img_path in enumerate(pbar):
+                input_depth.set(batch_total - i)
+                PROFILER.step()
+                record = None
                 try:
+                    record = trace.new_record("pipeline", img_path.name, img_path.stat().st_size)
+
+                    if video.is_video(img_path) or video.is_animation(img_path):
+                        if not process_media(img_path, detector, cleaner, record):
+                            skipped_in_batch += 1
+                        io_futures.append(io_executor.submit(save_and_move_worker, None, None, img_path, record, tracer))
+                        continue
+
                     # ШАГ 1: Загрузка
+                    t0 = time.perf_counter()
                     with Image.open(img_path) as img:
                         original = img.convert("RGB")
                         original.load()
+                    t1 = time.perf_counter()
+                    metrics.DECODE_SECONDS.observe(t1 - t0)
+                    trace.add_timing(record, "decode", t1 - t0)
+                    trace.set_image(record, original)
 
                     # ШАГ 2: GPU Inference
-                    mask = detector.get_mask(original)
+                    mask = detector.get_mask(original, stats=record)
+                    t2 = time.perf_counter()
+                    metrics.DETECT_SECONDS.observe(t2 - t1)
+                    trace.add_timing(record, "detect", t2 - t1)
 
                     if mask.getbbox():
                         # Нашли -> Чистим
+                        record["mask_area"] = round(metrics.mask_area_ratio(mask), 5)
+                        metrics.MASK_AREA_RATIO.observe(record["mask_area"])
                         result = cleaner.clean(original, mask)
+                        t3 = time.perf_counter()
+                        metrics.CLEAN_SECONDS.observe(t3 - t2)
+                        trace.add_timing(record, "clean", t3 - t2)
+                        metrics.CLEANED_TOTAL.inc()
+                        record["status"] = "cleaned"
                         save_to = DIR_RESULT_CLEAN / img_path.name
                     else:
                         # Пусто -> Скип
                         result = original
                         save_to = DIR_RESULT_SKIPPED / img_path.name
                         skipped_in_batch += 1
+                        metrics.SKIPPED_TOTAL.inc()
+                        record["mask_area"] = 0.0
+                        record["status"] = "skipped"
 
                     # ШАГ 3: Async Save
                     future = io_executor.submit(
                         save_and_move_worker,
                         result.copy(),
                         save_to,
-                        img_path
+                        img_path,
+                        record,
+                        tracer
                     )
                     io_futures.append(future)
 
                 except Exception as e:
+                    metrics.FAILED_TOTAL.inc()
                     logger.error(f"❌ Ошибка {img_path.name}: {e}")
+                    if record is not None:
+                        record["status"] = "failed"
+                        record["error"] = str(e)
+                        tracer.write(record)
                     # При ошибке тоже пытаемся убрать файл, чтобы не виснуть
                     # (можно раскомментить перемещение в errors)
 
             pbar.close()
+            input_depth.set(0)
 
             # Ждем, пока все файлы реально допишутся на диск и переместятся
             # Это решит проблему с WinError и даст честное время выполнения
             wait(io_futures)
+            PROFILER.step()
 
             # Выводим красивую табличку итогов
             print_summary(batch_start_time, batch_total, skipped_in_batch)
@@ -187,6 +302,8 @@ def main():
     except KeyboardInterrupt:
         print("\n🛑 Останавливаемся... Дописываем файлы...")
         io_executor.shutdown(wait=True)
+        tracer.close()
+        shutdown_logger()  # Дописываем очередь логов на диск
         print("✅ Всё сохранено. Пока!")
 
 if __name__ == "__main__":
@@ -4,26 +4,243 @@ REST API Сервер для удаления ватермарок.
 """
 
 import io
+import time
+_t_start = time.perf_counter()  # Отсчет холодного старта (импорты тоже считаются)
 import asyncio
 import logging
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import Response
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
+from fastapi.responses import Response, JSONResponse, StreamingResponse, FileResponse
+from starlette.datastructures import UploadFile as StarletteUploadFile
 from PIL import Image
 
 import config
+from core import metrics, trace, bulk, jobs, codecs
+from core.pipeline_logger import setup_logger, shutdown_logger
+from core.profiler import PROFILER
+from core.scheduler import InferenceQueue, BatchScheduler, QueueFullError, DeadlineExceeded, remaining
+from core.replicas import ReplicaPool, InvalidInputError
 from core.detector import YourClassDetector
 from core.cleaner import ImageInpainter
+from core.startup import StartupReport
 
-# Настройка логгера
-logging.basicConfig(level=logging.WARNING) # WARNING чтобы не спамил INFO сообщениями
+startup = StartupReport(_t_start)
+startup.add("imports", time.perf_counter() - _t_start)
+
+# Настройка логгера (очередь + фоновая запись в logs/, как у пайплайна)
+setup_logger()
 logger = logging.getLogger("API")
-logger.setLevel(logging.INFO)
 
 # Глобальные переменные
 models = {}
-gpu_lock = asyncio.Lock() # "Светофор" для видеокарты
+tracer = trace.open_writer()  # logs/traces.jsonl
+
+class InvalidImageError(ValueError):
+    """Байты не декодируются как картинка."""
+
+def decode_image(contents) -> Image.Image:
+    """Декодирование прямо из принятого буфера (в пуле потоков: PIL отпускает GIL)."""
+    return codecs.decode(contents)
+
+# Оценка стоимости LaMa (сек на мегапиксель, EWMA): не чистим то, что не успеет к дедлайну
+clean_cost = {"per_mp": None}
+
+def run_models_batch(items: list) -> list:
+    """
+    Детекция + очистка для микро-батча [(image, record, deadline), ...].
+    Выполняется в потоке инференса. Возвращает [(результат, статус) | DeadlineExceeded, ...].
+    Время стадий в метриках/трейсе — амортизированное на фото.
+    """
+    PROFILER.step()
+    images = [image for image, _, _ in items]
+    records = [record for _, record, _ in items]
+    deadlines = [deadline for _, _, deadline in items]
+    n = len(items)
+
+    t1 = time.perf_counter()
+    masks = models["detector"].get_masks(images, stats=records)
+    t2 = time.perf_counter()
+    detect_s = (t2 - t1) / n
+
+    found = [i for i, mask in enumerate(masks) if mask.getbbox()]
+
+    # LaMa — самая дорогая стадия. Если к дедлайну она заведомо не успеет, не запускаем
+    late = set()
+    per_mp = clean_cost["per_mp"]
+    if per_mp is not None:
+        now = time.monotonic()
+        late = {i for i in found if deadlines[i] is not None and now + per_mp * records[i]["megapixels"] > deadlines[i]}
+    todo = [i for i in found if i not in late]
+
+    cleaned = []
+    if todo:
+        cleaned = models["cleaner"].clean_batch([images[i] for i in todo], [masks[i] for i in todo])
+        elapsed = time.perf_counter() - t2
+        sample = elapsed / max(sum(records[i]["megapixels"] for i in todo), 0.01)
+        clean_cost["per_mp"] = sample if per_mp is None else per_mp * 0.8 + sample * 0.2
+    clean_s = (time.perf_counter() - t2) / len(todo) if todo else 0.0
+
+    results = [(image, "skipped") for image in images]
+    for record in records:
+        metrics.DETECT_SECONDS.observe(detect_s)
+        trace.add_timing(record, "detect", detect_s)
+        record["batch_size"] = n
+        record["mask_area"] = 0.0
+    for i, result_image in zip(todo, cleaned):
+        record = records[i]
+        record["mask_area"] = round(metrics.mask_area_ratio(masks[i]), 5)
+        metrics.MASK_AREA_RATIO.observe(record["mask_area"])
+        metrics.CLEAN_SECONDS.observe(clean_s)
+        trace.add_timing(record, "clean", clean_s)
+        results[i] = (result_image, "cleaned")
+    for i in late:
+        metrics.AVOIDED_WORK.labels("clean_skipped").inc()
+        results[i] = DeadlineExceeded("Clean stage would miss the deadline")
+    return results
+
+# Модели крутятся в своем потоке (event loop свободен для I/O), запросы собираются в микро-батчи
+inference = BatchScheduler(run_models_batch)
+
+# Режим реплик (config.API_REPLICAS > 0): модели в отдельных процессах, тут только фронт
+replicas = ReplicaPool() if config.API_REPLICAS > 0 else None
+
+def model_queue():
+    """Очередь, которая сейчас обслуживает очистку (для допуска, /ready, Retry-After)."""
+    return replicas if replicas is not None else inference
+
+# Только детекция (/detect): отдельная модель и очередь — дешевые запросы не стоят за LaMa
+detection = InferenceQueue(max_pending=config.API_DETECT_MAX_QUEUE, workers=config.API_DETECT_THREADS, name="detect")
+
+def encode_image(image: Image.Image, fmt: str, quality: int = None) -> io.BytesIO:
+    return codecs.encode(image, fmt, quality)
+
+def check_deadline(deadline):
+    """Дедлайн истек — дальше не работаем (фото пишется в трейс как timeout)."""
+    if deadline is not None and remaining(deadline) <= 0:
+        metrics.AVOIDED_WORK.labels("expired").inc()
+        raise DeadlineExceeded("Deadline expired")
+
+async def wait_deadline(coro, deadline):
+    """Ждать результат не дольше дедлайна (отмена убирает элемент из очереди моделей)."""
+    if deadline is None:
+        return await coro
+    try:
+        return await asyncio.wait_for(coro, max(remaining(deadline), 0))
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded("Deadline expired while waiting for models")
+
+async def clean_contents(contents: bytes, filename: str, fmt: str, deadline=None, quality=None):
+    """
+    Полный цикл для одного фото: decode -> очередь моделей -> encode (fmt/quality — см. core/codecs.py).
+    deadline (time.monotonic()) — после него работа прекращается: DeadlineExceeded.
+    Возвращает (BytesIO, статус). Бросает InvalidImageError / QueueFullError / DeadlineExceeded.
+    """
+    record = trace.new_record("api", filename, len(contents))
+    try:
+        if replicas is not None:
+            return await clean_contents_replica(contents, record, fmt, deadline, quality)
+        return await clean_contents_local(contents, record, fmt, deadline, quality)
+    except DeadlineExceeded:
+        metrics.TIMEOUT_TOTAL.inc()
+        record["status"] = "timeout"
+        tracer.write(record)
+        raise
+
+async def clean_contents_local(contents: bytes, record: dict, fmt: str, deadline, quality):
+    check_deadline(deadline)
+    t0 = time.perf_counter()
+    try:
+        image = await asyncio.to_thread(decode_image, contents)
+    except Exception:
+        metrics.FAILED_TOTAL.inc()
+        record["status"] = "failed"
+        record["error"] = "invalid image"
+        tracer.write(record)
+        raise InvalidImageError(record["file"])
+    decode_s = time.perf_counter() - t0
+    metrics.DECODE_SECONDS.observe(decode_s)
+    trace.add_timing(record, "decode", decode_s)
+    trace.set_image(record, image)
+
+    # Очередь инференса (event loop не блокируется)
+    result_image, processing_status = await wait_deadline(
+        inference.submit((image, record, deadline), deadline), deadline
+    )
+    check_deadline(deadline)
+
+    t4 = time.perf_counter()
+    img_byte_arr = await asyncio.to_thread(encode_image, result_image, fmt, quality)
+    encode_s = time.perf_counter() - t4
+    metrics.ENCODE_SECONDS.observe(encode_s)
+
+    if processing_status == "cleaned":
+        metrics.CLEANED_TOTAL.inc()
+    else:
+        metrics.SKIPPED_TOTAL.inc()
+
+    trace.add_timing(record, "encode", encode_s)
+    record["status"] = processing_status
+    record["output_bytes"] = img_byte_arr.tell()
+    tracer.write(record)
+    return img_byte_arr, processing_status
+
+async def run_job(contents: bytes, job: dict):
+    """Обработка одной задачи /jobs. Очередь моделей общая с /process: при 503 ждем место."""
+    while True:
+        try:
+            img_byte_arr, status = await clean_contents(contents, job["filename"], job["fmt"])
+            return img_byte_arr.getbuffer(), status
+        except QueueFullError as e:
+            await asyncio.sleep(min(e.retry_after, 1))
+        except InvalidImageError:
+            raise ValueError("File is not a valid image.")
+
+# Асинхронные задачи: sqlite + файлы в jobs/, переживают рестарт
+job_runner = None
+
+async def clean_contents_replica(contents: bytes, record: dict, fmt: str, deadline, quality):
+    """То же, что clean_contents_local, но decode/модели/encode целиком в процессе-реплике."""
+    check_deadline(deadline)
+    try:
+        data, processing_status, stats = await wait_deadline(replicas.submit(contents, fmt, deadline, quality), deadline)
+    except InvalidInputError:
+        metrics.FAILED_TOTAL.inc()
+        record["status"] = "failed"
+        record["error"] = "invalid image"
+        tracer.write(record)
+        raise InvalidImageError(record["file"])
+
+    trace.set_size(record, stats["width"], stats["height"])
+    stage_metrics = {
+        "decode": metrics.DECODE_SECONDS, "detect": metrics.DETECT_SECONDS,
+        "clean": metrics.CLEAN_SECONDS, "encode": metrics.ENCODE_SECONDS,
+    }
+    for stage, seconds in stats["timings"].items():
+        stage_metrics[stage].observe(seconds)
+        trace.add_timing(record, stage, seconds)
+    if processing_status == "cleaned":
+        metrics.CLEANED_TOTAL.inc()
+        metrics.MASK_AREA_RATIO.observe(stats["mask_area"])
+    else:
+        metrics.SKIPPED_TOTAL.inc()
+
+    for key in ("components", "mask_area", "batch_size"):
+        if key in stats:
+            record[key] = stats[key]
+    record["status"] = processing_status
+    record["output_bytes"] = len(data)
+    tracer.write(record)
+
+    img_byte_arr = io.BytesIO(data)
+    img_byte_arr.seek(0, io.SEEK_END)  # Как у encode_image: tell() = размер
+    return img_byte_arr, processing_status
+
+def warmup():
+    """Прогоняем фейк, чтобы прогрузить CUDA контекст (в потоке инференса)."""
+    dummy = Image.new("RGB", (640, 640), (128, 128, 128))
+    m = models["detector"].get_mask(dummy)
+    if m.getbbox(): models["cleaner"].clean(dummy, m)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -32,18 +249,47 @@ async def lifespan(app: FastAPI):
     logger.info(f"   Device: {config.DEVICE}")
     
     try:
-        # 1. Загрузка
-        models["detector"] = YourClassDetector()
-        models["cleaner"] = ImageInpainter()
-        
-        # 2. Прогрев (Warmup)
-        # Прогоняем фейк, чтобы прогрузить CUDA контекст
+        config.setup_directories()
+
+        # 1. Загрузка: модели грузятся параллельно в потоках (чтение весов, перенос на GPU,
+        # оптимизация LaMa перекрываются), а не одна за другой
+        async def load(name, factory):
+            def run():
+                with startup.phase(f"load.{name}"):
+                    return factory()
+            models[name] = await asyncio.to_thread(run)
+            metrics.MODEL_LOAD_SECONDS.labels(name).set(startup.phases[f"load.{name}"])
+
+        async def start_replicas():
+            logger.info(f"🧩 Запуск {config.API_REPLICAS} реплик моделей...")
+            with startup.phase("load.replicas"):
+                await replicas.start()
+            metrics.MODEL_LOAD_SECONDS.labels("replicas").set(startup.phases["load.replicas"])
+
+        loaders = [load("detect_only", YourClassDetector)]
+        if replicas is None:
+            loaders += [load("detector", YourClassDetector), load("cleaner", ImageInpainter)]
+        else:
+            loaders.append(start_replicas())
+        with startup.phase("load"):
+            await asyncio.gather(*loaders)
+
+        # 2. Прогрев (Warmup): поток инференса и поток /detect — одновременно
         logger.info("🌡️ Warming up GPU...")
-        dummy = Image.new("RGB", (640, 640), (128, 128, 128))
-        async with gpu_lock:
-            m = models["detector"].get_mask(dummy)
-            if m.getbbox(): models["cleaner"].clean(dummy, m)
-            
+        with startup.phase("warmup"):
+            warmups = [detection.run_in_worker(models["detect_only"].get_mask, Image.new("RGB", (640, 640), (128, 128, 128)))]
+            if replicas is None:
+                warmups.append(inference.run_in_worker(warmup))
+            await asyncio.gather(*warmups)
+        inference.start()
+
+        # 3. Очередь задач (недоделанные до рестарта — снова в очередь)
+        global job_runner
+        with startup.phase("jobs"):
+            job_runner = jobs.JobRunner(jobs.JobStore(), run_job)
+            await job_runner.start()
+
+        logger.info(startup.summary())
         logger.info("✅ SERVER READY! Listening on port 8000.")
         
     except Exception as e:
@@ -52,56 +298,390 @@ async def lifespan(app: FastAPI):
         
     yield
     
+    await job_runner.stop()
+    await inference.stop()
+    if replicas is not None:
+        await replicas.stop()
+    detection.shutdown()
     models.clear()
+    tracer.close()
     logger.info("🛑 Server Stopped.")
+    shutdown_logger()
 
 app = FastAPI(lifespan=lifespan)
 
-@app.post("/process")
-async def process_image(file: UploadFile = File(...)):
-    # 1. Валидация типа файла
-    if file.content_type not in ["image/jpeg", "image/png", "image/webp"]:
+@app.get("/health")
+async def health():
+    """Liveness: event loop жив и отвечает."""
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness: модели загружены и очередь не переполнена.
+    503 -> балансировщику стоит слать запросы на другие реплики.
+    """
+    queue = model_queue()
+    loaded = replicas.ready if replicas is not None else bool(models)
+    body = {
+        "ready": loaded and not queue.is_full,
+        "queue_depth": queue.pending,
+        "queue_limit": queue.max_pending,
+    }
+    if not body["ready"]:
+        return JSONResponse(status_code=503, content=body, headers={"Retry-After": str(queue.retry_after())})
+    return body
+
+@app.get("/metrics")
+async def get_metrics():
+    """Метрики в формате Prometheus"""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.post("/debug/profile")
+async def debug_profile(seconds: float = None):
+    """
+    Захват профиля на N секунд (torch.profiler + cProfile -> logs/).
+    Сервер продолжает обслуживать запросы: ждем через asyncio.sleep.
+    Профилируется поток инференса этого процесса — в режиме реплик моделей в нем нет: 501.
+    """
+    if not config.API_DEBUG_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if replicas is not None:
+        raise HTTPException(status_code=501, detail="Profiling is not available with API_REPLICAS > 0: "
+                                                    "models run in replica processes.")
+
+    seconds = PROFILER.request(seconds)
+    if seconds is None:
+        raise HTTPException(status_code=409, detail="Profiling already in progress.")
+
+    # cProfile привязан к потоку: старт и стоп — в потоке инференса
+    await inference.run_in_worker(PROFILER.step)
+    await asyncio.sleep(seconds)
+    result = await inference.run_in_worker(PROFILER.finish) or {}
+    return {"seconds": seconds, "files": result}
+
+class ClientDisconnected(Exception):
+    """Клиент закрыл соединение, не дождавшись ответа."""
+
+def request_deadline(request: Request):
+    """
+    Дедлайн запроса в шкале time.monotonic():
+    заголовок X-Request-Deadline-Ms (бюджет в мс от начала обработки) или config.API_DEFAULT_DEADLINE_MS.
+    """
+    raw = request.headers.get("x-request-deadline-ms")
+    budget_ms = config.API_DEFAULT_DEADLINE_MS
+    if raw is not None:
+        try:
+            budget_ms = float(raw)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="X-Request-Deadline-Ms must be a number.")
+        if budget_ms <= 0:
+            raise HTTPException(status_code=400, detail="X-Request-Deadline-Ms must be positive.")
+    return None if budget_ms is None else time.monotonic() + budget_ms / 1000
+
+async def until_disconnected(request: Request, coro):
+    """
+    Выполняет coro, пока клиент на связи. Клиент ушел — задача отменяется:
+    фото выпадает из очереди моделей, а не обрабатывается впустую.
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=0.5)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+
+async def read_upload(request: Request, filename: str = None):
+    """
+    Тело /process -> (bytes, имя, MIME входа).
+    multipart/form-data с полем file ИЛИ сырое тело image/jpeg|png|webp
+    (без multipart-парсинга и временного файла — буфер сразу идет в декодер).
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == "multipart/form-data":
+        async with request.form(max_files=1) as form:
+            file = form.get("file")
+            if not isinstance(file, StarletteUploadFile):
+                raise HTTPException(status_code=400, detail="Missing 'file' field.")
+            if file.content_type not in codecs.INPUT_TYPES:
+                raise HTTPException(status_code=400, detail="Invalid file type. Only jpg/png/webp.")
+            return await file.read(), file.filename, file.content_type
+
+    if content_type not in codecs.INPUT_TYPES:
         raise HTTPException(status_code=400, detail="Invalid file type. Only jpg/png/webp.")
+    return await request.body(), filename or "upload" + codecs.FORMATS[content_type][1], content_type
+
+@app.post("/process")
+async def process_image(request: Request, filename: str = None):
+    """
+    Вход: multipart (поле file) или сырое тело image/* (?filename= — для логов/трейса).
+    Выход: формат по Accept (image/webp;quality=80, image/jpeg, image/png), по умолчанию — формат входа.
+    """
+    deadline = request_deadline(request)
 
     try:
-        # 2. Чтение (RAM)
-        contents = await file.read()
+        # 1. Чтение (RAM) + валидация типа файла
+        contents, filename, content_type = await read_upload(request, filename)
+
+        # 2. Формат ответа
         try:
-            image = Image.open(io.BytesIO(contents)).convert("RGB")
-        except Exception:
+            fmt, mime, _, quality = codecs.negotiate(request.headers.get("accept"), filename, content_type)
+        except codecs.NotAcceptable:
+            raise HTTPException(status_code=406, detail="Acceptable output types: image/webp, image/jpeg, image/png.")
+
+        # 3. Обработка
+        try:
+            img_byte_arr, processing_status = await until_disconnected(
+                request, clean_contents(contents, filename, fmt, deadline, quality)
+            )
+        except InvalidImageError:
             raise HTTPException(status_code=400, detail="File is not a valid image.")
 
-        # 3. Обработка (с блокировкой GPU)
-        processing_status = "skipped"
-        result_image = image
-
-        # Ждем очереди на GPU
-        async with gpu_lock:
-            mask = models["detector"].get_mask(image)
-            
-            if mask.getbbox():
-                result_image = models["cleaner"].clean(image, mask)
-                processing_status = "cleaned"
-            
-        # 4. Ответ
-        img_byte_arr = io.BytesIO()
-        # Сохраняем формат (если JPEG - то JPEG, иначе PNG)
-        fmt = "JPEG" if file.content_type == "image/jpeg" else "PNG"
-        result_image.save(img_byte_arr, format=fmt, quality=95)
-        
+        # 4. Ответ: memoryview над буфером энкодера, без копии в bytes
         return Response(
-            content=img_byte_arr.getvalue(), 
-            media_type=file.content_type,
-            headers={"Clean-Status": processing_status}
+            content=img_byte_arr.getbuffer(),
+            media_type=mime,
+            headers={"Clean-Status": processing_status, "Vary": "Accept"}
         )
 
     except HTTPException as he:
         raise he
+    except ClientDisconnected:
+        return Response(status_code=499)  # Ответ уже никто не прочитает
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded.")
+    except QueueFullError as e:
+        metrics.IMAGES_TOTAL.labels("rejected").inc()
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, retry later.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
     except Exception as e:
+        metrics.FAILED_TOTAL.inc()
         logger.error(f"Internal Error: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+@app.post("/jobs", status_code=202)
+async def create_job(request: Request, file: UploadFile = File(...), webhook: str = Form(None)):
+    """
+    Асинхронная обработка: сразу отвечаем ID, фото ждет в персистентной очереди.
+    Статус — GET /jobs/{id}, результат — GET /jobs/{id}/result.
+    webhook (необязательно): URL, на который придет POST с JSON статуса по завершении.
+    """
+    if file.content_type not in codecs.INPUT_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid file type. Only jpg/png/webp.")
+    if webhook and not webhook.startswith(("http://", "https://")):
+        raise HTTPException(status_code=400, detail="Webhook must be an http(s) URL.")
+
+    if job_runner.store.queued >= config.API_JOB_MAX_QUEUED:
+        metrics.IMAGES_TOTAL.labels("rejected").inc()
+        raise HTTPException(
+            status_code=503,
+            detail="Job queue is full, retry later.",
+            headers={"Retry-After": str(model_queue().retry_after())},
+        )
+
+    contents = await file.read()
+    fmt, mime, ext = codecs.default_output(file.filename or "image", file.content_type)
+    job_id = await job_runner.submit(
+        contents, file.filename, fmt, mime, ext, webhook=webhook, base_url=str(request.base_url)
+    )
+    return {"id": job_id, "status": jobs.QUEUED, "status_url": f"/jobs/{job_id}"}
+
+async def get_job_or_404(job_id: str) -> dict:
+    job = await asyncio.to_thread(job_runner.store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found (unknown or expired).")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Статус задачи: queued / running / done / failed."""
+    return jobs.describe(await get_job_or_404(job_id))
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """Готовое фото (Clean-Status в заголовке). 409, пока задача не завершена."""
+    job = await get_job_or_404(job_id)
+    if job["status"] == jobs.FAILED:
+        raise HTTPException(status_code=422, detail=job["error"] or "Job failed.")
+    if job["status"] != jobs.DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}.")
+
+    path = job_runner.store.result_path(job_id, job["result_ext"])
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="Result expired.")
+    return FileResponse(path, media_type=job["mime"], headers={"Clean-Status": job["clean_status"] or ""})
+
+def detect_image(contents: bytes, original_size, rle: bool) -> dict:
+    """decode + детекция (в потоке очереди /detect)."""
+    t0 = time.perf_counter()
+    try:
+        image = decode_image(contents)
+    except Exception:
+        raise InvalidImageError()
+    body = models["detect_only"].detect(image, original_size=original_size, rle=rle)
+    metrics.STAGE_SECONDS.labels("detect_only").observe(time.perf_counter() - t0)
+    return body
+
+@app.post("/detect")
+async def detect(
+    file: UploadFile = File(...),
+    original_width: int = Form(None),
+    original_height: int = Form(None),
+    rle: bool = Form(False),
+):
+    """
+    Только детекция, без очистки: есть ли ватермарка и где.
+    Можно прислать уменьшенную копию + original_width/original_height —
+    полигоны и bbox вернутся в координатах оригинала.
+    rle=true — дополнительно маска в COCO RLE (size=[h, w], counts по столбцам).
+    """
+    if file.content_type not in codecs.INPUT_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid file type. Only jpg/png/webp.")
+    if (original_width is None) != (original_height is None):
+        raise HTTPException(status_code=400, detail="Pass both original_width and original_height.")
+    original_size = None
+    if original_width is not None:
+        if original_width <= 0 or original_height <= 0:
+            raise HTTPException(status_code=400, detail="Original size must be positive.")
+        original_size = (original_width, original_height)
+
+    contents = await file.read()
+    try:
+        return await detection.submit(detect_image, contents, original_size, rle)
+    except InvalidImageError:
+        raise HTTPException(status_code=400, detail="File is not a valid image.")
+    except QueueFullError as e:
+        metrics.IMAGES_TOTAL.labels("rejected").inc()
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, retry later.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except Exception as e:
+        logger.error(f"Detect Error: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.post("/process/bulk")
+async def process_bulk(request: Request):
+    """
+    Много фото за один запрос (меньше HTTP round-trip и парсинга multipart на фото).
+    Вход: multipart с несколькими файлами ИЛИ тело-архив (application/zip, application/x-tar, tar.gz).
+    Выход: zip (по умолчанию) или multipart/mixed (Accept: multipart/mixed).
+    Файлы идут через тот же микро-батчинг и отдаются потоком по мере готовности.
+    Статус каждого файла (Clean-Status) — в manifest.json последним элементом ответа.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if model_queue().is_full:
+        metrics.IMAGES_TOTAL.labels("rejected").inc()
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, retry later.",
+            headers={"Retry-After": str(model_queue().retry_after())},
+        )
+
+    # 1. Список элементов: (имя, async read(), content-type)
+    items = []
+    form = None
+    if content_type == "multipart/form-data":
+        form = await request.form(max_files=config.API_BULK_MAX_ITEMS + 1)
+        for _, value in form.multi_items():
+            if isinstance(value, StarletteUploadFile):
+                items.append((value.filename or "image", value.read, value.content_type))
+    elif content_type in bulk.ZIP_TYPES | bulk.TAR_TYPES:
+        body = await request.body()
+        try:
+            # tar читается целиком за один проход (TarFile не потокобезопасен) — не в event loop
+            archive = await asyncio.to_thread(lambda: list(bulk.iter_archive(body, content_type)))
+            for name, read in archive:
+                items.append((name, lambda read=read: asyncio.to_thread(read), None))
+        except bulk.ArchiveError:
+            raise HTTPException(status_code=400, detail="Body is not a valid zip/tar archive.")
+    else:
+        raise HTTPException(status_code=415, detail="Use multipart/form-data or a zip/tar body.")
+
+    if not items or len(items) > config.API_BULK_MAX_ITEMS:
+        if form is not None:
+            await form.close()
+        if not items:
+            raise HTTPException(status_code=400, detail="No images found in request.")
+        raise HTTPException(status_code=413, detail=f"Too many images (max {config.API_BULK_MAX_ITEMS}).")
+
+    writer = bulk.MultipartStream() if "multipart/mixed" in request.headers.get("accept", "") else bulk.ZipStream()
+    unique = bulk.UniqueNames()
+    work_items = []
+    for name, read, item_type in items:
+        fmt, mime, ext = codecs.default_output(name, item_type)
+        stem = name.replace("\\", "/").rsplit("/", 1)[-1].rsplit(".", 1)[0] or "image"
+        work_items.append((name, unique(stem + ext), read, fmt, mime))
+
+    async def run_item(name, out_name, read, fmt, mime):
+        entry = {"name": name, "output": out_name}
+        try:
+            contents = await read()
+            while True:
+                try:
+                    img_byte_arr, status = await clean_contents(contents, name, fmt)
+                    break
+                except QueueFullError as e:
+                    # Запрос уже принят — не отказываем, а ждем место в очереди
+                    await asyncio.sleep(min(e.retry_after, 1))
+            entry["status"] = status
+            entry["bytes"] = img_byte_arr.tell()
+            return entry, img_byte_arr.getbuffer(), mime
+        except InvalidImageError:
+            entry["status"] = "failed"
+            entry["error"] = "File is not a valid image."
+        except Exception as e:
+            metrics.FAILED_TOTAL.inc()
+            logger.error(f"Bulk item error {name}: {e}")
+            entry["status"] = "failed"
+            entry["error"] = "Internal Server Error"
+        return entry, None, None
+
+    async def stream():
+        # Не больше API_BULK_INFLIGHT фото одного запроса в очереди одновременно
+        slots = asyncio.Semaphore(config.API_BULK_INFLIGHT)
+
+        async def guarded(item):
+            async with slots:
+                return await run_item(*item)
+
+        tasks = [asyncio.create_task(guarded(item)) for item in work_items]
+        manifest = []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                entry, data, mime = await next_done
+                manifest.append(entry)
+                if data is not None:
+                    yield writer.add(entry["output"], data, entry["status"], mime)
+            yield writer.finish(manifest)
+        finally:
+            # Клиент отвалился посреди ответа — не тратим модели на остаток
+            for task in tasks:
+                task.cancel()
+            if form is not None:
+                # Временные файлы загрузки (SpooledTemporaryFile) — сразу, а не при сборке мусора
+                try:
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                finally:
+                    await form.close()
+
+    headers = {}
+    if isinstance(writer, bulk.ZipStream):
+        headers["Content-Disposition"] = 'attachment; filename="cleaned.zip"'
+    return StreamingResponse(stream(), media_type=writer.media_type, headers=headers)
+
 if __name__ == "__main__":
     import uvicorn
-    # Запуск: workers=1, так как у нас 1 GPU и мы держим модели в памяти
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="error")
\ No newline at end of file
+    # Запуск: workers=1, так как у нас 1 GPU и мы держим модели в памяти.
+    # На CPU-хосте ядра загружает config.API_REPLICAS (процессы-реплики), а не uvicorn workers
+    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="error")
@@ -0,0 +1,108 @@
+"""
+Продвижение обученной модели в models/best.pt (вместо ручного копирования).
+
+Кандидат (по умолчанию — best.pt последнего 2_train_model.py) сравнивается с текущей
+config.YOLO_MODEL_PATH: mAP масок и CPU-латентность p50/p95 на отложенной выборке
+config.PROMOTE_HOLDOUT_DIR (core/promotion.py; нет — собирается при первом запуске и дальше заморожена).
+Пороги — config.PROMOTE_*. Прошел — атомарная подмена, прежняя модель остается в best.prev.pt.
+
+Запуск: python 5_promote_model.py
+        python 5_promote_model.py --dry-run             # только отчет
+        python 5_promote_model.py --candidate path.pt --force
+        python 5_promote_model.py --rollback            # вернуть предыдущую модель
+        python 5_promote_model.py --rebuild-holdout     # пересобрать holdout (сравнение с прошлым не засчитается)
+"""
+
+import os
+import sys
+import argparse
+import logging
+from pathlib import Path
+
+import config
+from core import promotion
+
+# Фикс для ошибки OpenMP
+os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
+
+CANDIDATE_PATH = Path("runs/segment") / "train_seg_run" / "weights" / "best.pt"
+
+
+def print_report(report: dict):
+    print(f"\n{'модель':<10} {'mAP50-95':>9} {'mAP50':>7} {'P':>6} {'R':>6} {'imgsz':>6} {'p50, мс':>8} {'p95, мс':>8}")
+    for name in ("candidate", "deployed"):
+        r = report[name]
+        if r is None:
+            continue
+        a, lat = r["accuracy"], r["latency"]
+        print(f"{name:<10} {a['map50_95']:>9.4f} {a['map50']:>7.4f} {a['precision']:>6.3f} {a['recall']:>6.3f} "
+              f"{lat['imgsz']:>6} {lat['p50_ms']:>8.1f} {lat['p95_ms']:>8.1f}")
+
+
+def promote(candidate: Path, dry_run: bool = False, force: bool = False, rebuild_holdout: bool = False) -> bool:
+    print(f"🏅 ПРОДВИЖЕНИЕ МОДЕЛИ")
+    print("=" * 40)
+    if not candidate.exists():
+        print(f"❌ Нет кандидата: {candidate}")
+        print("   👉 Сначала обучи модель (2_train_model.py)")
+        return False
+    if not config.WATERMARK_SOURCE.exists():
+        print(f"❌ Нет файла {config.WATERMARK_SOURCE}: не из чего собрать holdout")
+        return False
+    if rebuild_holdout or not promotion.DATA_YAML.exists():
+        print(f"🧱 Собираю holdout: {config.PROMOTE_HOLDOUT_DIR} ({config.PROMOTE_HOLDOUT_SIZE} примеров, сид {config.PROMOTE_HOLDOUT_SEED})")
+        promotion.build_holdout()
+
+    print(f"🧪 Кандидат: {candidate}")
+    print(f"🧪 Текущая:  {config.YOLO_MODEL_PATH}")
+    report = promotion.evaluate(candidate)
+    print(f"🧾 Holdout: {config.PROMOTE_HOLDOUT_DIR} (хэш {report['holdout']['hash']})")
+    print_report(report)
+
+    checks = promotion.check(report)
+    print()
+    for name, passed, detail in checks:
+        print(f"{'✅' if passed else '❌'} {name}: {detail}")
+    passed = all(ok for _, ok, _ in checks)
+
+    if dry_run:
+        print(f"\n🔍 Dry run: {'прошел бы' if passed else 'не прошел бы'}, ничего не меняю")
+        return passed
+    if not passed and not force:
+        print(f"\n⛔ Пороги не пройдены — {config.YOLO_MODEL_PATH.name} не тронут (--force — продвинуть все равно)")
+        return False
+    if not passed:
+        print("\n⚠️ Пороги не пройдены, но --force")
+
+    target = promotion.promote(candidate, report)
+    print(f"\n🚀 Продвинуто: {target}")
+    if promotion.prev_path(target).exists():
+        print(f"↩️ Предыдущая: {promotion.prev_path(target)} (откат: python 5_promote_model.py --rollback)")
+    print("👉 Перезапусти пайплайн/API, чтобы они подхватили новую модель")
+    return True
+
+
+def rollback() -> bool:
+    try:
+        target = promotion.rollback()
+    except FileNotFoundError as e:
+        print(f"❌ {e}")
+        return False
+    print(f"↩️ Откат выполнен: {target} <-> {promotion.prev_path(target)}")
+    print("👉 Перезапусти пайплайн/API, чтобы они подхватили модель")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Продвижение модели в models/best.pt")
+    parser.add_argument("--candidate", type=Path, default=CANDIDATE_PATH, help="Веса-кандидат")
+    parser.add_argument("--dry-run", action="store_true", help="Только сравнить, ничего не менять")
+    parser.add_argument("--force", action="store_true", help="Продвинуть, даже если пороги не пройдены")
+    parser.add_argument("--rollback", action="store_true", help="Поменять местами best.pt и best.prev.pt")
+    parser.add_argument("--rebuild-holdout", action="store_true", help="Пересобрать отложенную выборку")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    config.setup_directories()
+    ok = rollback() if args.rollback else promote(args.candidate, args.dry_run, args.force, args.rebuild_holdout)
+    sys.exit(0 if ok else 1)
@@ -20,7 +20,7 @@ def benchmark_speed():
         print(f"❌ ОШИБКА: Не найден файл модели {config.YOLO_MODEL_PATH.name}")
         print(f"   Путь: {config.YOLO_MODEL_PATH}")
         print("   👉 Сначала обучи модель (2_train_model.py)")
-        print("   👉 И скопируй best.pt из runs/.../weights/ в models/best.pt")
+        print("   👉 И продвинь ее в models/best.pt (5_promote_model.py)")
         print("!"*50 + "\n")
         return
 
@@ -0,0 +1,218 @@
+"""
+Разбор трейсов обработки (logs/traces.jsonl).
+
+Отвечает на вопрос "на что уходит время":
+* Перцентили по стадиям (decode / detect / clean / encode / total).
+* Разбивка времени по стадиям (доля от общего).
+* Самые медленные файлы.
+* Регрессия "время ~ мегапиксели" + файлы, которые сильно медленнее прогноза.
+* Классы изображений (размер x статус) и их доля во времени обработки.
+
+Запуск:
+    python benchmarks/5_analyze_traces.py
+    python benchmarks/5_analyze_traces.py logs/traces.jsonl --top 20 --source api
+"""
+
+import sys
+import json
+import argparse
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+import config
+
+STAGES = ["decode", "detect", "clean", "encode"]
+PERCENTILES = [50, 90, 95, 99]
+
+# Классы по размеру (мегапиксели)
+MP_CLASSES = [(0, 1, "<1MP"), (1, 4, "1-4MP"), (4, 12, "4-12MP"), (12, float("inf"), ">12MP")]
+
+
+def load_traces(path: Path, source=None):
+    records = []
+    bad_lines = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line: continue
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                bad_lines += 1  # Оборванная строка (процесс убили посреди записи)
+                continue
+            if source and rec.get("source") != source: continue
+            records.append(rec)
+    if bad_lines:
+        print(f"⚠️ Пропущено битых строк: {bad_lines}")
+    return records
+
+
+def percentile(values, p):
+    """Линейная интерполяция (как numpy.percentile по умолчанию)."""
+    if not values:
+        return 0.0
+    data = sorted(values)
+    k = (len(data) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(data) - 1)
+    return data[lo] + (data[hi] - data[lo]) * (k - lo)
+
+
+def linear_fit(xs, ys):
+    """y = a*x + b методом наименьших квадратов. Возвращает (a, b, r2)."""
+    n = len(xs)
+    if n < 2:
+        return 0.0, 0.0, 0.0
+    mx = sum(xs) / n
+    my = sum(ys) / n
+    sxx = sum((x - mx) ** 2 for x in xs)
+    sxy = sum((x - mx) * (y - my) for x, y in zip(xs, ys))
+    if sxx == 0:
+        return 0.0, my, 0.0
+    a = sxy / sxx
+    b = my - a * mx
+    ss_tot = sum((y - my) ** 2 for y in ys)
+    ss_res = sum((y - (a * x + b)) ** 2 for x, y in zip(xs, ys))
+    r2 = 1 - ss_res / ss_tot if ss_tot > 0 else 0.0
+    return a, b, r2
+
+
+def mp_class(mp):
+    for lo, hi, name in MP_CLASSES:
+        if lo <= mp < hi:
+            return name
+    return "?"
+
+
+def report_overview(records):
+    statuses = {}
+    backends = {}
+    for r in records:
+        statuses[r.get("status", "?")] = statuses.get(r.get("status", "?"), 0) + 1
+        backends[r.get("backend", "?")] = backends.get(r.get("backend", "?"), 0) + 1
+    print(f"📦 Записей: {len(records)}")
+    print("   Статусы: " + ", ".join(f"{k}={v}" for k, v in sorted(statuses.items())))
+    print("   Бэкенды: " + ", ".join(f"{k}={v}" for k, v in sorted(backends.items())))
+
+
+def report_percentiles(records):
+    print("\n⏱  ПЕРЦЕНТИЛИ (ms)")
+    header = f"{'STAGE':<8} | {'N':>6} | " + " | ".join(f"{'p' + str(p):>8}" for p in PERCENTILES) + f" | {'MAX':>8}"
+    print(header)
+    print("-" * len(header))
+    for stage in STAGES + ["total"]:
+        if stage == "total":
+            values = [r["total_ms"] for r in records if "total_ms" in r]
+        else:
+            values = [r["timings_ms"][stage] for r in records if stage in r.get("timings_ms", {})]
+        if not values: continue
+        cols = " | ".join(f"{percentile(values, p):8.1f}" for p in PERCENTILES)
+        print(f"{stage:<8} | {len(values):>6} | {cols} | {max(values):8.1f}")
+
+
+def report_breakdown(records):
+    print("\n🧩 РАЗБИВКА ВРЕМЕНИ ПО СТАДИЯМ")
+    totals = {s: 0.0 for s in STAGES}
+    for r in records:
+        for stage, ms in r.get("timings_ms", {}).items():
+            if stage in totals:
+                totals[stage] += ms
+    grand = sum(totals.values())
+    if grand <= 0:
+        print("   Нет данных.")
+        return
+    for stage in STAGES:
+        share = totals[stage] / grand * 100
+        bar = "█" * int(share / 2)
+        print(f"   {stage:<8} {totals[stage] / 1000:9.1f} s  {share:5.1f}%  {bar}")
+
+
+def report_slowest(records, top):
+    print(f"\n🐢 САМЫЕ МЕДЛЕННЫЕ ({top})")
+    slow = sorted((r for r in records if "total_ms" in r), key=lambda r: r["total_ms"], reverse=True)[:top]
+    for r in slow:
+        t = r.get("timings_ms", {})
+        stages = " ".join(f"{s}={t[s]:.0f}" for s in STAGES if s in t)
+        print(f"   {r['total_ms']:8.1f} ms | {r.get('megapixels', 0):6.2f} MP | {r.get('status', '?'):<8} | "
+              f"{str(r.get('file'))[:40]:<40} | {stages}")
+
+
+def report_regression(records, top):
+    print("\n📐 ВРЕМЯ ~ МЕГАПИКСЕЛИ (ms = a * MP + b)")
+    rows = [r for r in records if r.get("megapixels") and "total_ms" in r and r.get("status") != "failed"]
+    if len(rows) < 2:
+        print("   Мало данных.")
+        return
+
+    xs = [r["megapixels"] for r in rows]
+    for stage in STAGES + ["total"]:
+        pairs = [(r["megapixels"], r["total_ms"] if stage == "total" else r["timings_ms"].get(stage))
+                 for r in rows]
+        pairs = [(x, y) for x, y in pairs if y is not None]
+        if len(pairs) < 2: continue
+        a, b, r2 = linear_fit([p[0] for p in pairs], [p[1] for p in pairs])
+        print(f"   {stage:<8} a={a:8.2f} ms/MP  b={b:8.1f} ms  R²={r2:.3f}  (N={len(pairs)})")
+
+    # Выбросы: кто медленнее прогноза сильнее всех (по total)
+    a, b, _ = linear_fit(xs, [r["total_ms"] for r in rows])
+    outliers = sorted(rows, key=lambda r: r["total_ms"] - (a * r["megapixels"] + b), reverse=True)[:top]
+    print(f"\n   Медленнее прогноза ({len(outliers)}):")
+    for r in outliers:
+        expected = a * r["megapixels"] + b
+        print(f"   {r['total_ms']:8.1f} ms (ожидалось {expected:7.1f}) | {r['megapixels']:6.2f} MP | "
+              f"comp={r.get('components', '-')} | {str(r.get('file'))[:40]}")
+
+
+def report_classes(records):
+    print("\n🗂  КЛАССЫ ИЗОБРАЖЕНИЙ (размер x статус)")
+    groups = {}
+    for r in records:
+        if "total_ms" not in r: continue
+        key = (mp_class(r.get("megapixels", 0)), r.get("status", "?"))
+        g = groups.setdefault(key, [])
+        g.append(r["total_ms"])
+
+    grand = sum(sum(v) for v in groups.values())
+    if grand <= 0:
+        print("   Нет данных.")
+        return
+
+    print(f"   {'CLASS':<16} | {'N':>6} | {'MEAN ms':>8} | {'p95 ms':>8} | {'TIME %':>6}")
+    order = sorted(groups.items(), key=lambda kv: sum(kv[1]), reverse=True)
+    for (size, status), values in order:
+        share = sum(values) / grand * 100
+        print(f"   {size + ' ' + status:<16} | {len(values):>6} | {sum(values) / len(values):8.1f} | "
+              f"{percentile(values, 95):8.1f} | {share:5.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Анализ logs/traces.jsonl")
+    parser.add_argument("path", nargs="?", default=str(config.TRACE_LOG_PATH), help="Файл трейсов")
+    parser.add_argument("--top", type=int, default=10, help="Сколько файлов показывать в топах")
+    parser.add_argument("--source", choices=["pipeline", "api"], default=None, help="Фильтр по источнику")
+    args = parser.parse_args()
+
+    path = Path(args.path)
+    if not path.exists():
+        print(f"❌ Нет файла {path}. Трейсы пишут 3_run_pipeline.py и 4_api_pipeline.py (config.TRACE_ENABLED).")
+        return
+
+    records = load_traces(path, args.source)
+    if not records:
+        print("❌ Трейсы пусты.")
+        return
+
+    print("=" * 60)
+    report_overview(records)
+    report_percentiles(records)
+    report_breakdown(records)
+    report_slowest(records, args.top)
+    report_regression(records, args.top)
+    report_classes(records)
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Масштабирование пула реплик (core/replicas.py) на CPU: 1..N процессов.
+Без HTTP — меряем только бэкенд инференса (decode -> YOLO -> LaMa -> encode).
+
+Запуск: python benchmarks/6_bench_replicas.py --max-replicas 4 --limit 40
+"""
+
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+import time
+import asyncio
+import argparse
+
+import config
+from core.replicas import ReplicaPool, core_slices
+
+INPUT_DIR = config.INPUT_DIR
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+async def run_once(replicas: int, payloads: list, rounds: int) -> dict:
+    pool = ReplicaPool(replicas=replicas, max_pending=len(payloads) * rounds + 1)
+    t0 = time.perf_counter()
+    await pool.start()
+    # Ждем все реплики (start() ждет только первую)
+    while not all(r.ready for r in pool._replicas):
+        await asyncio.sleep(0.2)
+    startup = time.perf_counter() - t0
+
+    # Прогрев: по фото на реплику
+    await asyncio.gather(*[pool.submit(payloads[i % len(payloads)][0], payloads[i % len(payloads)][1])
+                           for i in range(replicas)])
+
+    jobs = payloads * rounds
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*[pool.submit(data, fmt) for data, fmt in jobs], return_exceptions=True)
+    elapsed = time.perf_counter() - t0
+    await pool.stop()
+
+    errors = sum(isinstance(r, Exception) for r in results)
+    return {"replicas": replicas, "startup": startup, "elapsed": elapsed,
+            "images": len(jobs), "fps": len(jobs) / elapsed, "errors": errors}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Пропускная способность пула реплик 1..N")
+    parser.add_argument("--max-replicas", type=int, default=len(core_slices(1)[0]) // 2 or 1,
+                        help="Максимум реплик (по умолчанию половина доступных ядер)")
+    parser.add_argument("--limit", type=int, default=20, help="Сколько фото из images_input брать")
+    parser.add_argument("--rounds", type=int, default=1, help="Сколько раз прогнать набор")
+    args = parser.parse_args()
+
+    files = sorted(f for f in INPUT_DIR.glob("*.*") if f.suffix.lower() in IMAGE_SUFFIXES)[:args.limit]
+    if not files:
+        print(f"❌ Нет файлов в {INPUT_DIR}")
+        return
+    payloads = [(f.read_bytes(), "JPEG" if f.suffix.lower() in {".jpg", ".jpeg"} else "PNG") for f in files]
+
+    print(f"🚀 Реплики 1..{args.max_replicas} | фото: {len(payloads) * args.rounds} | device: {config.DEVICE}")
+    print("-" * 72)
+    print(f"{'replicas':>8} | {'cores/replica':>13} | {'startup, s':>10} | {'img/s':>7} | {'speedup':>7} | {'eff.':>5} | err")
+    print("-" * 72)
+
+    base = None
+    for n in range(1, args.max_replicas + 1):
+        r = await run_once(n, payloads, args.rounds)
+        base = base or r["fps"]
+        speedup = r["fps"] / base
+        cores = len(core_slices(n)[0])
+        print(f"{n:>8} | {cores:>13} | {r['startup']:>10.1f} | {r['fps']:>7.2f} | "
+              f"{speedup:>6.2f}x | {speedup / n:>5.0%} | {r['errors']}")
+    print("-" * 72)
+    print("eff. = speedup / replicas. Падение эффективности — упор в память/кэш или слишком мало ядер на реплику.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,175 @@
+"""
+Ядра генератора (core/synth.py) против прежней реализации: сверка результата и время на пример.
+
+* blend     — альфа-смешивание (было: цикл по каналам в float64; стало: cv2.blendLinear по ROI)
+* colorize  — перекраска (было: цикл по каналам в float64; стало: таблица + cv2.LUT)
+* polygons  — разметка (было: маска во весь кадр + findContours; стало: маска ROI + сдвиг)
+* compose   — весь compose_sample на пример
+
+Допуск сверки: смешивание ±1 уровень (округление вместо отбрасывания дробной части),
+перекраска и полигоны — точное совпадение.
+Запуск: python benchmarks/7_bench_generator_kernels.py --samples 300
+"""
+
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+import config
+from core import synth
+
+
+# ==============================================================================
+# Прежняя реализация (эталон для сверки)
+# ==============================================================================
+
+def legacy_blend(bg, wm_resized, opacity, x_off, y_off):
+    new_h, new_w = wm_resized.shape[:2]
+    wm_rgb = wm_resized[:, :, :3]
+    wm_alpha = wm_resized[:, :, 3] / 255.0
+    wm_alpha = wm_alpha * opacity
+    roi = bg[y_off:y_off+new_h, x_off:x_off+new_w]
+    for c in range(3):
+        roi[:, :, c] = (1.0 - wm_alpha) * roi[:, :, c] + \
+                       wm_alpha * wm_rgb[:, :, c]
+    bg[y_off:y_off+new_h, x_off:x_off+new_w] = roi
+    return bg
+
+
+def legacy_colorize(img_rgba, color):
+    gray = cv2.cvtColor(img_rgba[:, :, :3], cv2.COLOR_BGR2GRAY) / 255.0
+    result = img_rgba.copy()
+    for c in range(3):
+        colored_layer = np.ones_like(gray) * color[c]
+        result[:, :, c] = (colored_layer * gray).astype(np.uint8)
+    return result
+
+
+def legacy_polygons(wm_resized, x_off, y_off, w_bg, h_bg):
+    new_h, new_w = wm_resized.shape[:2]
+    mask_binary = np.zeros((h_bg, w_bg), dtype=np.uint8)
+    wm_shape = (wm_resized[:, :, 3] > 10).astype(np.uint8) * 255
+    mask_binary[y_off:y_off+new_h, x_off:x_off+new_w] = wm_shape
+
+    contours, _ = cv2.findContours(mask_binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    polygons = []
+    for cnt in contours:
+        if cv2.contourArea(cnt) < 50: continue
+        epsilon = 0.002 * cv2.arcLength(cnt, True)
+        approx = cv2.approxPolyDP(cnt, epsilon, True)
+        if len(approx) < 4: continue
+        points = []
+        for point in approx:
+            x, y = point[0]
+            nx = max(0, min(1, x / w_bg))
+            ny = max(0, min(1, y / h_bg))
+            points.append(f"{nx:.6f} {ny:.6f}")
+        polygons.append(" ".join(points))
+    return polygons
+
+
+def new_polygons(wm_resized, x_off, y_off, w_bg, h_bg):
+    roi_mask = (wm_resized[:, :, 3] > synth.MASK_ALPHA_THRESHOLD).view(np.uint8) * np.uint8(255)
+    return [synth.format_polygon(p) for p in synth.roi_polygons(roi_mask, x_off, y_off, w_bg, h_bg)]
+
+
+# ==============================================================================
+# Данные
+# ==============================================================================
+
+def load_wm():
+    if config.WATERMARK_SOURCE.exists():
+        return synth.load_watermark()
+    # Нет watermark.png — рисуем похожую: текст с мягкой альфой
+    wm = np.zeros((120, 480, 4), dtype=np.uint8)
+    cv2.putText(wm, "WATERMARK", (10, 90), cv2.FONT_HERSHEY_SIMPLEX, 3, (255, 255, 255, 255), 8)
+    wm[:, :, 3] = cv2.GaussianBlur(wm[:, :, 3], (5, 5), 0)
+    return wm
+
+
+def make_cases(wm, n, seed):
+    """Случайные (фон, ватермарка в размере ROI, opacity, x, y, цвет)."""
+    rng = np.random.default_rng(seed)
+    cases = []
+    for _ in range(n):
+        h_bg, w_bg = int(rng.integers(480, 1200)), int(rng.integers(640, 1600))
+        bg = rng.integers(0, 256, (h_bg, w_bg, 3), dtype=np.uint8)
+        new_w = int(w_bg * rng.uniform(*config.GEN_SCALE_RANGE))
+        new_h = min(int(wm.shape[0] * new_w / wm.shape[1]), h_bg)
+        wm_resized = synth.smart_resize(wm, max(new_w, 10), max(new_h, 2))
+        h, w = wm_resized.shape[:2]
+        x, y = int(rng.integers(0, w_bg - w + 1)), int(rng.integers(0, h_bg - h + 1))
+        cases.append((bg, wm_resized, rng.uniform(0.05, 1.0), x, y, rng.integers(0, 256, (3,), dtype=np.uint8)))
+    return cases
+
+
+def timed(fn, cases, prepare=None):
+    total = 0.0
+    for case in cases:
+        args = prepare(case) if prepare else case
+        t0 = time.perf_counter()
+        fn(*args)
+        total += time.perf_counter() - t0
+    return total / len(cases) * 1e6  # мкс на пример
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ядра генератора: сверка и скорость")
+    parser.add_argument("--samples", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    cv2.setNumThreads(1)  # Как в воркерах генератора
+    wm = load_wm()
+    cases = make_cases(wm, args.samples, args.seed)
+    print(f"🧪 {len(cases)} примеров, ватермарка {wm.shape[1]}x{wm.shape[0]}")
+
+    # 1. Сверка
+    blend_diff = color_diff = poly_mismatch = 0
+    for bg, wm_r, opacity, x, y, color in cases:
+        a = legacy_blend(bg.copy(), wm_r, opacity, x, y)
+        b = synth.blend_roi(bg.copy(), wm_r, opacity, x, y)
+        blend_diff = max(blend_diff, int(np.abs(a.astype(np.int16) - b).max()))
+
+        a = legacy_colorize(wm_r, color)
+        b = synth.colorize(wm_r, color)
+        color_diff = max(color_diff, int(np.abs(a.astype(np.int16) - b).max()))
+
+        if legacy_polygons(wm_r, x, y, bg.shape[1], bg.shape[0]) != new_polygons(wm_r, x, y, bg.shape[1], bg.shape[0]):
+            poly_mismatch += 1
+
+    ok = blend_diff <= 1 and color_diff == 0 and poly_mismatch == 0
+    print(f"{'✅' if ok else '❌'} Сверка: blend max diff {blend_diff}, colorize max diff {color_diff}, "
+          f"полигоны расходятся в {poly_mismatch} примерах")
+
+    # 2. Скорость
+    copy_bg = lambda c: (c[0].copy(),) + c[1:5]
+    rows = [
+        ("blend", timed(legacy_blend, cases, copy_bg), timed(synth.blend_roi, cases, copy_bg)),
+        ("colorize", timed(legacy_colorize, cases, lambda c: (c[1], c[5])),
+         timed(synth.colorize, cases, lambda c: (c[1], c[5]))),
+        ("polygons", timed(legacy_polygons, cases, lambda c: (c[1], c[3], c[4], c[0].shape[1], c[0].shape[0])),
+         timed(new_polygons, cases, lambda c: (c[1], c[3], c[4], c[0].shape[1], c[0].shape[0]))),
+    ]
+    print(f"\n{'ядро':<10} {'было, мкс':>12} {'стало, мкс':>12} {'ускорение':>10}")
+    for name, old, new in rows:
+        print(f"{name:<10} {old:>12.0f} {new:>12.0f} {old / new:>9.1f}x")
+
+    # 3. Пример целиком (новая реализация)
+    t = timed(lambda bg, i: synth.compose_sample(bg, wm, synth.sample_rng(i, args.seed)),
+              [(c[0], i) for i, c in enumerate(cases)], lambda c: (c[0].copy(), c[1]))
+    print(f"\ncompose_sample: {t / 1000:.2f} мс/пример")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Отчет о банке вариантов ватермарки (core/wm_atlas.py): разнообразие и скорость против обычного пути.
+
+На одних и тех же фонах и сидах собираются примеры обоими путями compose_sample,
+и по результату (а не по внутренним параметрам) сравниваются распределения:
+* size     — ширина рамки ватермарки / ширина кадра
+* aspect   — высота / ширина рамки (доля поворотов)
+* area     — доля кадра под маской
+* strength — средний |пример - фон| под маской (прозрачность, цвет, инверсия, размытие)
+* sizes    — число разных размеров рамки (дискретность банка)
+Для каждой величины — p5 / p50 / p95 обоих путей и расстояние Колмогорова-Смирнова (KS, 0..1).
+KS < ~0.1 — распределения практически неотличимы.
+
+Запуск: python benchmarks/8_report_wm_atlas.py --samples 2000
+"""
+
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+import time
+import argparse
+import tempfile
+
+import cv2
+import numpy as np
+
+import config
+from core import synth, wm_atlas
+
+
+def load_wm():
+    if config.WATERMARK_SOURCE.exists():
+        return synth.load_watermark()
+    # Нет watermark.png — рисуем похожую: текст с мягкой альфой
+    wm = np.zeros((120, 480, 4), dtype=np.uint8)
+    cv2.putText(wm, "WATERMARK", (10, 90), cv2.FONT_HERSHEY_SIMPLEX, 3, (255, 255, 255, 255), 8)
+    wm[:, :, 3] = cv2.GaussianBlur(wm[:, :, 3], (5, 5), 0)
+    return wm
+
+
+def make_backgrounds(n, seed):
+    """Реальные фоны, если скачаны, иначе градиенты генератора."""
+    files = sorted(config.BACKGROUNDS_DIR.glob("*.jpg"))[:n]
+    if files:
+        return [bg for bg in map(synth.read_background, files) if bg is not None]
+    rng = np.random.default_rng(seed)
+    return [synth.make_background(0, [], rng) for _ in range(n)]
+
+
+def run(backgrounds, wm, atlas, samples, seed):
+    """Статистика по примерам одного пути + время compose_sample на пример."""
+    stats = {"size": [], "aspect": [], "area": [], "strength": [], "shape": []}
+    skipped = 0
+    total = 0.0
+    for i in range(samples):
+        bg = backgrounds[i % len(backgrounds)]
+        rng = synth.sample_rng(i, seed)
+        out = bg.copy()
+        t0 = time.perf_counter()
+        img, polygons = synth.compose_sample(out, wm, rng, atlas)
+        total += time.perf_counter() - t0
+        if img is None or not polygons:
+            skipped += 1
+            continue
+
+        h, w = img.shape[:2]
+        mask = np.zeros((h, w), dtype=np.uint8)
+        cv2.fillPoly(mask, [np.round(p * (w, h)).astype(np.int32) for p in polygons], 255)
+        x, y, bw, bh = cv2.boundingRect(mask)
+        under = mask > 0
+        stats["size"].append(bw / w)
+        stats["aspect"].append(bh / max(bw, 1))
+        stats["area"].append(under.mean())
+        stats["strength"].append(np.abs(img.astype(np.int16) - bg)[under].mean())
+        stats["shape"].append((bw, bh))
+    return stats, skipped, total / samples * 1000
+
+
+def ks_distance(a, b):
+    a, b = np.sort(a), np.sort(b)
+    grid = np.concatenate([a, b])
+    return float(np.abs(np.searchsorted(a, grid, side="right") / len(a) -
+                        np.searchsorted(b, grid, side="right") / len(b)).max())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Банк ватермарок: разнообразие и скорость")
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--backgrounds", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    cv2.setNumThreads(1)  # Как в воркерах генератора
+    wm = load_wm()
+    backgrounds = make_backgrounds(args.backgrounds, args.seed)
+    print(f"🧪 {args.samples} примеров на {len(backgrounds)} фонах, ватермарка {wm.shape[1]}x{wm.shape[0]}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        atlas = wm_atlas.build(wm, args.seed, Path(tmp))
+        build_s = time.perf_counter() - t0
+        print(f"🧩 Банк: {len(atlas)} вариантов, {atlas.data.nbytes / 2**20:.0f} МБ, сборка {build_s:.1f} с")
+
+        plain, plain_skip, plain_ms = run(backgrounds, wm, None, args.samples, args.seed)
+        banked, banked_skip, banked_ms = run(backgrounds, wm, atlas, args.samples, args.seed)
+        del atlas  # memmap закрывается до удаления папки
+
+    q = lambda v: "/".join(f"{x:.3f}" for x in np.percentile(v, [5, 50, 95]))
+    print(f"\n{'величина':<10} {'обычный p5/p50/p95':>24} {'банк p5/p50/p95':>24} {'KS':>6}")
+    worst = 0.0
+    for key in ("size", "aspect", "area", "strength"):
+        ks = ks_distance(plain[key], banked[key])
+        worst = max(worst, ks)
+        print(f"{key:<10} {q(plain[key]):>24} {q(banked[key]):>24} {ks:>6.3f}")
+
+    print(f"\n{'разных размеров':<22} {len(set(plain['shape'])):>8} {len(set(banked['shape'])):>8}")
+    print(f"{'отброшено/негативы':<22} {plain_skip:>8} {banked_skip:>8}")
+    print(f"{'compose, мс/пример':<22} {plain_ms:>8.2f} {banked_ms:>8.2f}  ({plain_ms / banked_ms:.1f}x)")
+    print(f"\n{'✅' if worst < 0.1 else '⚠️'} Худший KS: {worst:.3f}")
+
+
+if __name__ == "__main__":
+    main()
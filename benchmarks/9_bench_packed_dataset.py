@@ -0,0 +1,128 @@
+"""
+Эпоха обучения: папки с JPEG + .txt ("files") против упаковки в шарды ("packed", core/packed_dataset.py).
+
+1. Даталоадер: одна полная эпоха train (аугментации как в 2_train_model.py) без модели —
+   ровно та часть эпохи, которую меняет формат. Плюс время создания датасета
+   (для "files" — проверка разметки и .cache ultralytics при первом запуске).
+2. --full: по одной эпохе настоящего обучения в каждом формате (без валидации), время целиком.
+
+Запуск: python benchmarks/9_bench_packed_dataset.py --workers 8 --batch 8
+        python benchmarks/9_bench_packed_dataset.py --full
+"""
+
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+import time
+import argparse
+import tempfile
+
+from tqdm import tqdm
+from ultralytics import YOLO
+from ultralytics.cfg import get_cfg
+from ultralytics.data import build_dataloader, build_yolo_dataset
+from ultralytics.data.utils import check_det_dataset
+
+import config
+from core import packed_dataset
+from core.packed_trainer import PackedSegmentDataset, PackedSegmentationTrainer
+from core.utils import ensure_model
+
+DATA_YAML = config.TRAIN_DATASET_DIR / "data.yaml"
+
+
+def hyp(args):
+    return get_cfg(overrides={
+        "task": "segment", "imgsz": args.imgsz, "batch": args.batch, "workers": args.workers,
+        "mosaic": config.TRAIN_MOSAIC, "hsv_h": config.TRAIN_HSV_H, "hsv_s": config.TRAIN_HSV_S,
+        "hsv_v": config.TRAIN_HSV_V, "scale": config.TRAIN_SCALE,
+    })
+
+
+def loader_epoch(dataset, args) -> dict:
+    loader = build_dataloader(dataset, batch=args.batch, workers=args.workers, shuffle=True)
+    t0 = time.perf_counter()
+    images = 0
+    for batch in loader:
+        images += len(batch["im_file"])
+    elapsed = time.perf_counter() - t0
+    return {"epoch": elapsed, "fps": images / elapsed}
+
+
+def bench_loader(args, data):
+    cfg = hyp(args)
+    img_path = str(config.TRAIN_DATASET_DIR / "images" / "train")
+
+    t0 = time.perf_counter()
+    files = build_yolo_dataset(cfg, img_path, args.batch, data, mode="train")
+    files_init = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    packed = PackedSegmentDataset(
+        pack_path=packed_dataset.pack_dir("train"), img_path=img_path, imgsz=args.imgsz,
+        batch_size=args.batch, augment=True, hyp=cfg, rect=False, cache=None, stride=32, pad=0.0,
+        task="segment", data=data,
+    )
+    packed_init = time.perf_counter() - t0
+
+    rows = []
+    for name, dataset, init in (("files", files, files_init), ("packed", packed, packed_init)):
+        # Первая эпоха прогревает page cache ОС — в зачет идет вторая
+        loader_epoch(dataset, args)
+        rows.append((name, init, loader_epoch(dataset, args)))
+
+    print(f"\n{'формат':<8} {'создание, с':>12} {'эпоха, с':>10} {'img/s':>8}")
+    for name, init, r in rows:
+        print(f"{name:<8} {init:>12.2f} {r['epoch']:>10.2f} {r['fps']:>8.1f}")
+    print(f"⚡ Эпоха даталоадера: {rows[0][2]['epoch'] / rows[1][2]['epoch']:.1f}x")
+
+
+def bench_full(args):
+    ensure_model(config.YOLO_BASE_MODEL_PATH, config.YOLO_MODEL_URL, config.YOLO_MODEL_SHA256)
+    times = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, trainer in (("files", None), ("packed", PackedSegmentationTrainer)):
+            model = YOLO(config.YOLO_BASE_MODEL_PATH)
+            t0 = time.perf_counter()
+            model.train(trainer=trainer, data=str(DATA_YAML), epochs=1, imgsz=args.imgsz, batch=args.batch,
+                        workers=args.workers, mosaic=config.TRAIN_MOSAIC, val=False, plots=False,
+                        project=tmp, name=name, exist_ok=True, verbose=False,
+                        device=0 if config.DEVICE == "cuda" else "cpu")
+            times[name] = time.perf_counter() - t0
+    print(f"\n{'формат':<8} {'эпоха обучения, с':>18}")
+    for name, t in times.items():
+        print(f"{name:<8} {t:>18.1f}")
+    print(f"⚡ Эпоха обучения: {times['files'] / times['packed']:.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Эпоха: files против packed")
+    parser.add_argument("--workers", type=int, default=config.TRAIN_WORKERS)
+    parser.add_argument("--batch", type=int, default=config.TRAIN_BATCH)
+    parser.add_argument("--imgsz", type=int, default=config.TRAIN_IMG_SIZE)
+    parser.add_argument("--full", action="store_true", help="Еще и по эпохе настоящего обучения")
+    args = parser.parse_args()
+
+    if not DATA_YAML.exists():
+        print(f"❌ Нет {DATA_YAML}. Запусти 1_image_generator.py")
+        sys.exit(1)
+    data = check_det_dataset(str(DATA_YAML))
+
+    for split in ("train", "val"):
+        packed_dataset.ensure(split, imgsz=args.imgsz, progress_factory=lambda n: tqdm(total=n, unit="img"))
+    jpeg = sum(f.stat().st_size for f in (config.TRAIN_DATASET_DIR / "images" / "train").glob("*.jpg"))
+    shards = sum(f.stat().st_size for f in packed_dataset.pack_dir("train").glob("shard_*.u8"))
+    print(f"💾 train: JPEG {jpeg / 2**30:.2f} ГБ, шарды {shards / 2**30:.2f} ГБ (imgsz {args.imgsz})")
+    print(f"🧪 workers={args.workers}, batch={args.batch}")
+
+    bench_loader(args, data)
+    if args.full:
+        bench_full(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,6 @@
 """
 
 import os
-import torch
 from pathlib import Path
 
 # ==============================================================================
@@ -16,21 +15,33 @@ INPUT_DIR = BASE_DIR / "images_input"       # Твои фото для обра
 OUTPUT_DIR = BASE_DIR / "images_cleaned"    # Результат
 LOG_DIR = BASE_DIR / "logs"                 # Логи
 MODELS_DIR = BASE_DIR / "models"            # Веса моделей (ТУТ ЛЕЖАТ ФАЙЛЫ)
+MODEL_CACHE_DIR = MODELS_DIR / "cache"      # Оптимизированные копии моделей (можно удалить — пересоберутся)
 TEMP_DIR = BASE_DIR / "temp_download"       # Временная папка
+JOBS_DIR = BASE_DIR / "jobs"                # Очередь асинхронных задач API (sqlite + файлы)
 
 # Обучающие данные
 TRAIN_DATASET_DIR = BASE_DIR / "train_dataset"
 BACKGROUNDS_DIR = BASE_DIR / "backgrounds"
+BG_CACHE_DIR = BASE_DIR / "bg_cache"        # Декодированные фоны (можно удалить — пересоберутся)
+WM_ATLAS_DIR = BASE_DIR / "wm_atlas"        # Банк вариантов ватермарки (можно удалить — пересоберется)
+PROMOTE_HOLDOUT_DIR = BASE_DIR / "promote_holdout"   # Отложенная выборка 5_promote_model.py (обучение ее не видит)
+PROMOTE_HOLDOUT_BACKGROUNDS_DIR = BASE_DIR / "holdout_backgrounds"  # Свои фото для нее (нет — фоны обучения с другим сидом)
 
 # === 🔗 URL ИСТОЧНИКИ (Для авто-скачивания) ===
+# *_SHA256 закрепляет содержимое: скачанное и уже лежащее на диске сверяется с ним (core/downloader.py).
+# None — без проверки; загрузчик пишет в лог фактический хэш, его можно вписать сюда.
 BACKGROUNDS_URL = "http://images.cocodataset.org/zips/val2017.zip"
+BACKGROUNDS_SHA256 = None
+BACKGROUNDS_STREAM_EXTRACT = True   # Распаковывать фоны на лету из HTTP-потока (CRC32 на файл; SHA-256 архива — только без этого)
 
 # LaMa (Big-Lama.pt) - Зеркало HuggingFace
 LAMA_MODEL_URL = "https://huggingface.co/fashn-ai/LaMa/resolve/main/big-lama.pt"
 LAMA_MODEL_PATH = MODELS_DIR / "big-lama.pt"
+LAMA_MODEL_SHA256 = None
 
 # YOLOv11s-seg - Официальный репозиторий
 YOLO_MODEL_URL = "https://github.com/ultralytics/assets/releases/download/v8.3.0/yolo11s-seg.pt"
+YOLO_MODEL_SHA256 = None
 YOLO_MODEL_PATH = MODELS_DIR / "best.pt"    # Путь к ТВОЕЙ обученной модели
 
 # Базовая модель для старта обучения
@@ -39,11 +50,28 @@ YOLO_BASE_MODEL_PATH = MODELS_DIR / "yolo11s-seg.pt"
 # Файл ватермарки
 WATERMARK_SOURCE = BASE_DIR / "watermark.png"
 
+# Загрузка (core/downloader.py): куски по HTTP Range параллельно, докачка из .part
+DOWNLOAD_WORKERS = 4                 # Параллельных Range-запросов (1 = одним потоком)
+DOWNLOAD_PIECE_SIZE = 16 * 2**20     # Кусок файла на один Range-запрос
+DOWNLOAD_CHUNK_SIZE = 2**20          # Буфер чтения из сокета (было 1 КБ — миллион итераций на 1 ГБ)
+DOWNLOAD_RETRIES = 5                 # Повторов одного куска при обрыве
+DOWNLOAD_TIMEOUT = 30                # Таймаут соединения/чтения, с
+
 # ==============================================================================
 # 🎨 2. НАСТРОЙКИ ГЕНЕРАТОРА (SYNTHETIC DATA)
 # ==============================================================================
 GEN_EXTRA_SOLID_PERCENT = 0.20  # +20% градиентов
 GEN_TRAIN_RATIO = 0.8           # 80% train / 20% val
+GEN_SEED = 42                   # Мастер-сид: пример = f(сид, номер), от числа процессов не зависит
+GEN_WORKERS = None              # Процессов генерации. None = все ядра, 1 = без пула
+GEN_BG_CACHE = True             # Фоны из кэша декодированных кадров (memmap), а не JPEG каждый раз
+GEN_BG_MAX_SIDE = None          # Уменьшать фоны до этой длинной стороны (None = как есть). Меняет примеры
+
+# Банк готовых вариантов ватермарки (core/wm_atlas.py) вместо трансформаций на каждый пример
+GEN_WM_ATLAS = False            # Быстрее, но размеры дискретны. Отчет: benchmarks/8_report_wm_atlas.py
+GEN_WM_ATLAS_STEP = 1.08        # Шаг лестницы масштабов (меньше — ближе к непрерывному, но банк больше)
+GEN_WM_ATLAS_VARIANTS = 8       # Сложных вариантов (инверсия/размытие/края) на ступень и ориентацию
+GEN_WM_ATLAS_MAX_SIDE = 1024    # Самая крупная ступень (длинная сторона)
 
 # Вероятности
 GEN_PROB_NEGATIVE = 0.05        # 5% пустых фото
@@ -69,6 +97,10 @@ TRAIN_EPOCHS = 200
 TRAIN_IMG_SIZE = 640
 TRAIN_PATIENCE = 15
 TRAIN_BATCH = 8
+TRAIN_DATA_FORMAT = "files"     # "files" — датасет с диска; "stream" — train генерируется в даталоадере (core/stream_dataset.py);
+                                # "packed" — декодированные кадры в шардах + memmap (core/packed_dataset.py)
+TRAIN_STREAM_EPOCH_SIZE = None  # "stream": примеров в эпохе. None = все фоны train-сплита
+TRAIN_PACK_SHARD_MB = 1024      # "packed": размер одного шарда
 
 # 🔥 АВТО-ОПРЕДЕЛЕНИЕ OS ДЛЯ WORKERS
 # Windows не умеет workers > 0 в spawn-режиме без танцев с бубном.
@@ -85,6 +117,16 @@ TRAIN_HSV_S = 0.7
 TRAIN_HSV_V = 0.4
 TRAIN_SCALE = 0.5
 
+# Продвижение модели в YOLO_MODEL_PATH (5_promote_model.py): кандидат против текущей модели
+PROMOTE_MIN_MAP = None          # Минимум mAP50-95 масок кандидата на holdout. None = без абсолютного порога
+PROMOTE_MAX_MAP_DROP = 0.0      # Насколько mAP50-95 кандидата может быть ниже текущей модели
+PROMOTE_MAX_P95_RATIO = 1.10    # p95 CPU-латентности кандидата / p95 текущей модели
+PROMOTE_MAX_P95_MS = None       # Абсолютный потолок p95 на CPU (мс). None = без потолка
+PROMOTE_LATENCY_IMAGES = 50     # Фиксированный набор для замера: первые N фото holdout по имени
+PROMOTE_LATENCY_WARMUP = 5      # Прогревочные прогоны (не в зачет)
+PROMOTE_HOLDOUT_SIZE = 500      # Примеров в holdout (собирается один раз, дальше заморожен)
+PROMOTE_HOLDOUT_SEED = 20240917 # Свой сид: ни ватермарки, ни градиенты не совпадут с train_dataset
+
 # ==============================================================================
 # 🕵️ 4. ДЕТЕКТОР И ПАЙПЛАЙН
 # ==============================================================================
@@ -92,14 +134,85 @@ YOLO_CONFIDENCE = 0.25      # Порог уверенности
 
 # Очистка (LaMa)
 CLEANER_MASK_DILATION = 6   # Расширение маски на 6px перед удалением
+CLEANER_MAX_BATCH = 4       # Сколько фото LaMa берет за один forward (батч в API)
+CLEANER_BATCH_BUCKET = 64   # Шаг корзин размера для батча (паддинг до кратного)
+CLEANER_OPTIMIZE = True     # LaMa: torch.jit.freeze + optimize_for_inference, результат кэшируется в MODEL_CACHE_DIR
+
+# Видео и анимации (core/video.py). Нужен ffmpeg/ffprobe в PATH (для GIF/WebP — только PIL)
+VIDEO_SUFFIXES = {".mp4", ".mov", ".mkv", ".webm", ".avi"}
+VIDEO_DETECT_EVERY = 15         # Детекция минимум раз в N кадров, между ними маска переиспользуется
+VIDEO_SCENE_THRESHOLD = 12.0    # Смена сцены: средняя разница миниатюр (0..255) с последним кейфреймом
+VIDEO_MASK_IOU = 0.8            # Маска "поехала" (IoU ниже) — снова детектим каждый кадр, пока не устаканится
+VIDEO_BATCH = 8                 # Кадров на один clean_batch (внутри режется по CLEANER_MAX_BATCH)
+VIDEO_CRF = 18                  # Качество перекодирования (x264 / VP9)
+VIDEO_PRESET = "medium"         # x264 preset: быстрее — больше файл
+FFMPEG_BIN = "ffmpeg"
+FFPROBE_BIN = "ffprobe"
+
+# ==============================================================================
+# 🌐 5. REST API (4_api_pipeline.py)
+# ==============================================================================
+API_INFERENCE_THREADS = 1   # Потоки инференса. 1 GPU = 1 поток (модели не thread-safe)
+API_REPLICAS = 0            # CPU-хост: N процессов-реплик моделей, каждый на своем срезе ядер. 0 = модели в процессе API
+API_REPLICA_MAX_RESTARTS = 5        # Перезапусков реплики подряд (без успешной загрузки моделей). Дальше — пул not ready
+API_REPLICA_RESTART_DELAY = 1.0     # Пауза перед первым перезапуском, с (дальше удваивается)
+API_REPLICA_RESTART_MAX_DELAY = 60  # Потолок паузы, с
+API_MAX_QUEUE = 32          # Сколько запросов может ждать модели. Больше — 503 + Retry-After
+API_MAX_BATCH = 8           # Микро-батч: максимум фото на один вызов детектора
+API_BATCH_WINDOW_MS = 15    # Максимальное окно сбора батча (под нагрузкой). В простое ~0
+API_JPEG_QUALITY = 95       # Качество ответа по умолчанию (можно переопределить: Accept: image/jpeg;quality=80)
+API_WEBP_QUALITY = 90
+API_WEBP_METHOD = 4         # 0..6: выше — меньше файл, дольше кодирование
+API_PNG_COMPRESS_LEVEL = 6  # 0..9: ниже — быстрее, но больше трафика
+API_DEFAULT_DEADLINE_MS = None  # Дедлайн /process, если клиент не прислал X-Request-Deadline-Ms. None = без дедлайна
+API_BULK_MAX_ITEMS = 1000   # Максимум фото в одном POST /process/bulk
+API_BULK_INFLIGHT = 16      # Сколько фото одного bulk-запроса одновременно в очереди моделей
+API_DETECT_THREADS = 1      # /detect: свой экземпляр YOLO и свой поток, не ждет очередь LaMa
+API_DETECT_MAX_QUEUE = 64   # Лимит очереди /detect (отдельный от API_MAX_QUEUE)
+API_JOB_WORKERS = 8         # Сколько задач /jobs одновременно в очереди моделей (~ API_MAX_BATCH)
+API_JOB_MAX_QUEUED = 10000  # Лимит задач в статусе queued. Больше — 503
+API_JOB_TTL_HOURS = 24      # Сколько хранить результат после завершения
+API_JOB_MAX_ATTEMPTS = 3    # Сколько раз задача может пережить падение сервера посреди обработки
+
+# ==============================================================================
+# 📈 6. МОНИТОРИНГ
+# ==============================================================================
+# Порт для /metrics у 3_run_pipeline.py (None = выключено).
+# API отдает /metrics на своем порту всегда.
+METRICS_PORT = None         # Например 9108
+METRICS_ADDR = "127.0.0.1"  # Только локально. "0.0.0.0" — для скрейпа снаружи
+
+# Логи (core/pipeline_logger.py): запись в фоне через очередь + ротация
+LOG_MAX_BYTES = 50 * 1024 * 1024  # Ротация pipeline.log/errors.log по размеру
+LOG_BACKUP_COUNT = 5              # Сколько старых файлов хранить
+LOG_ROTATE_WHEN = None            # "midnight" / "H" — ротация по времени вместо размера
+LOG_SAMPLE_WINDOW = 60            # Окно (сек) для подавления повторяющихся ошибок
+LOG_SAMPLE_BURST = 20             # Сколько ошибок с одной строки кода пропускать за окно
+
+# Профилирование по запросу (core/profiler.py): SIGUSR1 у пайплайна, POST /debug/profile у API
+PROFILE_SECONDS = 10        # Длительность захвата по умолчанию
+PROFILE_MAX_SECONDS = 120   # Потолок, чтобы случайно не писать трейс вечно
+API_DEBUG_ENDPOINTS = False # /debug/* в API (без авторизации!). Включать только в закрытой сети
+
+# Трейс: одна JSON строка на фото (разбор — benchmarks/5_analyze_traces.py)
+TRACE_ENABLED = True
+TRACE_LOG_PATH = LOG_DIR / "traces.jsonl"
 
 # ==============================================================================
 # ⚙️ СИСТЕМА
 # ==============================================================================
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+# DEVICE ("cuda" / "cpu") считается лениво при первом обращении (config.DEVICE):
+# import config не тянет torch (~1-2с), скрипты без моделей стартуют мгновенно.
+
+def __getattr__(name):
+    if name == "DEVICE":
+        import torch
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        globals()["DEVICE"] = device  # Дальше — обычный атрибут модуля
+        return device
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def setup_directories():
+    """Создание рабочих папок. Зовется из main() скриптов, а не при import config."""
     for path in [INPUT_DIR, OUTPUT_DIR, LOG_DIR, MODELS_DIR, TRAIN_DATASET_DIR, BACKGROUNDS_DIR, TEMP_DIR]:
-        path.mkdir(parents=True, exist_ok=True)
-
-setup_directories()
\ No newline at end of file
+        path.mkdir(parents=True, exist_ok=True)
\ No newline at end of file
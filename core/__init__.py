@@ -31,6 +31,6 @@ train_dataset/ (пример структуры папки)
 /models
 Сюда скачаются веса (yolo, sam, lama)
 
-Сюда нужно РУКАМИ скопировать файл best.pt после обучения (из runs/detect/...).
+Сюда best.pt после обучения кладет 5_promote_model.py (прежняя модель — best.prev.pt).
 ---
 """
\ No newline at end of file
@@ -0,0 +1,239 @@
+"""
+Распаковка zip-архивов фонов без лишних проходов по данным.
+
+stream_extract — архив читается прямо из HTTP-ответа, файлы пишутся в папку назначения
+по мере прихода (zip читается по локальным заголовкам, центральный каталог не нужен).
+Ни архива на диске, ни временной папки. Обрыв связи — переподключение с Range с начала
+текущего файла; уже готовые файлы при перезапуске пропускаются.
+Не умеет: шифрование, методы сжатия кроме stored/deflate, stored-файлы с дескриптором данных —
+тогда StreamUnsupported, и вызывающий код качает архив целиком (core/downloader.py).
+
+parallel_extract — распаковка уже скачанного архива в несколько потоков
+(zlib отпускает GIL), у каждого потока свой ZipFile.
+
+Оба пути: файлы кладутся плоско (без папок архива), атомарно (.part -> rename), целостность —
+CRC32 каждого файла; файл, который уже лежит с тем же размером, не трогается.
+"""
+
+import logging
+import os
+import shutil
+import struct
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+import urllib3
+
+import config
+
+logger = logging.getLogger(__name__)
+
+CHUNK = 2**20
+_LOCAL = b"PK\x03\x04"
+_CENTRAL = (b"PK\x01\x02", b"PK\x05\x06", b"PK\x06\x06")
+_DESCRIPTOR = b"PK\x07\x08"
+_STREAM_ERRORS = (requests.RequestException, urllib3.exceptions.HTTPError, OSError, EOFError)
+
+
+class StreamUnsupported(Exception):
+    pass
+
+
+def is_jpeg(name: str) -> bool:
+    return name.lower().endswith((".jpg", ".jpeg")) and not Path(name).name.startswith(".")
+
+
+def _present(target: Path, size: int = None) -> bool:
+    return target.exists() and (size is None or target.stat().st_size == size)
+
+
+class _Reader:
+    """Точное чтение из потока с позицией в архиве и возвратом лишних байт."""
+
+    def __init__(self, raw, pos: int = 0, progress=None):
+        self.raw, self.pos, self.progress = raw, pos, progress
+        self._buf = b""
+
+    def read_some(self, n: int) -> bytes:
+        if self._buf:
+            data, self._buf = self._buf[:n], self._buf[n:]
+        else:
+            data = self.raw.read(n)
+            if not data:
+                raise EOFError("Поток оборвался посреди архива")
+            if self.progress:
+                self.progress(len(data))
+        self.pos += len(data)
+        return data
+
+    def read(self, n: int) -> bytes:
+        parts = []
+        while n:
+            data = self.read_some(n)
+            parts.append(data)
+            n -= len(data)
+        return b"".join(parts)
+
+    def skip(self, n: int):
+        while n:
+            n -= len(self.read_some(min(CHUNK, n)))
+
+    def unread(self, data: bytes):
+        self._buf = data + self._buf
+        self.pos -= len(data)
+
+
+def _zip64_sizes(extra: bytes, csize: int, usize: int):
+    i = 0
+    while i + 4 <= len(extra):
+        tag, length = struct.unpack_from("<HH", extra, i)
+        if tag == 0x0001:
+            fields = extra[i + 4:i + 4 + length]
+            j = 0
+            if usize == 0xFFFFFFFF:
+                usize = struct.unpack_from("<Q", fields, j)[0]; j += 8
+            if csize == 0xFFFFFFFF:
+                csize = struct.unpack_from("<Q", fields, j)[0]
+            return csize, usize, True
+        i += 4 + length
+    return csize, usize, False
+
+
+def _extract_member(reader: _Reader, dest_dir: Path, accept) -> str:
+    """
+    Один файл архива с текущей позиции.
+    -> "extracted" / "skipped" (уже есть) / "ignored" (не подходит под accept) / "end" (начался каталог).
+    """
+    sig = reader.read(4)
+    if sig in _CENTRAL:
+        return "end"
+    if sig != _LOCAL:
+        raise StreamUnsupported(f"Неожиданная сигнатура {sig!r} на позиции {reader.pos - 4}")
+    _, flags, method, _, _, crc, csize, usize, name_len, extra_len = struct.unpack("<HHHHHIIIHH", reader.read(26))
+    name = reader.read(name_len).decode("utf-8" if flags & 0x800 else "cp437")
+    csize, usize, zip64 = _zip64_sizes(reader.read(extra_len), csize, usize)
+    has_descriptor = bool(flags & 0x8)
+
+    if flags & 0x1:
+        raise StreamUnsupported(f"{name}: зашифрован")
+    if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        raise StreamUnsupported(f"{name}: метод сжатия {method}")
+    if has_descriptor and method == zipfile.ZIP_STORED:
+        raise StreamUnsupported(f"{name}: stored с дескриптором данных — размер заранее неизвестен")
+
+    target = dest_dir / Path(name).name if accept(name) else None
+    skip = target is None or _present(target, None if has_descriptor else usize)
+    if skip and not has_descriptor:
+        reader.skip(csize)
+        return "skipped" if target else "ignored"
+
+    tmp = target.with_name(target.name + ".part") if not skip else None
+    out = open(tmp, "wb") if tmp else None
+    actual_crc = 0
+    try:
+        if method == zipfile.ZIP_STORED:
+            remaining = csize
+            while remaining:
+                data = reader.read_some(min(CHUNK, remaining))
+                remaining -= len(data)
+                actual_crc = zlib.crc32(data, actual_crc)
+                out.write(data)
+        else:
+            d = zlib.decompressobj(-zlib.MAX_WBITS)
+            remaining = None if has_descriptor else csize
+            while not d.eof:
+                if remaining == 0:
+                    raise StreamUnsupported(f"{name}: поток deflate длиннее заявленного")
+                data = reader.read_some(CHUNK if remaining is None else min(CHUNK, remaining))
+                if remaining is not None:
+                    remaining -= len(data)
+                data = d.decompress(data)
+                if out:
+                    actual_crc = zlib.crc32(data, actual_crc)
+                    out.write(data)
+            reader.unread(d.unused_data)
+            if remaining:
+                reader.skip(remaining)
+
+        if has_descriptor:
+            head = reader.read(4)
+            if head != _DESCRIPTOR:
+                reader.unread(head)
+            crc = struct.unpack("<I", reader.read(4))[0]
+            reader.skip(16 if zip64 else 8)
+    finally:
+        if out:
+            out.close()
+
+    if not out:
+        return "skipped" if target else "ignored"
+    if actual_crc != crc:
+        tmp.unlink(missing_ok=True)
+        raise EOFError(f"{name}: CRC32 не совпал")  # Битые байты в пути — как обрыв: повтор с начала файла
+    os.replace(tmp, target)
+    return "extracted"
+
+
+def stream_extract(url: str, dest_dir: Path, accept=is_jpeg, session: requests.Session = None,
+                   progress=None, retries: int = None) -> dict:
+    """
+    Скачать и распаковать zip одним проходом. -> {"extracted": N, "skipped": M, "ignored": K}.
+    progress(n) — вызывается на каждые n прочитанных байт архива.
+    """
+    dest_dir = Path(dest_dir)
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    session = session or requests.Session()
+    retries = config.DOWNLOAD_RETRIES if retries is None else retries
+    stats = {"extracted": 0, "skipped": 0, "ignored": 0}
+    pos = 0
+
+    for attempt in range(retries + 1):
+        headers = {"Range": f"bytes={pos}-"} if pos else {}
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=config.DOWNLOAD_TIMEOUT) as r:
+                r.raise_for_status()
+                if pos and r.status_code != 206:
+                    logger.warning("⚠️ Сервер не поддерживает Range: архив читается с начала, готовые файлы пропускаются")
+                    pos = 0
+                reader = _Reader(r.raw, pos, progress)
+                while True:
+                    status = _extract_member(reader, dest_dir, accept)
+                    if status == "end":
+                        return stats
+                    stats[status] += 1
+                    pos = reader.pos
+        except _STREAM_ERRORS as e:
+            if attempt == retries:
+                raise
+            logger.warning(f"🔁 Обрыв на {pos / 2**20:.0f} МБ: {e}. Повтор {attempt + 1}/{retries}")
+            time.sleep(min(2 ** attempt, 30))
+    return stats
+
+
+def parallel_extract(zip_path: Path, dest_dir: Path, accept=is_jpeg, workers: int = None, progress=None) -> dict:
+    """Распаковать скачанный архив в workers потоков. -> {"extracted": N, "skipped": M}."""
+    dest_dir = Path(dest_dir)
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    workers = workers or min(8, os.cpu_count() or 1)
+    with zipfile.ZipFile(zip_path) as zf:
+        infos = [i for i in zf.infolist() if not i.is_dir() and accept(i.filename)]
+    todo = [i for i in infos if not _present(dest_dir / Path(i.filename).name, i.file_size)]
+
+    def work(chunk):
+        with zipfile.ZipFile(zip_path) as zf:
+            for info in chunk:
+                target = dest_dir / Path(info.filename).name
+                tmp = target.with_name(target.name + ".part")
+                with zf.open(info) as src, open(tmp, "wb") as dst:  # zf.open сверяет CRC32
+                    shutil.copyfileobj(src, dst, CHUNK)
+                os.replace(tmp, target)
+                if progress:
+                    progress(1)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(work, [todo[k::workers] for k in range(workers)]))
+    return {"extracted": len(todo), "skipped": len(infos) - len(todo)}
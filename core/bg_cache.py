@@ -0,0 +1,160 @@
+"""
+Кэш декодированных фонов для генератора (config.GEN_BG_CACHE).
+
+JPEG из config.BACKGROUNDS_DIR декодируются один раз (с уменьшением до GEN_BG_MAX_SIDE,
+как synth.read_background) и лежат подряд в одном файле uint8:
+    bg_cache/backgrounds.u8   — кадры BGR без заголовков
+    bg_cache/index.json       — отпечаток папки + [имя, смещение, h, w] на кадр
+Воркеры открывают файл через np.memmap и получают кадр как read-only вид — без декодирования
+и без копий (страницы общие для всех процессов через page cache ОС).
+
+Отпечаток — имена, размеры и mtime файлов + GEN_BG_MAX_SIDE: добавили/заменили фон или
+поменяли настройку — кэш пересобирается сам при следующем запуске генератора.
+"""
+
+import json
+import hashlib
+import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+import config
+from core.synth import read_background
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+DATA_NAME = "backgrounds.u8"
+INDEX_NAME = "index.json"
+
+
+def fingerprint(bg_files: list) -> str:
+    """Отпечаток набора фонов: имя, размер, mtime каждого файла + параметры декодирования."""
+    h = hashlib.sha256(json.dumps([CACHE_VERSION, config.GEN_BG_MAX_SIDE]).encode())
+    for path in bg_files:
+        st = path.stat()
+        h.update(f"{path.name}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()[:16]
+
+
+class BackgroundCache:
+    """
+    Чтение кадров из кэша. Объект можно передавать в другие процессы:
+    при pickle memmap не копируется, а заново открывается на месте.
+    """
+
+    def __init__(self, cache_dir: Path, index: dict):
+        self.cache_dir = Path(cache_dir)
+        self.fingerprint = index["fingerprint"]
+        self.entries = {name: (offset, h, w) for name, offset, h, w in index["entries"]}
+        self._data = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    @property
+    def data(self) -> np.ndarray:
+        if self._data is None:
+            path = self.cache_dir / DATA_NAME
+            # Пустой memmap numpy не открывает
+            self._data = np.memmap(path, dtype=np.uint8, mode="r") if path.stat().st_size else np.empty(0, np.uint8)
+        return self._data
+
+    def __len__(self):
+        return len(self.entries)
+
+    def read(self, path):
+        """Кадр BGR (read-only вид на memmap) по пути фона. None — фон не читался при сборке."""
+        offset, h, w = self.entries[Path(path).name]
+        if not h:
+            return None
+        return self.data[offset:offset + h * w * 3].reshape(h, w, 3)
+
+    @classmethod
+    def load(cls, bg_files: list, cache_dir: Path = None):
+        """Кэш, если он есть и собран из этих же фонов с теми же настройками; иначе None."""
+        cache_dir = Path(cache_dir or config.BG_CACHE_DIR)
+        try:
+            with open(cache_dir / INDEX_NAME, encoding="utf-8") as f:
+                index = json.load(f)
+            if index.get("fingerprint") != fingerprint(bg_files) or not (cache_dir / DATA_NAME).exists():
+                return None
+            return cls(cache_dir, index)
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+def imap_window(pool, fn, items, window: int):
+    """
+    pool.map по порядку, но в работе (и в памяти) не больше window результатов:
+    следующая задача уходит в пул только когда потребитель забрал очередной результат.
+    """
+    pending = deque()
+    for item in items:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(pool.submit(fn, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+def build(bg_files: list, cache_dir: Path = None, workers: int = None, progress=None) -> BackgroundCache:
+    """
+    Собрать кэш заново. Декодирование — в потоках (cv2 отпускает GIL), запись — по порядку
+    в один файл; в пул уходит не больше 2 * workers кадров вперед записи (imap_window),
+    так что в памяти держится только это окно.
+    Атомарно: данные и индекс пишутся во временные файлы, индекс подменяется последним.
+    """
+    cache_dir = Path(cache_dir or config.BG_CACHE_DIR)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    fp = fingerprint(bg_files)
+    workers = workers or min(8, os.cpu_count() or 1)
+
+    entries = []
+    offset = 0
+    tmp_data = cache_dir / (DATA_NAME + ".tmp")
+    with open(tmp_data, "wb") as f, ThreadPoolExecutor(max_workers=workers) as pool:
+        for path, img in zip(bg_files, imap_window(pool, read_background, bg_files, 2 * workers)):
+            if img is None:
+                logger.warning(f"⚠️ Фон не читается, в кэше будет пустым: {path.name}")
+                entries.append([path.name, offset, 0, 0])
+            else:
+                img = np.ascontiguousarray(img)
+                f.write(img.data)
+                entries.append([path.name, offset, img.shape[0], img.shape[1]])
+                offset += img.nbytes
+            if progress:
+                progress()
+
+    index = {"version": CACHE_VERSION, "fingerprint": fp, "max_side": config.GEN_BG_MAX_SIDE, "entries": entries}
+    tmp_index = cache_dir / (INDEX_NAME + ".tmp")
+    with open(tmp_index, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    (cache_dir / INDEX_NAME).unlink(missing_ok=True)  # Без индекса старые данные никто не откроет
+    tmp_data.replace(cache_dir / DATA_NAME)
+    tmp_index.replace(cache_dir / INDEX_NAME)
+    logger.info(f"💾 Кэш фонов собран: {len(entries)} кадров, {offset / 2**30:.2f} ГБ")
+    return BackgroundCache(cache_dir, index)
+
+
+def ensure(bg_files: list, cache_dir: Path = None, progress_factory=None):
+    """
+    Кэш для этих фонов: готовый или собранный заново. None — кэш выключен (config.GEN_BG_CACHE).
+    progress_factory(total) -> контекст с .update() (например, tqdm) для прогресса сборки.
+    """
+    if not config.GEN_BG_CACHE:
+        return None
+    cache = BackgroundCache.load(bg_files, cache_dir)
+    if cache is not None:
+        return cache
+    print(f"📦 Кэш фонов устарел или отсутствует — декодирую {len(bg_files)} фонов (один раз)...")
+    if progress_factory is None:
+        return build(bg_files, cache_dir)
+    with progress_factory(len(bg_files)) as pbar:
+        return build(bg_files, cache_dir, progress=pbar.update)
@@ -0,0 +1,147 @@
+"""
+Упаковка/распаковка для bulk-эндпоинта API (POST /process/bulk).
+
+Вход: multipart с несколькими файлами ИЛИ тело-архив (zip / tar / tar.gz).
+Выход: zip или multipart/mixed, который отдается потоком — каждый файл уходит клиенту,
+как только готов, без накопления всего ответа в памяти.
+"""
+
+import io
+import json
+import uuid
+import tarfile
+import zipfile
+from pathlib import PurePosixPath
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+
+ZIP_TYPES = {"application/zip", "application/x-zip-compressed"}
+TAR_TYPES = {"application/x-tar", "application/tar", "application/gzip", "application/x-gtar", "application/x-gzip"}
+
+MANIFEST_NAME = "manifest.json"
+
+
+class ArchiveError(ValueError):
+    """Тело запроса не является читаемым архивом."""
+
+
+def is_image_name(name: str) -> bool:
+    return PurePosixPath(name).suffix.lower() in IMAGE_SUFFIXES
+
+
+def iter_archive(body: bytes, content_type: str):
+    """
+    Генератор (name, read) по картинкам архива.
+    zip: read() достает байты файла лениво (ZipFile читает под своим замком — можно из потоков).
+    tar: TarFile не потокобезопасен (общая позиция в потоке, у tar.gz — еще и общий распаковщик),
+    поэтому файлы читаются здесь, по порядку за один проход, а read() лишь отдает готовые байты.
+    """
+    buf = io.BytesIO(body)
+    try:
+        if content_type in ZIP_TYPES:
+            zf = zipfile.ZipFile(buf)
+            for info in zf.infolist():
+                if info.is_dir() or not is_image_name(info.filename): continue
+                yield info.filename, (lambda info=info: zf.read(info))
+        else:
+            tf = tarfile.open(fileobj=buf, mode="r:*")
+            for member in tf:
+                if not member.isfile() or not is_image_name(member.name): continue
+                data = tf.extractfile(member).read()
+                yield member.name, (lambda data=data: data)
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        raise ArchiveError(str(e))
+
+
+class UniqueNames:
+    """a.jpg, a.jpg -> a.jpg, a_1.jpg (в архиве имена должны быть уникальны)."""
+
+    def __init__(self):
+        self._seen = set()
+
+    def __call__(self, name: str) -> str:
+        name = PurePosixPath(name.replace("\\", "/")).name or "image"
+        candidate, n = name, 0
+        stem, suffix = PurePosixPath(name).stem, PurePosixPath(name).suffix
+        while candidate in self._seen:
+            n += 1
+            candidate = f"{stem}_{n}{suffix}"
+        self._seen.add(candidate)
+        return candidate
+
+
+class _ChunkSink:
+    """
+    Файлоподобный приемник для zipfile: есть write/tell, нет seek.
+    zipfile тогда пишет data descriptor после каждого файла — архив можно отдавать потоком.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStream:
+    """
+    Потоковый zip: add() возвращает готовые байты для отправки клиенту.
+    Картинки уже сжаты (JPEG/PNG/WebP), поэтому ZIP_STORED — без лишнего CPU.
+    """
+    media_type = "application/zip"
+
+    def __init__(self):
+        self._sink = _ChunkSink()
+        self._zip = zipfile.ZipFile(self._sink, mode="w", compression=zipfile.ZIP_STORED)
+
+    def add(self, name: str, data, status: str = None, content_type: str = None) -> bytes:
+        self._zip.writestr(name, data)
+        return self._sink.drain()
+
+    def finish(self, manifest: list) -> bytes:
+        self._zip.writestr(MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False, indent=1))
+        self._zip.close()
+        return self._sink.drain()
+
+
+class MultipartStream:
+    """Потоковый multipart/mixed: часть на файл (с заголовком Clean-Status) + manifest в конце."""
+
+    def __init__(self):
+        self.boundary = uuid.uuid4().hex
+        self.media_type = f"multipart/mixed; boundary={self.boundary}"
+
+    def _part(self, headers: dict, data) -> bytes:
+        head = "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+        return f"--{self.boundary}\r\n{head}\r\n".encode("utf-8") + bytes(data) + b"\r\n"
+
+    def add(self, name: str, data, status: str = None, content_type: str = None) -> bytes:
+        headers = {
+            "Content-Type": content_type or "application/octet-stream",
+            "Content-Disposition": f'attachment; filename="{name}"',
+        }
+        if status:
+            headers["Clean-Status"] = status
+        return self._part(headers, data)
+
+    def finish(self, manifest: list) -> bytes:
+        body = json.dumps(manifest, ensure_ascii=False).encode("utf-8")
+        part = self._part({
+            "Content-Type": "application/json",
+            "Content-Disposition": f'attachment; filename="{MANIFEST_NAME}"',
+        }, body)
+        return part + f"--{self.boundary}--\r\n".encode("utf-8")
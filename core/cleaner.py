@@ -4,12 +4,15 @@
 Использует локальную модель LaMa (TorchScript) с автоскачиванием.
 """
 
+import math
 import logging
 import torch
+import torch.nn.functional as F
 import numpy as np
 from PIL import Image
 import config
 from core.utils import ensure_model
+from core.profiler import region
 
 class ImageInpainter:
     def __init__(self):
@@ -19,22 +22,87 @@ class ImageInpainter:
 
         # 1. Проверяем и качаем модель, если её нет
         try:
-            ensure_model(self.model_path, config.LAMA_MODEL_URL)
+            ensure_model(self.model_path, config.LAMA_MODEL_URL, config.LAMA_MODEL_SHA256)
         except Exception as e:
             self.logger.critical(f"❌ Не удалось получить модель LaMa: {e}")
             raise e
 
         self.logger.info(f"⏳ Загрузка LaMa: {self.model_path.name}...")
         try:
-            # 2. Грузим TorchScript модель
-            self.model = torch.jit.load(str(self.model_path), map_location=self.device)
-            self.model.eval()
-            self.model.to(self.device)
+            # 2. Грузим TorchScript модель (оптимизированную копию из кэша, если есть)
+            self.model = self._load_model()
             self.logger.info("✅ LaMa готова к работе.")
         except Exception as e:
             self.logger.critical(f"❌ Битый файл модели или ошибка CUDA: {e}")
             raise e
 
+    def _load_plain(self):
+        model = torch.jit.load(str(self.model_path), map_location=self.device)
+        model.eval()
+        model.to(self.device)
+        return model
+
+    def _cache_path(self):
+        """
+        Ключ кэша: исходный файл (размер + mtime), версия torch и устройство —
+        замороженная модель содержит константы под конкретное устройство.
+        """
+        st = self.model_path.stat()
+        key = f"{self.model_path.stem}-{st.st_size}-{int(st.st_mtime)}-torch{torch.__version__}-{self.device}"
+        return config.MODEL_CACHE_DIR / (key.replace("+", "_") + ".frozen.pt")
+
+    def _load_model(self):
+        """
+        Рестарт не повторяет оптимизацию: freeze/optimize_for_inference делаются один раз,
+        результат сохраняется в config.MODEL_CACHE_DIR. Любая ошибка — откат на исходную модель.
+        """
+        if not config.CLEANER_OPTIMIZE:
+            return self._load_plain()
+
+        cache_path = self._cache_path()
+        if cache_path.exists():
+            try:
+                model = torch.jit.load(str(cache_path), map_location=self.device)
+                self.logger.info(f"⚡ LaMa из кэша: {cache_path.name}")
+                return model
+            except Exception as e:
+                self.logger.warning(f"⚠️ Кэш LaMa битый, пересобираю: {e}")
+                cache_path.unlink(missing_ok=True)
+
+        model = self._load_plain()
+        optimized = self._optimize(model)
+        if optimized is not model:
+            try:
+                cache_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = cache_path.with_suffix(".tmp")
+                torch.jit.save(optimized, str(tmp))
+                tmp.replace(cache_path)
+                self.logger.info(f"💾 Оптимизированная LaMa сохранена: {cache_path.name}")
+            except Exception as e:
+                self.logger.warning(f"⚠️ Не удалось сохранить кэш LaMa: {e}")
+        return optimized
+
+    def _optimize(self, model):
+        """freeze + optimize_for_inference с проверкой, что выход не изменился."""
+        try:
+            frozen = torch.jit.freeze(model)
+            try:
+                frozen = torch.jit.optimize_for_inference(frozen)
+            except Exception as e:
+                self.logger.info(f"optimize_for_inference недоступен, только freeze: {e}")
+
+            img = torch.rand(1, 3, 64, 64, device=self.device)
+            mask = (torch.rand(1, 1, 64, 64, device=self.device) > 0.5).float()
+            with torch.no_grad():
+                diff = (model(img, mask) - frozen(img, mask)).abs().max().item()
+            if diff > 1e-3:
+                self.logger.warning(f"⚠️ Оптимизированная LaMa расходится с исходной ({diff:.4f}), не используем")
+                return model
+            return frozen
+        except Exception as e:
+            self.logger.warning(f"⚠️ Оптимизация LaMa не удалась, работаем с исходной: {e}")
+            return model
+
     def _preprocess(self, image: Image.Image, mask: Image.Image):
         """
         Подготовка тензоров для LaMa.
@@ -80,28 +148,94 @@ class ImageInpainter:
 
         try:
             # 1. Препроцессинг
-            img_t, mask_t, orig_w, orig_h = self._preprocess(image, mask)
+            with region("cleaner.preprocess"):
+                img_t, mask_t, orig_w, orig_h = self._preprocess(image, mask)
 
             # 2. Инференс (без градиентов для скорости)
-            with torch.no_grad():
+            with torch.no_grad(), region("cleaner.forward"):
                 output = self.model(img_t, mask_t)
 
             # 3. Постпроцессинг (Tensor -> PIL)
-            output = output[0].permute(1, 2, 0).cpu().numpy() # (3, H, W) -> (H, W, 3)
-            output = np.clip(output * 255, 0, 255).astype(np.uint8)
-            
-            result_img = Image.fromarray(output)
-            
-            # Возвращаем исходный размер (если он был не кратен 8)
-            if result_img.size != (orig_w, orig_h):
-                 result_img = result_img.resize((orig_w, orig_h), Image.LANCZOS)
-                 
-            return result_img
+            with region("cleaner.postprocess"):
+                return self._postprocess(output[0], orig_w, orig_h)
 
         except Exception as e:
             self.logger.error(f"❌ Ошибка во время inpainting: {e}")
             return image
 
+    def _postprocess(self, output, orig_w, orig_h) -> Image.Image:
+        """(3, H, W) Float 0..1 -> PIL в исходном размере."""
+        output = output.permute(1, 2, 0).cpu().numpy() # (3, H, W) -> (H, W, 3)
+        output = np.clip(output * 255, 0, 255).astype(np.uint8)
+
+        result_img = Image.fromarray(output)
+
+        # Возвращаем исходный размер (если он был не кратен 8)
+        if result_img.size != (orig_w, orig_h):
+             result_img = result_img.resize((orig_w, orig_h), Image.LANCZOS)
+
+        return result_img
+
+    @staticmethod
+    def _bucket(w, h):
+        """
+        Корзина размера для батча: стороны (уже кратные 8) округляются вверх
+        до config.CLEANER_BATCH_BUCKET. Фото из одной корзины дополняются паддингом
+        до общего размера и идут одним forward.
+        """
+        step = config.CLEANER_BATCH_BUCKET
+        return math.ceil((w // 8 * 8) / step) * step, math.ceil((h // 8 * 8) / step) * step
+
+    def clean_batch(self, images: list, masks: list) -> list:
+        """
+        Батчевая очистка. Фото группируются по корзинам размера, внутри корзины —
+        паддинг (replicate для фото, 0 для маски = "не трогать") и один forward
+        на до config.CLEANER_MAX_BATCH фото. Результат обрезается обратно.
+        Фото с пустой маской возвращаются как есть.
+        """
+        results = list(images)
+        groups = {}
+        for i, (image, mask) in enumerate(zip(images, masks)):
+            if not mask.getbbox(): continue
+            groups.setdefault(self._bucket(*image.size), []).append(i)
+
+        max_batch = max(1, config.CLEANER_MAX_BATCH)
+        for (bucket_w, bucket_h), indices in groups.items():
+            for start in range(0, len(indices), max_batch):
+                chunk = indices[start:start + max_batch]
+                if len(chunk) == 1:
+                    results[chunk[0]] = self.clean(images[chunk[0]], masks[chunk[0]])
+                    continue
+
+                try:
+                    with region("cleaner.preprocess"):
+                        imgs, msks, sizes = [], [], []
+                        for i in chunk:
+                            img_t, mask_t, orig_w, orig_h = self._preprocess(images[i], masks[i])
+                            pad_w = bucket_w - img_t.shape[3]
+                            pad_h = bucket_h - img_t.shape[2]
+                            imgs.append(F.pad(img_t, (0, pad_w, 0, pad_h), mode="replicate"))
+                            msks.append(F.pad(mask_t, (0, pad_w, 0, pad_h), value=0.0))
+                            sizes.append((img_t.shape[3], img_t.shape[2], orig_w, orig_h))
+                        img_b = torch.cat(imgs)
+                        mask_b = torch.cat(msks)
+
+                    with torch.no_grad(), region("cleaner.forward"):
+                        output = self.model(img_b, mask_b)
+
+                    with region("cleaner.postprocess"):
+                        for j, i in enumerate(chunk):
+                            w8, h8, orig_w, orig_h = sizes[j]
+                            results[i] = self._postprocess(output[j, :, :h8, :w8], orig_w, orig_h)
+
+                except Exception as e:
+                    # Например, OOM на большом батче — доделываем поштучно
+                    self.logger.error(f"❌ Ошибка батча inpainting ({len(chunk)} фото): {e}")
+                    for i in chunk:
+                        results[i] = self.clean(images[i], masks[i])
+
+        return results
+
 if __name__ == "__main__":
     # Тест запуска
     try:
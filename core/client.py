@@ -0,0 +1,294 @@
+"""
+Асинхронный клиент API (для команд, которые интегрируются с сервисом).
+
+Зависит только от aiohttp — не тянет torch / config, можно копировать в чужой проект.
+
+    async with WatermarkClient("http://host:8000") as client:
+        async for result in client.clean_many(paths):
+            if result.ok:
+                result.save(out_dir / result.path.name)
+
+* Один пул соединений (keep-alive) и ограничение параллельности (concurrency).
+* 429 / 502 / 503 и обрывы соединения — повтор с экспоненциальной задержкой,
+  при наличии Retry-After ждем ровно столько, сколько просит сервер.
+* clean_many() сам использует POST /process/bulk, если сервер его поддерживает
+  (пачками по bulk_size, ответ multipart/mixed разбирается потоком), иначе — POST /process.
+  Исключение — задан accept: bulk отдает формат входа, поэтому тогда всегда POST /process.
+  Результаты отдаются по мере готовности, а не в порядке входа.
+
+CLI: python -m core.client images_input images_cleaned --url http://localhost:8000
+"""
+
+import json
+import random
+import asyncio
+import logging
+from pathlib import Path
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".webp": "image/webp"}
+RETRY_STATUSES = {429, 502, 503}
+
+
+class CleanResult:
+    """Результат по одному файлу. status: cleaned | skipped | failed."""
+
+    __slots__ = ("path", "status", "data", "content_type", "error")
+
+    def __init__(self, path, status, data=None, content_type=None, error=None):
+        self.path = path
+        self.status = status
+        self.data = data
+        self.content_type = content_type
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.status in ("cleaned", "skipped")
+
+    def save(self, path):
+        """Сохранить результат. Расширение подставляется по Content-Type ответа."""
+        path = Path(path)
+        suffixes = [suffix for suffix, content_type in CONTENT_TYPES.items() if content_type == self.content_type]
+        if suffixes and path.suffix.lower() not in suffixes:
+            path = path.with_suffix(suffixes[0])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(self.data)
+        return path
+
+    def __repr__(self):
+        return f"CleanResult({self.path!s}, {self.status}{', ' + self.error if self.error else ''})"
+
+
+class RetryableError(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class WatermarkClient:
+    def __init__(self, base_url="http://localhost:8000", concurrency=16, timeout=300,
+                 retries=5, backoff=0.5, max_backoff=30.0, bulk_size=16, accept=None):
+        """
+        concurrency — сколько фото одновременно "в полете" (и лимит соединений пула).
+        accept — желаемый формат ответа, например "image/webp;quality=85" (None = формат входа).
+                 С accept clean_many() не использует bulk (там формат всегда по входу).
+        bulk_size — фото в одном POST /process/bulk (0 — не использовать bulk).
+        """
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.bulk_size = bulk_size
+        self.accept = accept
+        self._session = None
+        self._bulk = None  # None — еще не проверяли
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    # ------------------------------------------------------------------
+    # Повторы
+    # ------------------------------------------------------------------
+
+    def _delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return retry_after
+        # Экспонента с джиттером: клиенты не ломятся в сервер одновременно
+        return min(self.max_backoff, self.backoff * 2 ** attempt) * (0.5 + random.random() / 2)
+
+    @staticmethod
+    def _retry_after(response):
+        try:
+            return float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            return None
+
+    async def _with_retries(self, fn):
+        for attempt in range(self.retries + 1):
+            try:
+                return await fn()
+            except (RetryableError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    raise
+                delay = self._delay(attempt, getattr(e, "retry_after", None))
+                logger.debug(f"Retry {attempt + 1}/{self.retries} in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+
+    # ------------------------------------------------------------------
+    # Одно фото
+    # ------------------------------------------------------------------
+
+    async def clean(self, path, data: bytes = None) -> CleanResult:
+        """POST /process с сырым телом (без multipart). Ошибки не бросает — status="failed"."""
+        path = Path(path)
+        if data is None:
+            data = await asyncio.to_thread(path.read_bytes)
+        content_type = CONTENT_TYPES.get(path.suffix.lower(), "application/octet-stream")
+        headers = {"Content-Type": content_type}
+        if self.accept:
+            headers["Accept"] = self.accept
+
+        async def attempt():
+            async with self._session.post(f"{self.base_url}/process", data=data, headers=headers,
+                                          params={"filename": path.name}) as response:
+                if response.status in RETRY_STATUSES:
+                    raise RetryableError(f"HTTP {response.status}", self._retry_after(response))
+                body = await response.read()
+                if response.status != 200:
+                    return CleanResult(path, "failed", error=f"HTTP {response.status}: {body[:200].decode(errors='replace')}")
+                return CleanResult(path, response.headers.get("Clean-Status", "cleaned"), body,
+                                   response.headers.get("Content-Type"))
+
+        try:
+            return await self._with_retries(attempt)
+        except Exception as e:
+            return CleanResult(path, "failed", error=str(e) or type(e).__name__)
+
+    # ------------------------------------------------------------------
+    # Bulk
+    # ------------------------------------------------------------------
+
+    async def supports_bulk(self) -> bool:
+        """Есть ли на сервере POST /process/bulk (по openapi.json, проверяется один раз)."""
+        if self._bulk is None:
+            try:
+                async with self._session.get(f"{self.base_url}/openapi.json") as response:
+                    spec = await response.json() if response.status == 200 else {}
+                self._bulk = "/process/bulk" in spec.get("paths", {})
+            except Exception:
+                self._bulk = False
+        return self._bulk
+
+    async def _clean_chunk(self, paths: list, emit):
+        """
+        Одна пачка через /process/bulk (ответ multipart/mixed, разбор потоком).
+        Имена в запросе с префиксом-индексом, чтобы однозначно сопоставить ответ входу.
+        Пачка, упавшая посреди ответа, дочищается поштучно.
+        """
+        pending = dict(enumerate(paths))
+
+        async def attempt():
+            form = aiohttp.FormData()
+            for i, path in pending.items():
+                data = await asyncio.to_thread(path.read_bytes)
+                form.add_field("files", data, filename=f"{i:05d}_{path.name}",
+                               content_type=CONTENT_TYPES.get(path.suffix.lower(), "application/octet-stream"))
+
+            async with self._session.post(f"{self.base_url}/process/bulk", data=form,
+                                          headers={"Accept": "multipart/mixed"}) as response:
+                if response.status in RETRY_STATUSES:
+                    raise RetryableError(f"HTTP {response.status}", self._retry_after(response))
+                if response.status != 200:
+                    raise RuntimeError(f"HTTP {response.status}")
+
+                reader = aiohttp.MultipartReader(response.headers, response.content)
+                async for part in reader:
+                    name = part.filename or ""
+                    body = await part.read()
+                    if name == "manifest.json":
+                        for entry in json.loads(body):
+                            index = int(entry["name"].split("_", 1)[0])
+                            if index in pending and entry.get("status") == "failed":
+                                await emit(CleanResult(pending.pop(index), "failed", error=entry.get("error")))
+                        continue
+                    index = int(name.split("_", 1)[0])
+                    if index in pending:
+                        await emit(CleanResult(pending.pop(index), part.headers.get("Clean-Status", "cleaned"),
+                                               bytes(body), part.headers.get("Content-Type")))
+
+        try:
+            await self._with_retries(attempt)
+        except Exception as e:
+            logger.warning(f"Bulk chunk failed ({e}), {len(pending)} files -> /process")
+        for path in pending.values():
+            await emit(await self.clean(path))
+
+    # ------------------------------------------------------------------
+    # Много фото
+    # ------------------------------------------------------------------
+
+    async def clean_many(self, paths, bulk: bool = None):
+        """
+        Асинхронный генератор CleanResult по мере готовности.
+        bulk=None — автоматически (bulk, если сервер его поддерживает и bulk_size > 0).
+        С accept — всегда поштучно через /process: bulk выбирает формат каждого файла по его имени,
+        Accept на него не влияет.
+        """
+        paths = [Path(p) for p in paths]
+        if bulk and self.accept:
+            logger.warning(f"accept={self.accept!r}: /process/bulk не умеет выбирать формат ответа, файлы идут через /process")
+        if self.accept:
+            bulk = False
+        elif bulk is None:
+            bulk = self.bulk_size > 0 and len(paths) > 1 and await self.supports_bulk()
+
+        results = asyncio.Queue()
+        slots = asyncio.Semaphore(max(1, self.concurrency // self.bulk_size) if bulk else self.concurrency)
+
+        async def run(coro_fn, *args):
+            async with slots:
+                await coro_fn(*args)
+
+        async def single(path):
+            await results.put(await self.clean(path))
+
+        if bulk:
+            chunks = [paths[i:i + self.bulk_size] for i in range(0, len(paths), self.bulk_size)]
+            tasks = [asyncio.create_task(run(self._clean_chunk, chunk, results.put)) for chunk in chunks]
+        else:
+            tasks = [asyncio.create_task(run(single, path)) for path in paths]
+
+        try:
+            for _ in range(len(paths)):
+                yield await results.get()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _main():
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Очистка папки через API")
+    parser.add_argument("input", type=Path)
+    parser.add_argument("output", type=Path)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--accept", default=None, help='Формат ответа, например "image/webp;quality=85"')
+    parser.add_argument("--no-bulk", action="store_true")
+    args = parser.parse_args()
+
+    paths = sorted(p for p in args.input.rglob("*") if p.suffix.lower() in CONTENT_TYPES)
+    counts = {}
+    t0 = time.perf_counter()
+    async with WatermarkClient(args.url, concurrency=args.concurrency, accept=args.accept) as client:
+        async for result in client.clean_many(paths, bulk=False if args.no_bulk else None):
+            counts[result.status] = counts.get(result.status, 0) + 1
+            if result.ok:
+                await asyncio.to_thread(result.save, args.output / result.path.relative_to(args.input))
+            else:
+                print(f"❌ {result.path}: {result.error}")
+    elapsed = time.perf_counter() - t0
+    print(f"Готово: {len(paths)} фото за {elapsed:.1f}с ({len(paths) / max(elapsed, 1e-9):.2f} фото/с) {counts}")
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,99 @@
+"""
+Декодирование входа и кодирование результата для API.
+
+* decode() читает картинку прямо из принятого буфера: io.BytesIO над bytes
+  в CPython не копирует данные, пока в него не пишут.
+* negotiate() выбирает формат ответа по заголовку Accept (WebP / JPEG / PNG),
+  с учетом q и подсказки качества: `Accept: image/webp;quality=80`.
+  Без Accept (или */*) формат сохраняется: JPEG -> JPEG, WebP -> WebP, остальное -> PNG.
+* encode() пишет в BytesIO; отдавать его стоит через getbuffer() (memoryview, без копии).
+"""
+
+import io
+from pathlib import PurePosixPath
+
+from PIL import Image
+
+import config
+
+# MIME -> (формат PIL, расширение)
+FORMATS = {
+    "image/jpeg": ("JPEG", ".jpg"),
+    "image/png": ("PNG", ".png"),
+    "image/webp": ("WEBP", ".webp"),
+}
+INPUT_TYPES = set(FORMATS)
+_SUFFIX_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".webp": "image/webp"}
+
+
+class NotAcceptable(ValueError):
+    """В Accept нет ни одного формата, который мы умеем отдавать."""
+
+
+def decode(buffer) -> Image.Image:
+    """bytes / memoryview -> RGB."""
+    return Image.open(io.BytesIO(buffer)).convert("RGB")
+
+
+def default_output(name: str, content_type: str = None):
+    """(Формат PIL, MIME, расширение) результата, если клиент не просил другое: формат входа."""
+    mime = content_type if content_type in FORMATS else _SUFFIX_TYPES.get(PurePosixPath(name or "").suffix.lower())
+    if mime not in FORMATS:
+        mime = "image/png"
+    fmt, ext = FORMATS[mime]
+    return fmt, mime, ext
+
+
+def negotiate(accept: str, name: str, content_type: str = None):
+    """
+    Accept -> (формат PIL, MIME, расширение, качество или None).
+    Среди подходящих берется максимальный q; при равном q явный тип важнее image/* и */*.
+    """
+    default = default_output(name, content_type)
+    if not accept:
+        return default + (None,)
+
+    best = None
+    for position, part in enumerate(accept.split(",")):
+        media, *params = [p.strip() for p in part.split(";")]
+        media = media.lower()
+        q, quality = 1.0, None
+        for param in params:
+            key, _, value = param.partition("=")
+            key, value = key.strip().lower(), value.strip()
+            try:
+                if key == "q":
+                    q = float(value)
+                elif key == "quality":
+                    quality = max(1, min(100, int(value)))
+            except ValueError:
+                continue
+
+        if q <= 0:
+            continue
+        if media in FORMATS:
+            candidate, exact = (FORMATS[media][0], media, FORMATS[media][1]), 1
+        elif media in ("image/*", "*/*"):
+            candidate, exact = default, 0
+        else:
+            continue
+
+        rank = (q, exact, -position)
+        if best is None or rank > best[0]:
+            best = (rank, candidate, quality)
+
+    if best is None:
+        raise NotAcceptable(accept)
+    return best[1] + (best[2],)
+
+
+def encode(image: Image.Image, fmt: str, quality: int = None) -> io.BytesIO:
+    """RGB -> BytesIO в нужном формате. quality=None — значения по умолчанию из config."""
+    buf = io.BytesIO()
+    if fmt == "PNG":
+        image.save(buf, format="PNG", compress_level=config.API_PNG_COMPRESS_LEVEL)
+    elif fmt == "WEBP":
+        image.save(buf, format="WEBP", quality=quality or config.API_WEBP_QUALITY, method=config.API_WEBP_METHOD)
+    else:
+        image.save(buf, format=fmt, quality=quality or config.API_JPEG_QUALITY)
+    return buf
@@ -0,0 +1,104 @@
+"""
+Манифест синтетического датасета: train_dataset/manifest.jsonl.
+
+Одна JSON строка на готовый пример (дописывается сразу после записи файлов):
+{"index": 42, "source": "000000000139.jpg:161811", "seed": 42, "trace": ["watermark", "hard"], "config": "9f2c...",
+ "split": "train", "status": "positive", "files": ["images/train/syn_000042.jpg", "labels/train/syn_000042.txt"]}
+
+* Пример валиден, если совпали фон, сид и хэш настроек, которые он использовал (synth.sample_hash
+  по записанным решениям trace), и все его файлы на месте. Такой пример при перезапуске пропускается.
+  Смена GEN_* с другого пути (например, GEN_WM_ATLAS_* при выключенном банке) его не трогает.
+* Сплит в хэш не входит: при смене GEN_TRAIN_RATIO готовые файлы переносятся (move), а не пересоздаются.
+* Падение посреди генерации: файлы без строки в манифесте считаются мусором и пересоздаются.
+* Последняя строка по индексу главнее предыдущих; compact() переписывает файл начисто.
+"""
+
+import json
+import logging
+import re
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.jsonl"
+_SAMPLE_RE = re.compile(r"^syn_(\d+)\.(jpg|txt)$")
+
+
+class DatasetManifest:
+    def __init__(self, base_dir: Path):
+        self.base_dir = Path(base_dir)
+        self.path = self.base_dir / MANIFEST_NAME
+        self.entries = {}
+        self._file = None
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.entries[entry["index"]] = entry
+                    except (ValueError, KeyError):
+                        continue  # Недописанная последняя строка после падения
+
+    def is_valid(self, index: int, source: str, seed: int, config_hash) -> bool:
+        """config_hash(trace) -> хэш текущих значений настроек, которые пример прочитал."""
+        entry = self.entries.get(index)
+        if entry is None or "trace" not in entry:
+            return False
+        if (entry.get("source"), entry.get("seed")) != (source, seed):
+            return False
+        if entry.get("config") != config_hash(entry["trace"]):
+            return False
+        return all((self.base_dir / f).exists() for f in entry.get("files", []))
+
+    def move(self, index: int, split: str, files: list):
+        """Перенести файлы готового примера в другой сплит (os.replace) и дописать строку."""
+        entry = self.entries[index]
+        for old, new in zip(entry["files"], files):
+            if old != new:
+                (self.base_dir / old).replace(self.base_dir / new)
+        self.add({**entry, "split": split, "files": files})
+
+    def add(self, entry: dict):
+        """Дописать строку (построчная буферизация: после падения теряется максимум одна)."""
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+        self.entries[entry["index"]] = entry
+        self._file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def drop(self, index: int):
+        self.entries.pop(index, None)
+
+    def compact(self, keep=None):
+        """Переписать манифест: по строке на индекс (только keep, если задан). Атомарно."""
+        self.close()
+        if keep is not None:
+            self.entries = {i: e for i, e in self.entries.items() if i in keep}
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for index in sorted(self.entries):
+                f.write(json.dumps(self.entries[index], ensure_ascii=False, separators=(",", ":")) + "\n")
+        tmp.replace(self.path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def scan_sample_files(base_dir: Path) -> dict:
+    """{index: [относительные пути]} по всем syn_*.jpg / syn_*.txt в images/* и labels/*."""
+    base_dir = Path(base_dir)
+    found = {}
+    for kind in ("images", "labels"):
+        root = base_dir / kind
+        if not root.exists():
+            continue
+        for split_dir in root.iterdir():
+            if not split_dir.is_dir():
+                continue
+            for path in split_dir.iterdir():
+                match = _SAMPLE_RE.match(path.name)
+                if match:
+                    found.setdefault(int(match.group(1)), []).append(path.relative_to(base_dir).as_posix())
+    return found
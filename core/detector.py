@@ -6,8 +6,22 @@ import logging
 import cv2
 import numpy as np
 from PIL import Image
-from ultralytics import YOLO
 import config
+from core.profiler import region
+
+def rle_encode(mask: np.ndarray) -> dict:
+    """
+    Несжатый RLE в формате COCO: обход по столбцам (column-major),
+    counts начинается с длины серии нулей. pycocotools.mask.frPyObjects читает его напрямую.
+    """
+    h, w = mask.shape
+    flat = (mask.ravel(order="F") > 0).astype(np.int8)
+    changes = np.flatnonzero(np.diff(flat)) + 1
+    bounds = np.concatenate(([0], changes, [flat.size]))
+    counts = np.diff(bounds).tolist()
+    if flat.size and flat[0]:
+        counts.insert(0, 0)
+    return {"size": [h, w], "counts": counts}
 
 class YourClassDetector:
     def __init__(self):
@@ -17,34 +31,35 @@ class YourClassDetector:
 
         self.logger.info(f"⏳ Загрузка YOLO: {config.YOLO_MODEL_PATH}...")
         try:
+            from ultralytics import YOLO  # Лениво: импорт ultralytics ~1-2с, нужен только при загрузке модели
             self.model = YOLO(config.YOLO_MODEL_PATH)
         except Exception as e:
             self.logger.critical(f"❌ Ошибка YOLO: {e}")
             raise e
 
-    def get_mask(self, image: Image.Image) -> Image.Image:
-        w, h = image.size
-
-        try:
-            results = self.model.predict(
-                source=image,
+    def _predict(self, source):
+        with region("detector.predict"):
+            return self.model.predict(
+                source=source,
                 conf=config.YOLO_CONFIDENCE,
                 device=config.DEVICE,
                 verbose=False,
                 retina_masks=True
             )
-        except Exception as e:
-            self.logger.error(f"Prediction Error: {e}")
-            return Image.new("L", (w, h), 0)
 
+    def _result_to_mask(self, result, w, h, stats: dict = None) -> Image.Image:
         final_mask = np.zeros((h, w), dtype=np.uint8)
+        components = 0
 
-        if results and results[0].masks:
-            result = results[0]
+        if result is not None and result.masks:
             for polygon in result.masks.xy:
                 if len(polygon) == 0: continue
                 points = np.array(polygon, dtype=np.int32)
                 cv2.fillPoly(final_mask, [points], 255)
+                components += 1
+
+        if stats is not None:
+            stats["components"] = components
 
         # Dilation из конфига
         dil_px = config.CLEANER_MASK_DILATION
@@ -54,5 +69,80 @@ class YourClassDetector:
 
         return Image.fromarray(final_mask)
 
+    def get_mask(self, image: Image.Image, stats: dict = None) -> Image.Image:
+        """
+        Маска ватермарки (L, 0/255) в размере исходного фото.
+        stats (опционально) — сюда пишется число найденных полигонов ("components").
+        """
+        w, h = image.size
+
+        try:
+            results = self._predict(image)
+        except Exception as e:
+            self.logger.error(f"Prediction Error: {e}")
+            if stats is not None:
+                stats["components"] = 0
+            return Image.new("L", (w, h), 0)
+
+        return self._result_to_mask(results[0] if results else None, w, h, stats)
+
+    def get_masks(self, images: list, stats: list = None) -> list:
+        """
+        Батчевая версия get_mask: один forward YOLO на весь список.
+        Размеры могут отличаться (ultralytics сам делает letterbox до imgsz).
+        При ошибке батча — откат на поштучную обработку.
+        """
+        if len(images) == 1:
+            return [self.get_mask(images[0], stats[0] if stats else None)]
+
+        try:
+            results = self._predict(list(images))
+        except Exception as e:
+            self.logger.error(f"Batch Prediction Error ({len(images)} img): {e}")
+            return [self.get_mask(img, stats[i] if stats else None) for i, img in enumerate(images)]
+
+        masks = []
+        for i, img in enumerate(images):
+            w, h = img.size
+            masks.append(self._result_to_mask(results[i], w, h, stats[i] if stats else None))
+        return masks
+
+    def detect(self, image: Image.Image, original_size=None, rle: bool = False) -> dict:
+        """
+        Только детекция (без LaMa) -> JSON-совместимый dict:
+        {"width", "height", "found", "detections": [{"confidence", "bbox": [x1, y1, x2, y2], "polygon": [[x, y], ...]}]}
+        original_size=(w, h): пришла уменьшенная копия — координаты пересчитываются в масштаб оригинала.
+        rle=True: добавляет "mask_rle" (маска без dilation, в размере оригинала).
+        Ошибки модели пробрасываются: пустой ответ тут выглядел бы как "ватермарки нет".
+        """
+        w, h = image.size
+        ow, oh = original_size or (w, h)
+        sx, sy = ow / w, oh / h
+
+        results = self._predict(image)
+        result = results[0] if results else None
+
+        detections = []
+        if result is not None and result.boxes is not None and len(result.boxes):
+            boxes = result.boxes.xyxy.cpu().numpy() * np.array([sx, sy, sx, sy], dtype=np.float32)
+            confs = result.boxes.conf.cpu().numpy()
+            polygons = result.masks.xy if result.masks is not None else [np.empty((0, 2))] * len(boxes)
+            for box, conf, polygon in zip(boxes, confs, polygons):
+                points = np.asarray(polygon, dtype=np.float32).reshape(-1, 2) * np.array([sx, sy], dtype=np.float32)
+                detections.append({
+                    "confidence": round(float(conf), 4),
+                    "bbox": [round(float(v), 1) for v in box],
+                    "polygon": np.round(points, 1).tolist(),
+                })
+
+        body = {"width": ow, "height": oh, "found": bool(detections), "detections": detections}
+        if rle:
+            mask = np.zeros((oh, ow), dtype=np.uint8)
+            for det in detections:
+                if det["polygon"]:
+                    cv2.fillPoly(mask, [np.array(det["polygon"], dtype=np.int32)], 255)
+            body["mask_rle"] = rle_encode(mask)
+        return body
+
 if __name__ == "__main__":
     YourClassDetector()
\ No newline at end of file
@@ -0,0 +1,228 @@
+"""
+Общий загрузчик моделей и датасетов.
+
+* Большие буферы (config.DOWNLOAD_CHUNK_SIZE) вместо iter_content(1024).
+* Файл качается кусками по HTTP Range в config.DOWNLOAD_WORKERS потоков прямо в <файл>.part;
+  готовые куски отмечаются в <файл>.part.json. Обрыв, Ctrl+C, падение — следующий запуск
+  докачивает только недостающие куски (если на сервере тот же файл: размер + ETag/Last-Modified).
+  Сервер без Range — обычное скачивание одним потоком с нуля.
+* SHA-256 сверяется с закрепленным в config.py (*_SHA256). Не совпал — файл не подменяется.
+* Подмена атомарная (os.replace): на месте итогового файла никогда не бывает недокачанного.
+* Рядом кладется штамп <файл>.sha256 (хэш + размер + mtime): проверка уже лежащего файла
+  не пересчитывает хэш гигабайта при каждом запуске.
+
+Сеть — только через переданную requests.Session: загрузчик проверяется на локальном HTTP-сервере.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from tqdm import tqdm
+
+import config
+
+logger = logging.getLogger(__name__)
+
+HASH_BLOCK = 4 * 2**20
+
+
+class DownloadError(Exception):
+    pass
+
+
+def _part_path(dest: Path) -> Path:
+    return dest.with_name(dest.name + ".part")
+
+
+def _meta_path(dest: Path) -> Path:
+    return dest.with_name(dest.name + ".part.json")
+
+
+def _stamp_path(dest: Path) -> Path:
+    return dest.with_name(dest.name + ".sha256")
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(HASH_BLOCK):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _write_json(path: Path, data: dict):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(data), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _write_stamp(path: Path, digest: str):
+    st = path.stat()
+    _write_json(_stamp_path(path), {"sha256": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns})
+
+
+def is_verified(path: Path, sha256: str = None) -> bool:
+    """
+    Файл на месте и (если sha256 задан) совпадает с ним.
+    Хэш считается один раз: дальше хватает штампа, пока не изменились размер и mtime.
+    """
+    path = Path(path)
+    if not path.exists():
+        return False
+    if sha256 is None:
+        return True
+    sha256 = sha256.lower()
+    st = path.stat()
+    try:
+        stamp = json.loads(_stamp_path(path).read_text(encoding="utf-8"))
+        if stamp == {"sha256": sha256, "size": st.st_size, "mtime_ns": st.st_mtime_ns}:
+            return True
+    except (OSError, ValueError):
+        pass
+
+    actual = file_sha256(path)
+    if actual != sha256:
+        logger.warning(f"⚠️ {path.name}: SHA-256 {actual} не совпадает с ожидаемым {sha256}")
+        return False
+    _write_stamp(path, actual)
+    return True
+
+
+def _probe(session, url):
+    """(размер или None, поддержка Range, валидатор версии файла) — запросом первого байта."""
+    with session.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=config.DOWNLOAD_TIMEOUT) as r:
+        r.raise_for_status()
+        validator = r.headers.get("ETag") or r.headers.get("Last-Modified")
+        if r.status_code == 206 and "/" in r.headers.get("Content-Range", ""):
+            total = r.headers["Content-Range"].rsplit("/", 1)[1]
+            if total.isdigit():
+                return int(total), True, validator
+        length = r.headers.get("Content-Length")
+        return (int(length) if length and r.status_code == 200 else None), False, validator
+
+
+def _fetch_piece(session, url, part, start, end, bar):
+    """Кусок [start, end] в part с повторами. Недокачанный кусок при повторе пишется заново."""
+    for attempt in range(config.DOWNLOAD_RETRIES + 1):
+        got = 0
+        try:
+            with session.get(url, headers={"Range": f"bytes={start}-{end}"}, stream=True,
+                             timeout=config.DOWNLOAD_TIMEOUT) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise DownloadError(f"Сервер не отдал Range {start}-{end} (HTTP {r.status_code})")
+                with open(part, "r+b") as f:
+                    f.seek(start)
+                    for chunk in r.iter_content(chunk_size=config.DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        got += len(chunk)
+                        bar.update(len(chunk))
+            if got != end - start + 1:
+                raise DownloadError(f"Кусок {start}-{end}: получено {got} байт")
+            return
+        except (requests.RequestException, DownloadError) as e:
+            bar.update(-got)
+            if attempt == config.DOWNLOAD_RETRIES:
+                raise DownloadError(f"Кусок {start}-{end} не скачан за {attempt + 1} попыток: {e}") from e
+            logger.warning(f"🔁 Кусок {start}-{end}: {e}. Повтор {attempt + 1}/{config.DOWNLOAD_RETRIES}")
+            time.sleep(min(2 ** attempt, 30))
+
+
+def _download_ranges(session, url, part, meta_path, meta, workers, bar):
+    size = meta["size"]
+    piece = config.DOWNLOAD_PIECE_SIZE
+    done = set(meta["pieces"])
+    todo = [i for i in range(math.ceil(size / piece)) if i not in done]
+
+    with open(part, "r+b" if part.exists() else "w+b") as f:
+        f.truncate(size)
+
+    lock = threading.Lock()
+
+    def fetch(i):
+        _fetch_piece(session, url, part, i * piece, min(size, (i + 1) * piece) - 1, bar)
+        with lock:
+            done.add(i)
+            meta["pieces"] = sorted(done)
+            _write_json(meta_path, meta)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        # list(): первая же ошибка куска поднимается здесь, остальные куски доделываются
+        list(pool.map(fetch, todo))
+
+
+def _download_stream(session, url, part, bar):
+    with session.get(url, stream=True, timeout=config.DOWNLOAD_TIMEOUT) as r:
+        r.raise_for_status()
+        with open(part, "wb") as f:
+            for chunk in r.iter_content(chunk_size=config.DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                bar.update(len(chunk))
+
+
+def download(url: str, dest: Path, sha256: str = None, workers: int = None,
+             session: requests.Session = None, progress: bool = True) -> Path:
+    """
+    Скачать url в dest (с докачкой и проверкой sha256). Возвращает dest.
+    DownloadError — сеть не справилась за DOWNLOAD_RETRIES повторов или не совпал хэш.
+    """
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    part, meta_path = _part_path(dest), _meta_path(dest)
+    session = session or requests.Session()
+    workers = config.DOWNLOAD_WORKERS if workers is None else workers
+
+    size, ranges, validator = _probe(session, url)
+    meta = {"url": url, "size": size, "validator": validator, "pieces": []}
+    try:
+        old = json.loads(meta_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        old = None
+    resumable = ranges and size and part.exists() and old and \
+        (old.get("url"), old.get("size"), old.get("validator")) == (url, size, validator)
+    if resumable:
+        meta["pieces"] = old.get("pieces", [])
+    else:
+        part.unlink(missing_ok=True)
+    _write_json(meta_path, meta)
+
+    piece = config.DOWNLOAD_PIECE_SIZE
+    initial = sum(min(piece, size - i * piece) for i in meta["pieces"]) if size else 0
+    if initial:
+        logger.info(f"⏯️ {dest.name}: докачка, уже есть {initial / 2**20:.0f} МБ из {size / 2**20:.0f} МБ")
+
+    with tqdm(desc=dest.name, total=size, initial=initial, unit="iB", unit_scale=True,
+              unit_divisor=1024, disable=not progress) as bar:
+        if ranges and size:
+            _download_ranges(session, url, part, meta_path, meta, workers, bar)
+        else:
+            _download_stream(session, url, part, bar)
+
+    actual = file_sha256(part)
+    if sha256 is not None and actual != sha256.lower():
+        part.unlink(missing_ok=True)
+        meta_path.unlink(missing_ok=True)
+        raise DownloadError(f"{dest.name}: SHA-256 {actual} не совпадает с ожидаемым {sha256.lower()}")
+    if sha256 is None:
+        logger.info(f"🔑 {dest.name}: SHA-256 {actual} (можно закрепить в config.py)")
+
+    os.replace(part, dest)
+    meta_path.unlink(missing_ok=True)
+    _write_stamp(dest, actual)
+    return dest
+
+
+def ensure_file(dest: Path, url: str, sha256: str = None, **kwargs) -> Path:
+    """Файл, проверенный по sha256: уже лежащий или скачанный заново (битый заменяется)."""
+    dest = Path(dest)
+    if is_verified(dest, sha256):
+        return dest
+    return download(url, dest, sha256, **kwargs)
@@ -0,0 +1,289 @@
+"""
+Асинхронные задачи API (POST /jobs -> GET /jobs/{id}).
+
+Зачем: большие фото на CPU обрабатываются дольше таймаута балансировщика,
+синхронный /process обрывается и ретраится — работа делается дважды.
+Здесь клиент сразу получает ID, а результат забирает потом (или ждет webhook).
+
+Хранение (переживает рестарт):
+* jobs/jobs.sqlite3 — очередь и статусы.
+* jobs/input/<id>   — исходник.
+* jobs/results/<id>.<ext> — результат.
+Задачи в статусе running при старте возвращаются в очередь (процесс упал посреди работы).
+Готовые результаты удаляются через config.API_JOB_TTL_HOURS.
+"""
+
+import time
+import uuid
+import asyncio
+import logging
+import sqlite3
+import threading
+
+import config
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    filename TEXT,
+    fmt TEXT,
+    mime TEXT,
+    result_ext TEXT,
+    clean_status TEXT,
+    error TEXT,
+    webhook TEXT,
+    base_url TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    expires REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs(status, created);
+"""
+
+
+class JobStore:
+    """
+    SQLite + файлы на диске. Все методы синхронные и быстрые (мс);
+    из async-кода их зовут через asyncio.to_thread, чтобы не держать event loop.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or config.JOBS_DIR
+        self.input_dir = self.root / "input"
+        self.result_dir = self.root / "results"
+        self.input_dir.mkdir(parents=True, exist_ok=True)
+        self.result_dir.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.root / "jobs.sqlite3", check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        # Счетчик задач в очереди: create/claim/recover меняют его под тем же замком,
+        # так что /metrics и допуск в POST /jobs читают число, а не делают COUNT в SQLite
+        self.queued = self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+
+    def input_path(self, job_id):
+        return self.input_dir / job_id
+
+    def result_path(self, job_id, ext):
+        return self.result_dir / f"{job_id}{ext}"
+
+    def create(self, contents: bytes, filename, fmt, mime, result_ext, webhook=None, base_url=None) -> str:
+        job_id = uuid.uuid4().hex
+        # Сначала файл, потом строка: в очереди не бывает задачи без входа
+        path = self.input_path(job_id)
+        tmp = path.with_suffix(".part")
+        tmp.write_bytes(contents)
+        tmp.replace(path)
+
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, status, filename, fmt, mime, result_ext, webhook, base_url, created, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, filename, fmt, mime, result_ext, webhook, base_url, now, now),
+            )
+            self.queued += 1
+        return job_id
+
+    def claim(self):
+        """Взять самую старую задачу из очереди (атомарно) -> dict или None."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is None:
+                    self._db.execute("COMMIT")
+                    return None
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                    (RUNNING, time.time(), row["id"]),
+                )
+                self._db.execute("COMMIT")
+                self.queued -= 1
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return dict(row)
+
+    def finish(self, job_id, status, clean_status=None, error=None):
+        now = time.time()
+        expires = now + config.API_JOB_TTL_HOURS * 3600
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, clean_status = ?, error = ?, updated = ?, expires = ? WHERE id = ?",
+                (status, clean_status, error, now, expires, job_id),
+            )
+        self.input_path(job_id).unlink(missing_ok=True)
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def recover(self) -> int:
+        """После рестарта: running -> queued (или failed, если попытки кончились)."""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = 'Too many attempts', updated = ?, expires = ?"
+                " WHERE status = ? AND attempts >= ?",
+                (FAILED, now, now + config.API_JOB_TTL_HOURS * 3600, RUNNING, config.API_JOB_MAX_ATTEMPTS),
+            )
+            cur = self._db.execute("UPDATE jobs SET status = ?, updated = ? WHERE status = ?", (QUEUED, now, RUNNING))
+            self.queued += cur.rowcount
+        return cur.rowcount
+
+    def expire(self) -> int:
+        """Удалить задачи (и файлы), у которых истек TTL."""
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, result_ext FROM jobs WHERE expires IS NOT NULL AND expires < ?", (now,)
+            ).fetchall()
+            self._db.execute("DELETE FROM jobs WHERE expires IS NOT NULL AND expires < ?", (now,))
+        for row in rows:
+            self.input_path(row["id"]).unlink(missing_ok=True)
+            self.result_path(row["id"], row["result_ext"] or "").unlink(missing_ok=True)
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class JobRunner:
+    """
+    Фоновые воркеры, которые разбирают очередь задач.
+
+    process(contents, job) -> (bytes, clean_status) — корутина (в API это clean_contents
+    через общий микро-батчинг). Воркеров config.API_JOB_WORKERS: столько фото задачи
+    держат в очереди моделей одновременно, т.е. очередь разбирается на полной мощности
+    моделей, но не вытесняет синхронные /process целиком.
+    """
+
+    def __init__(self, store: JobStore, process, workers=None):
+        self.store = store
+        self.process = process
+        self.workers = workers or config.API_JOB_WORKERS
+        self._wakeup = None
+        self._tasks = []
+        self._session = None
+        metrics.QUEUE_DEPTH.labels("jobs").set_function(lambda: self.store.queued)
+
+    async def start(self):
+        recovered = await asyncio.to_thread(self.store.recover)
+        if recovered:
+            logger.info(f"♻️ Возвращено в очередь после рестарта: {recovered} задач")
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._janitor()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._session is not None:
+            await self._session.close()
+        self.store.close()
+
+    async def submit(self, contents, filename, fmt, mime, result_ext, webhook=None, base_url=None) -> str:
+        job_id = await asyncio.to_thread(
+            self.store.create, contents, filename, fmt, mime, result_ext, webhook, base_url
+        )
+        self._wakeup.set()
+        return job_id
+
+    async def _worker(self):
+        while True:
+            job = await asyncio.to_thread(self.store.claim)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                # Остановка сервера посреди задачи — вернется в очередь при следующем старте
+                raise
+            except Exception as e:
+                logger.error(f"Job {job['id']} failed: {e}")
+                await asyncio.to_thread(self.store.finish, job["id"], FAILED, None, str(e))
+                await self._notify(job["id"])
+
+    async def _run(self, job):
+        job_id = job["id"]
+        contents = await asyncio.to_thread(self.store.input_path(job_id).read_bytes)
+        data, clean_status = await self.process(contents, job)
+
+        path = self.store.result_path(job_id, job["result_ext"])
+        tmp = path.with_suffix(".part")
+        await asyncio.to_thread(tmp.write_bytes, data)
+        await asyncio.to_thread(tmp.replace, path)
+        await asyncio.to_thread(self.store.finish, job_id, DONE, clean_status)
+        await self._notify(job_id)
+
+    async def _notify(self, job_id):
+        """Webhook: POST JSON со статусом. 3 попытки, ошибки только в лог."""
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if not job or not job.get("webhook"):
+            return
+
+        import aiohttp
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+
+        payload = describe(job)
+        for attempt in range(3):
+            try:
+                async with self._session.post(job["webhook"], json=payload) as response:
+                    if response.status < 500:
+                        return
+            except Exception as e:
+                logger.warning(f"Webhook {job_id} attempt {attempt + 1}: {e}")
+            await asyncio.sleep(2 ** attempt)
+        logger.error(f"Webhook {job_id} не доставлен: {job['webhook']}")
+
+    async def _janitor(self):
+        while True:
+            try:
+                removed = await asyncio.to_thread(self.store.expire)
+                if removed:
+                    logger.info(f"🧹 Удалено просроченных задач: {removed}")
+            except Exception as e:
+                logger.error(f"Job cleanup error: {e}")
+            await asyncio.sleep(60)
+
+
+def describe(job: dict) -> dict:
+    """Публичное представление задачи (для GET /jobs/{id} и webhook)."""
+    body = {
+        "id": job["id"],
+        "status": job["status"],
+        "clean_status": job.get("clean_status"),
+        "error": job.get("error"),
+        "filename": job.get("filename"),
+        "created": job["created"],
+        "updated": job["updated"],
+        "expires": job.get("expires"),
+        "result_url": None,
+    }
+    if job["status"] == DONE:
+        body["result_url"] = f"{(job.get('base_url') or '/').rstrip('/')}/jobs/{job['id']}/result"
+    return body
@@ -0,0 +1,320 @@
+"""
+Метрики в формате Prometheus (text exposition 0.0.4).
+
+Один реестр на процесс, общий для 3_run_pipeline.py и 4_api_pipeline.py.
+Без внешних зависимостей: запись метрики — это bisect + пара сложений под
+неконкурентным локом, так что в горячем цикле (на каждое фото) это ничего не стоит.
+
+Отдача:
+* API — эндпоинт GET /metrics.
+* Пайплайн — локальный HTTP порт (config.METRICS_PORT), если он задан.
+"""
+
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Бакеты задержек (сек): от 5 мс до 2 минут (большие фото на CPU)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Бакеты доли площади маски от площади кадра
+AREA_BUCKETS = (0.001, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.35, 0.5, 0.75, 1.0)
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{str(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+class _Metric:
+    """База: имя, описание и дочерние серии по значениям лейблов."""
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        (registry or REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """
+        Возвращает серию для значений лейблов.
+        В горячем пути лучше взять её один раз и сохранить в переменную.
+        """
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name}: ожидались лейблы {self.labelnames}")
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _single(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name}: метрика с лейблами, используй .labels()")
+        return self._children[()]
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, key))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("_value", "_lock")
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self._value += amount
+
+    def render(self, name, labelnames, key):
+        return [f"{name}{_format_labels(labelnames, key)} {_format_value(self._value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1.0):
+        self._single().inc(amount)
+
+
+class _GaugeChild:
+    __slots__ = ("_value", "_fn", "_lock")
+
+    def __init__(self):
+        self._value = 0.0
+        self._fn = None
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1.0):
+        self.inc(-amount)
+
+    def set_function(self, fn):
+        """Значение считается в момент скрейпа (ноль затрат в горячем пути)."""
+        self._fn = fn
+
+    def get(self):
+        if self._fn is not None:
+            try:
+                return self._fn()
+            except Exception:
+                return float("nan")
+        return self._value
+
+    def render(self, name, labelnames, key):
+        return [f"{name}{_format_labels(labelnames, key)} {_format_value(self.get())}"]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._single().set(value)
+
+    def inc(self, amount=1.0):
+        self._single().inc(amount)
+
+    def dec(self, amount=1.0):
+        self._single().dec(amount)
+
+    def set_function(self, fn):
+        self._single().set_function(fn)
+
+
+class _HistogramChild:
+    __slots__ = ("_upper", "_counts", "_sum", "_count", "_lock")
+
+    def __init__(self, buckets):
+        self._upper = buckets
+        self._counts = [0] * (len(buckets) + 1)  # Последний — +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self._upper, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+            self._count += 1
+
+    def render(self, name, labelnames, key):
+        lines = []
+        cumulative = 0
+        bounds = list(self._upper) + [float("inf")]
+        for bound, count in zip(bounds, self._counts):
+            cumulative += count
+            le = (("le", _format_value(bound)),)
+            lines.append(f"{name}_bucket{_format_labels(labelnames, key, le)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, key)} {_format_value(self._sum)}")
+        lines.append(f"{name}_count{_format_labels(labelnames, key)} {self._count}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._single().observe(value)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ==============================================================================
+# Метрики проекта (общие для пайплайна и API)
+# ==============================================================================
+STAGE_SECONDS = Histogram(
+    "wm_stage_seconds", "Latency of a processing stage per image.",
+    labelnames=("stage",), buckets=LATENCY_BUCKETS,
+)
+IMAGES_TOTAL = Counter(
+    "wm_images_total", "Images processed, by outcome.",
+    labelnames=("status",),
+)
+QUEUE_DEPTH = Gauge(
+    "wm_queue_depth", "Items waiting in an internal queue.",
+    labelnames=("queue",),
+)
+MODEL_LOAD_SECONDS = Gauge(
+    "wm_model_load_seconds", "Time spent loading a model at startup.",
+    labelnames=("model",),
+)
+STARTUP_SECONDS = Gauge(
+    "wm_startup_seconds", "Cold start duration by phase.",
+    labelnames=("phase",),
+)
+MASK_AREA_RATIO = Histogram(
+    "wm_mask_area_ratio", "Fraction of the frame covered by the detected mask.",
+    buckets=AREA_BUCKETS,
+)
+VIDEO_FRAMES_TOTAL = Counter(
+    "wm_video_frames_total", "Video/animation frames, by whether the mask was detected or reused.",
+    labelnames=("mask",),
+)
+AVOIDED_WORK = Counter(
+    "wm_avoided_work_total", "Model work skipped because nobody would get the result.",
+    labelnames=("reason",),
+)
+
+# Готовые серии для горячего пути
+DECODE_SECONDS = STAGE_SECONDS.labels("decode")
+DETECT_SECONDS = STAGE_SECONDS.labels("detect")
+CLEAN_SECONDS = STAGE_SECONDS.labels("clean")
+ENCODE_SECONDS = STAGE_SECONDS.labels("encode")
+CLEANED_TOTAL = IMAGES_TOTAL.labels("cleaned")
+SKIPPED_TOTAL = IMAGES_TOTAL.labels("skipped")
+FAILED_TOTAL = IMAGES_TOTAL.labels("failed")
+TIMEOUT_TOTAL = IMAGES_TOTAL.labels("timeout")
+
+
+def mask_area_ratio(mask) -> float:
+    """Доля ненулевых пикселей маски (PIL 'L'). histogram() считается в C."""
+    hist = mask.histogram()
+    total = mask.size[0] * mask.size[1]
+    if total == 0:
+        return 0.0
+    return 1.0 - hist[0] / total
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Скрейпы раз в 15 сек не нужны в pipeline.log
+
+
+def start_http_server(port=None, addr=None):
+    """
+    Поднимает /metrics в фоновом daemon-потоке.
+    Возвращает сервер (или None, если порт не задан).
+    """
+    port = port if port is not None else config.METRICS_PORT
+    addr = addr if addr is not None else config.METRICS_ADDR
+    if not port:
+        return None
+
+    server = ThreadingHTTPServer((addr, int(port)), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    logger.info(f"📈 Метрики: http://{addr}:{port}/metrics")
+    return server
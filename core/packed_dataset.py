@@ -0,0 +1,234 @@
+"""
+Упакованный датасет для обучения (config.TRAIN_DATA_FORMAT = "packed").
+
+Каждая эпоха в режиме "files" заново декодирует десятки тысяч JPEG и парсит .txt разметки.
+Упаковка делает это один раз на сплит:
+    train_dataset/packed/<split>/shard_000.u8 ...  — кадры BGR uint8 подряд, уже уменьшенные
+                                                    как в BaseDataset.load_image (длинная сторона = imgsz)
+    train_dataset/packed/<split>/index.npz         — на кадр: шард, смещение, (h, w), исходные (h0, w0),
+                                                    диапазон полигонов; полигоны: класс + точки (float32)
+    train_dataset/packed/<split>/meta.json         — имена, imgsz, отпечаток исходных файлов
+Шарды (config.TRAIN_PACK_SHARD_MB) открываются через np.memmap: воркеры даталоадера читают
+кадры из общего page cache ОС, без декодирования. Даталоадер YOLO — core/packed_trainer.py.
+
+Отпечаток — имена, размеры и mtime картинок и разметки + imgsz: генератор что-то пересоздал
+или поменялся TRAIN_IMG_SIZE — ensure() перепаковывает сплит.
+"""
+
+import json
+import hashlib
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import config
+from core.bg_cache import imap_window
+
+logger = logging.getLogger(__name__)
+
+PACK_VERSION = 1
+INDEX_NAME = "index.npz"
+META_NAME = "meta.json"
+
+
+def pack_dir(split: str, base_dir: Path = None) -> Path:
+    return Path(base_dir or config.TRAIN_DATASET_DIR) / "packed" / split
+
+
+def _source_files(split: str, base_dir: Path):
+    """[(картинка, разметка)] сплита в порядке имен."""
+    base_dir = Path(base_dir)
+    images = sorted((base_dir / "images" / split).glob("*.jpg"))
+    return [(img, base_dir / "labels" / split / f"{img.stem}.txt") for img in images]
+
+
+def fingerprint(files: list, imgsz: int) -> str:
+    h = hashlib.sha256(json.dumps([PACK_VERSION, imgsz]).encode())
+    for img, label in files:
+        for path in (img, label):
+            try:
+                st = path.stat()
+                h.update(f"{path.name}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+            except FileNotFoundError:
+                h.update(f"{path.name}:-\n".encode())
+    return h.hexdigest()[:16]
+
+
+def read_labels(path: Path):
+    """Разметка YOLO-seg -> (классы (n,) int32, [полигоны (k, 2) float32]). Нет файла — пусто."""
+    classes, polygons = [], []
+    if path.exists():
+        for line in path.read_text().splitlines():
+            values = line.split()
+            if len(values) < 7:  # Класс + минимум 3 точки
+                continue
+            classes.append(int(float(values[0])))
+            polygons.append(np.array(values[1:], dtype=np.float32).reshape(-1, 2))
+    return np.array(classes, dtype=np.int32), polygons
+
+
+def load_resized(path: Path, imgsz: int):
+    """Кадр как BaseDataset.load_image(rect_mode=True): длинная сторона = imgsz. -> (img, (h0, w0))."""
+    img = cv2.imread(str(path))
+    if img is None:
+        return None, None
+    h0, w0 = img.shape[:2]
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        size = (min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz))
+        img = cv2.resize(img, size, interpolation=cv2.INTER_LINEAR)
+    return img, (h0, w0)
+
+
+def export(split: str, base_dir: Path = None, imgsz: int = None, workers: int = None, progress=None) -> Path:
+    """
+    Упаковать сплит. Декодирование в потоках (cv2 отпускает GIL), запись по порядку в шарды;
+    вперед записи декодируется не больше 2 * workers кадров (imap_window).
+    Атомарно: все пишется во временную папку, которая подменяет прежнюю упаковку.
+    """
+    base_dir = Path(base_dir or config.TRAIN_DATASET_DIR)
+    imgsz = imgsz or config.TRAIN_IMG_SIZE
+    files = _source_files(split, base_dir)
+    if not files:
+        raise FileNotFoundError(f"Нет картинок в {base_dir / 'images' / split}. Запусти 1_image_generator.py")
+    fp = fingerprint(files, imgsz)
+    workers = workers or min(8, os.cpu_count() or 1)
+    shard_limit = config.TRAIN_PACK_SHARD_MB * 2**20
+
+    out_dir = pack_dir(split, base_dir)
+    tmp_dir = out_dir.with_name(out_dir.name + ".tmp")
+    if tmp_dir.exists():
+        for old in tmp_dir.iterdir():
+            old.unlink()
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+
+    names, records = [], []           # records: shard, offset, h, w, h0, w0, poly_start, poly_count
+    poly_cls, pt_starts, points = [], [0], []
+    shard, offset, out = 0, 0, None
+
+    def load(pair):
+        img, hw0 = load_resized(pair[0], imgsz)
+        return img, hw0, read_labels(pair[1])
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for (img_path, _), (img, hw0, (classes, polygons)) in zip(files, imap_window(pool, load, files, 2 * workers)):
+                if progress:
+                    progress()
+                if img is None:
+                    logger.warning(f"⚠️ Не читается, пропущен: {img_path.name}")
+                    continue
+                if out is None or (offset and offset + img.nbytes > shard_limit):
+                    if out is not None:
+                        out.close()
+                        shard += 1
+                    out = open(tmp_dir / f"shard_{shard:03d}.u8", "wb")
+                    offset = 0
+                img = np.ascontiguousarray(img)
+                out.write(img.data)
+                records.append([shard, offset, img.shape[0], img.shape[1], *hw0, len(poly_cls), len(polygons)])
+                offset += img.nbytes
+                names.append(img_path.name)
+                for c, poly in zip(classes, polygons):
+                    poly_cls.append(c)
+                    points.append(poly)
+                    pt_starts.append(pt_starts[-1] + len(poly))
+    finally:
+        if out is not None:
+            out.close()
+
+    np.savez(tmp_dir / INDEX_NAME,
+             records=np.array(records, dtype=np.int64).reshape(-1, 8),
+             poly_cls=np.array(poly_cls, dtype=np.int32),
+             pt_starts=np.array(pt_starts, dtype=np.int64),
+             points=np.concatenate(points) if points else np.zeros((0, 2), dtype=np.float32))
+    with open(tmp_dir / META_NAME, "w", encoding="utf-8") as f:
+        json.dump({"version": PACK_VERSION, "fingerprint": fp, "imgsz": imgsz, "split": split,
+                   "shards": shard + 1 if out is not None else 0, "names": names}, f)
+
+    # Подмена: старая упаковка в сторону, новая на место, старая удаляется
+    if out_dir.exists():
+        trash = out_dir.with_name(out_dir.name + ".old")
+        out_dir.replace(trash)
+        for old in trash.iterdir():
+            old.unlink()
+        trash.rmdir()
+    tmp_dir.replace(out_dir)
+    return out_dir
+
+
+def is_fresh(split: str, base_dir: Path = None, imgsz: int = None) -> bool:
+    base_dir = Path(base_dir or config.TRAIN_DATASET_DIR)
+    imgsz = imgsz or config.TRAIN_IMG_SIZE
+    try:
+        with open(pack_dir(split, base_dir) / META_NAME, encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return meta.get("fingerprint") == fingerprint(_source_files(split, base_dir), imgsz)
+
+
+def ensure(split: str, base_dir: Path = None, imgsz: int = None, progress_factory=None) -> Path:
+    """Свежая упаковка сплита: готовая или собранная заново."""
+    if is_fresh(split, base_dir, imgsz):
+        return pack_dir(split, base_dir)
+    print(f"📦 Упаковка {split}: исходники изменились или упаковки нет — собираю...")
+    if progress_factory is None:
+        return export(split, base_dir, imgsz)
+    with progress_factory(len(_source_files(split, Path(base_dir or config.TRAIN_DATASET_DIR)))) as bar:
+        return export(split, base_dir, imgsz, progress=bar.update)
+
+
+class PackedStore:
+    """
+    Чтение упакованного сплита. Переживает pickle в воркеры даталоадера:
+    memmap шардов не копируется, а заново открывается на месте.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path / META_NAME, encoding="utf-8") as f:
+            meta = json.load(f)
+        self.names = meta["names"]
+        self.imgsz = meta["imgsz"]
+        self.n_shards = meta["shards"]
+        with np.load(self.path / INDEX_NAME) as index:
+            self.records = index["records"]
+            self.poly_cls = index["poly_cls"]
+            self.pt_starts = index["pt_starts"]
+            self.points = index["points"]
+        self._shards = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_shards"] = None
+        return state
+
+    def __len__(self):
+        return len(self.names)
+
+    def _shard(self, k: int) -> np.ndarray:
+        if self._shards is None:
+            self._shards = [None] * self.n_shards
+        if self._shards[k] is None:
+            self._shards[k] = np.memmap(self.path / f"shard_{k:03d}.u8", dtype=np.uint8, mode="r")
+        return self._shards[k]
+
+    def image(self, i: int) -> np.ndarray:
+        """Кадр i (read-only вид на шард, уже в масштабе imgsz)."""
+        shard, offset, h, w = (int(v) for v in self.records[i, :4])
+        return self._shard(shard)[offset:offset + h * w * 3].reshape(h, w, 3)
+
+    def original_shape(self, i: int):
+        return int(self.records[i, 4]), int(self.records[i, 5])
+
+    def labels(self, i: int):
+        """-> (классы (n,), [полигоны (k, 2) float32, нормированные])."""
+        start, count = int(self.records[i, 6]), int(self.records[i, 7])
+        polygons = [self.points[self.pt_starts[p]:self.pt_starts[p + 1]] for p in range(start, start + count)]
+        return self.poly_cls[start:start + count], polygons
@@ -0,0 +1,86 @@
+"""
+Обучение на упакованном датасете (config.TRAIN_DATA_FORMAT = "packed", формат — core/packed_dataset.py).
+
+Оба сплита (train и val) читаются из шардов через memmap: без декодирования JPEG и парсинга .txt.
+Кадры уже уменьшены как в BaseDataset.load_image, разметка в памяти с самого начала —
+дальше работают обычные аугментации и rect-батчи валидации ultralytics.
+"""
+
+import numpy as np
+from pathlib import Path
+from ultralytics.data.dataset import YOLODataset
+from ultralytics.models.yolo.segment import SegmentationTrainer
+from ultralytics.utils import colorstr
+from ultralytics.utils.torch_utils import unwrap_model
+
+from core import packed_dataset
+from core.stream_dataset import _xywh
+
+
+class PackedSegmentDataset(YOLODataset):
+    """YOLODataset поверх PackedStore: переопределены только источник картинок и разметки."""
+
+    def __init__(self, *args, pack_path: Path, **kwargs):
+        self.store = packed_dataset.PackedStore(pack_path)
+        self._record = {name: i for i, name in enumerate(self.store.names)}
+        super().__init__(*args, **kwargs)
+        if self.store.imgsz != self.imgsz:
+            raise ValueError(f"Упаковка под imgsz={self.store.imgsz}, а обучение с imgsz={self.imgsz}: перепакуй")
+
+    def get_img_files(self, img_path):
+        return list(self.store.names)
+
+    def get_labels(self):
+        labels = []
+        for i, name in enumerate(self.store.names):
+            classes, polygons = self.store.labels(i)
+            n = len(polygons)
+            labels.append({
+                "im_file": name,
+                "shape": self.store.original_shape(i),
+                "cls": classes.astype(np.float32).reshape(n, 1),
+                "bboxes": np.array([_xywh(p) for p in polygons], dtype=np.float32).reshape(n, 4),
+                "segments": polygons,
+                "keypoints": None,
+                "normalized": True,
+                "bbox_format": "xywh",
+            })
+        return labels
+
+    def load_image(self, i, rect_mode=True):
+        # im_files переставляются в rect-режиме, поэтому запись ищется по имени, а не по i.
+        # Копия: дальше аугментации (HSV) меняют кадр in-place, а шард read-only
+        record = self._record[self.im_files[i]]
+        img = self.store.image(record).copy()
+        if self.augment:
+            # Буфер кандидатов для mosaic, как у BaseDataset.load_image (сами кадры не держим — их держит page cache)
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                self.buffer.pop(0)
+        return img, self.store.original_shape(record), img.shape[:2]
+
+
+class PackedSegmentationTrainer(SegmentationTrainer):
+    """SegmentationTrainer, у которого train и val — PackedSegmentDataset."""
+
+    def build_dataset(self, img_path, mode="train", batch=None):
+        split = Path(img_path).name  # images/train -> train
+        path = packed_dataset.pack_dir(split)
+        gs = max(int(unwrap_model(self.model).stride.max() if self.model else 0), 32)
+        return PackedSegmentDataset(
+            pack_path=path,
+            img_path=img_path,
+            imgsz=self.args.imgsz,
+            batch_size=batch,
+            augment=mode == "train",
+            hyp=self.args,
+            rect=self.args.rect or mode == "val",
+            cache=None,
+            single_cls=self.args.single_cls or False,
+            stride=gs,
+            pad=0.0 if mode == "train" else 0.5,
+            prefix=colorstr(f"{mode} (packed): "),
+            task=self.args.task,
+            classes=self.args.classes,
+            data=self.data,
+        )
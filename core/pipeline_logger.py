@@ -14,12 +14,79 @@ failed_files.txt (Для ретрая)
 Консоль
 Дубликат pipeline.log + Progress Bar.
 Мониторинг в реальном времени.
+
+Производительность
+Логгер НЕ пишет в файлы в потоке вызова: root получает только QueueHandler,
+а файлы/консоль обслуживает фоновый QueueListener. logger.error в горячем цикле —
+это положить запись в очередь. Файлы ротируются (размер или время, см. config.LOG_*).
+Одинаковые ошибки с одной строки кода сэмплируются: не больше LOG_SAMPLE_BURST за окно,
+остальные считаются и выводятся одной пометкой в следующем сообщении.
+Перед выходом вызывать shutdown_logger() — он дописывает очередь на диск.
 """
 
-import logging
 import sys
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
 import config
 
+_listener = None
+
+
+class RepeatSampler(logging.Filter):
+    """
+    Rate-limit повторяющихся WARNING/ERROR.
+    Ключ — место вызова (logger + файл + строка), а не текст: в тексте обычно имя файла,
+    и "та же самая" ошибка на каждом фото иначе выглядела бы уникальной.
+    CRITICAL не подавляется никогда.
+    """
+
+    def __init__(self, window=None, burst=None):
+        super().__init__()
+        self.window = window if window is not None else config.LOG_SAMPLE_WINDOW
+        self.burst = burst if burst is not None else config.LOG_SAMPLE_BURST
+        self._state = {}  # key -> [window_start, passed, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING or record.levelno >= logging.CRITICAL or self.burst <= 0:
+            return True
+
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            state = self._state.get(key)
+            if state is None or now - state[0] >= self.window:
+                suppressed = state[2] if state else 0
+                self._state[key] = [now, 1, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} (+{suppressed} подобных подавлено за {self.window}с)"
+                return True
+
+            if state[1] < self.burst:
+                state[1] += 1
+                return True
+
+            state[2] += 1
+            return False
+
+
+def _file_handler(path, level, formatter):
+    if config.LOG_ROTATE_WHEN:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            path, when=config.LOG_ROTATE_WHEN, backupCount=config.LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            path, mode='a', maxBytes=config.LOG_MAX_BYTES, backupCount=config.LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+    handler.setLevel(level)
+    handler.setFormatter(formatter)
+    return handler
+
 
 def setup_logger():
     """
@@ -27,6 +94,7 @@ def setup_logger():
     Теперь сообщения из detector, segmenter и cleaner будут автоматически
     попадать в эти же файлы.
     """
+    global _listener
 
     # Создаем папку для логов
     config.LOG_DIR.mkdir(parents=True, exist_ok=True)
@@ -39,31 +107,63 @@ def setup_logger():
     root_logger.setLevel(logging.INFO)
 
     # Очищаем старые хендлеры (чтобы не дублировалось при перезапусках)
+    shutdown_logger()
     if root_logger.hasHandlers():
         root_logger.handlers.clear()
 
     # === 1. Файл pipeline.log (INFO) ===
-    general_path = config.LOG_DIR / "pipeline.log"
-    general_handler = logging.FileHandler(general_path, mode='a', encoding='utf-8')
-    general_handler.setLevel(logging.INFO)
-    general_handler.setFormatter(formatter)
-    root_logger.addHandler(general_handler)
+    general_handler = _file_handler(config.LOG_DIR / "pipeline.log", logging.INFO, formatter)
 
     # === 2. Файл errors.log (ERROR) ===
-    error_path = config.LOG_DIR / "errors.log"
-    error_handler = logging.FileHandler(error_path, mode='a', encoding='utf-8')
-    error_handler.setLevel(logging.ERROR)
-    error_handler.setFormatter(formatter)
-    root_logger.addHandler(error_handler)
+    error_handler = _file_handler(config.LOG_DIR / "errors.log", logging.ERROR, formatter)
 
     # === 3. Консоль (INFO) ===
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(formatter)
-    root_logger.addHandler(console_handler)
+
+    # === 4. Очередь: вызывающий поток только кладет запись, пишет фоновый поток ===
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RepeatSampler())
+    root_logger.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(
+        log_queue, general_handler, error_handler, console_handler, respect_handler_level=True
+    )
+    _listener.start()
 
     # Чтобы библиотеки типа PIL или urllib не спамили в лог, заглушим их
     logging.getLogger("PIL").setLevel(logging.WARNING)
     logging.getLogger("ultralytics").setLevel(logging.WARNING)
 
-    return root_logger
\ No newline at end of file
+    return root_logger
+
+
+def shutdown_logger():
+    """
+    Дописывает очередь на диск и закрывает файлы.
+    Безопасно вызывать несколько раз (и при KeyboardInterrupt, и из atexit).
+    """
+    global _listener
+    listener = _listener
+    if listener is None:
+        return
+    _listener = None
+
+    # Отцепляем очередь от root: поздние сообщения уйдут в stderr, а не в пустоту
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root_logger.removeHandler(handler)
+
+    listener.stop()  # Ждет, пока фоновый поток разберет очередь до конца
+    for handler in listener.handlers:
+        try:
+            handler.flush()
+            handler.close()
+        except Exception:
+            pass
+
+
+atexit.register(shutdown_logger)
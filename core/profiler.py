@@ -0,0 +1,151 @@
+"""
+Профилирование по запросу (для "почему упала скорость" на живом процессе).
+
+Захват ограничен по времени и включается:
+* в 3_run_pipeline.py — сигналом SIGUSR1 (kill -USR1 <pid>);
+* в 4_api_pipeline.py — POST /debug/profile?seconds=N.
+
+Что пишется в logs/:
+* profile_<time>.trace.json — torch.profiler (Chrome trace): chrome://tracing, https://ui.perfetto.dev
+  Тут видны model.forward YOLO/LaMa (регионы "detector.*", "cleaner.*") и операторы torch.
+* profile_<time>.prof — cProfile (pstats): snakeviz, `python -m pstats`. Вся Python-обвязка.
+* profile_<time>.txt — топ функций по cumulative time, чтобы глянуть без инструментов.
+
+Когда профилирование выключено, цена — одна проверка флага на фото:
+region() отдает готовый nullcontext, а step() сразу выходит.
+"""
+
+import io
+import time
+import pstats
+import cProfile
+import logging
+import threading
+from contextlib import nullcontext
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_NULL = nullcontext()
+
+
+class OnDemandProfiler:
+    """
+    request() можно звать из любого потока (сигнал, HTTP).
+    step() зовет рабочий поток (тот, что гоняет модели) на границе фото:
+    там захват стартует и там же останавливается по дедлайну.
+    cProfile привязан к потоку, поэтому старт и стоп — всегда в одном потоке.
+    """
+
+    def __init__(self, out_dir=None):
+        self.out_dir = out_dir or config.LOG_DIR
+        self.enabled = False     # Быстрый флаг для горячего пути
+        self.capturing = False   # Идет запись (для region())
+        self._lock = threading.Lock()
+        self._pending = None     # Запрошенная длительность (сек)
+        self._active = None      # Состояние текущего захвата
+        self._record_function = None
+        self.last_result = None  # Пути файлов последнего захвата
+
+    def request(self, seconds=None):
+        """Заказать захват. Возвращает длительность или None, если захват уже идет."""
+        seconds = float(seconds or config.PROFILE_SECONDS)
+        seconds = max(0.1, min(seconds, config.PROFILE_MAX_SECONDS))
+        with self._lock:
+            if self._pending is not None or self._active is not None:
+                return None
+            self._pending = seconds
+            self.enabled = True
+        return seconds
+
+    def step(self):
+        """Граница единицы работы: старт/стоп захвата. Дешево, если выключено."""
+        if not self.enabled:
+            return
+        if self._active is None:
+            with self._lock:
+                seconds, self._pending = self._pending, None
+            if seconds is not None:
+                self._start(seconds)
+        elif time.monotonic() >= self._active["deadline"]:
+            self._stop()
+
+    def finish(self):
+        """Остановить захват досрочно (из того же потока, где он стартовал)."""
+        if self._active is not None:
+            return self._stop()
+        return None
+
+    def region(self, name):
+        """Метка в torch-трейсе вокруг forward моделей (nullcontext, если не пишем)."""
+        if not self.capturing:
+            return _NULL
+        return self._record_function(name)
+
+    def _start(self, seconds):
+        stem = time.strftime("profile_%Y%m%d_%H%M%S")
+        state = {"deadline": time.monotonic() + seconds, "stem": stem, "seconds": seconds, "torch": None}
+
+        try:
+            import torch
+            from torch.profiler import profile, ProfilerActivity, record_function
+
+            activities = [ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(ProfilerActivity.CUDA)
+            state["torch"] = profile(activities=activities, record_shapes=False, with_stack=False)
+            state["torch"].__enter__()
+            self._record_function = record_function
+        except Exception as e:
+            logger.error(f"⚠️ torch.profiler недоступен, пишу только cProfile: {e}")
+            state["torch"] = None
+
+        state["cprofile"] = cProfile.Profile()
+        state["cprofile"].enable()
+
+        self._active = state
+        self.capturing = state["torch"] is not None
+        logger.info(f"🔬 Профилирование: старт на {seconds:.0f}с ({stem})")
+
+    def _stop(self):
+        state, self._active = self._active, None
+        self.capturing = False
+        state["cprofile"].disable()
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        base = self.out_dir / state["stem"]
+        result = {}
+
+        try:
+            if state["torch"] is not None:
+                state["torch"].__exit__(None, None, None)
+                path = base.with_suffix(".trace.json")
+                state["torch"].export_chrome_trace(str(path))
+                result["trace"] = str(path)
+
+            path = base.with_suffix(".prof")
+            state["cprofile"].dump_stats(str(path))
+            result["cprofile"] = str(path)
+
+            buf = io.StringIO()
+            pstats.Stats(state["cprofile"], stream=buf).sort_stats("cumulative").print_stats(40)
+            path = base.with_suffix(".txt")
+            path.write_text(buf.getvalue(), encoding="utf-8")
+            result["summary"] = str(path)
+        except Exception as e:
+            logger.error(f"⚠️ Ошибка сохранения профиля: {e}")
+        finally:
+            with self._lock:
+                self.enabled = self._pending is not None
+
+        self.last_result = result
+        logger.info(f"🔬 Профилирование: готово -> {', '.join(result.values())}")
+        return result
+
+
+# Один профайлер на процесс (detector/cleaner ставят метки через него)
+PROFILER = OnDemandProfiler()
+
+
+def region(name):
+    return PROFILER.region(name)
@@ -0,0 +1,280 @@
+"""
+Продвижение обученной модели в config.YOLO_MODEL_PATH (5_promote_model.py).
+
+Кандидат и текущая модель проверяются в одном запуске на одних и тех же данных — отложенной выборке
+(config.PROMOTE_HOLDOUT_DIR). Ее не видит обучение и не пересоздает 1_image_generator.py: свой сид,
+свои фоны (PROMOTE_HOLDOUT_BACKGROUNDS_DIR, если есть), собирается один раз и дальше заморожена.
+Ее хэш пишется в best.json; если holdout с прошлого продвижения поменялся, сравнение не засчитывается.
+* качество — mAP масок на holdout (model.val);
+* скорость — латентность predict на CPU (p50/p95) на фиксированном наборе фото holdout,
+  с теми же параметрами, что у core/detector.py. imgsz — тот, с которым модель реально
+  работает в проде: детектор его не передает, и ultralytics берет imgsz из чекпоинта.
+  Модели прогоняются поочередно на каждом фото: дрейф частоты/нагрузки CPU делится поровну.
+
+Подмена атомарная (os.replace): на месте best.pt всегда лежит целый файл.
+Прежняя модель сохраняется как best.prev.pt, рядом — best.json / best.prev.json с метриками.
+rollback() меняет best.pt и best.prev.pt местами (повторный rollback возвращает как было).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+import config
+from core import synth
+from core.downloader import file_sha256
+
+logger = logging.getLogger(__name__)
+
+DATA_YAML = config.PROMOTE_HOLDOUT_DIR / "data.yaml"
+
+
+def prev_path(target: Path) -> Path:
+    return target.with_name(f"{target.stem}.prev{target.suffix}")
+
+
+def record_path(model_path: Path) -> Path:
+    return model_path.with_suffix(".json")
+
+
+def production_imgsz(model) -> int:
+    """imgsz, с которым модель работает в core/detector.py (из чекпоинта; нет — TRAIN_IMG_SIZE)."""
+    imgsz = model.overrides.get("imgsz") or config.TRAIN_IMG_SIZE
+    return imgsz if isinstance(imgsz, int) else max(imgsz)
+
+
+def build_holdout(out_dir: Path = None) -> Path:
+    """
+    Собрать holdout ядрами core/synth.py с сидом PROMOTE_HOLDOUT_SEED (images/val + labels/val + data.yaml).
+    Фото — из PROMOTE_HOLDOUT_BACKGROUNDS_DIR; если там пусто — случайные фоны обучения
+    (сами фоны модель видела, но не эти примеры). Доля градиентов — как в генераторе.
+    Папка подменяется целиком: недособранный holdout не виден.
+    """
+    import cv2
+    import yaml
+
+    out_dir = Path(out_dir or config.PROMOTE_HOLDOUT_DIR)
+    seed, size = config.PROMOTE_HOLDOUT_SEED, config.PROMOTE_HOLDOUT_SIZE
+    bg_files = sorted(config.PROMOTE_HOLDOUT_BACKGROUNDS_DIR.glob("*.jpg"))
+    if not bg_files:
+        logger.warning(f"⚠️ Нет фото в {config.PROMOTE_HOLDOUT_BACKGROUNDS_DIR}: holdout на фонах обучения (другой сид)")
+        bg_files = sorted(config.BACKGROUNDS_DIR.glob("*.jpg"))
+    n_photo = min(len(bg_files), round(size / (1 + config.GEN_EXTRA_SOLID_PERCENT)))
+    pick = np.random.default_rng(seed).permutation(len(bg_files))[:n_photo]
+    bg_files = [bg_files[i] for i in sorted(pick)]
+
+    tmp = out_dir.with_name(out_dir.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    (tmp / "images" / "val").mkdir(parents=True)
+    (tmp / "labels" / "val").mkdir(parents=True)
+    wm_original = synth.load_watermark()
+    written = 0
+    for index in range(size):
+        rng = synth.sample_rng(index, seed)
+        bg = synth.make_background(index, bg_files, rng)
+        if bg is None:
+            continue
+        img, polygons = synth.compose_sample(bg, wm_original, rng)
+        if img is None:
+            continue
+        cv2.imwrite(str(tmp / "images" / "val" / f"hold_{index:06d}.jpg"), img)
+        with open(tmp / "labels" / "val" / f"hold_{index:06d}.txt", "w") as f:
+            for poly in polygons:
+                f.write(f"0 {synth.format_polygon(poly)}\n")
+        written += 1
+    # ultralytics требует ключ train — holdout им никогда не обучают, указываем ту же папку
+    with open(tmp / "data.yaml", "w") as f:
+        yaml.dump({"path": out_dir.absolute().as_posix(), "train": "images/val", "val": "images/val",
+                   "names": {0: "watermark"}}, f, sort_keys=False)
+
+    if out_dir.exists():
+        shutil.rmtree(out_dir)
+    os.replace(tmp, out_dir)
+    logger.info(f"💾 Holdout собран: {written} примеров в {out_dir} (хэш {holdout_hash(out_dir)})")
+    return out_dir
+
+
+def holdout_hash(holdout_dir: Path = None) -> str:
+    """Идентичность holdout: SHA-256 по путям и содержимому всех картинок и разметки."""
+    holdout_dir = Path(holdout_dir or config.PROMOTE_HOLDOUT_DIR)
+    h = hashlib.sha256()
+    for path in sorted(p for kind in ("images", "labels") for p in (holdout_dir / kind).rglob("*") if p.is_file()):
+        h.update(path.relative_to(holdout_dir).as_posix().encode())
+        h.update(path.read_bytes())
+    return h.hexdigest()[:16]
+
+
+def latency_images(n: int = None) -> list:
+    """Фиксированный набор для замера: первые n фото holdout по имени, декодированы заранее."""
+    from PIL import Image
+    n = n or config.PROMOTE_LATENCY_IMAGES
+    files = sorted((config.PROMOTE_HOLDOUT_DIR / "images" / "val").glob("*.jpg"))[:n]
+    if not files:
+        raise FileNotFoundError(f"Нет фото в {config.PROMOTE_HOLDOUT_DIR}. Запусти 5_promote_model.py --rebuild-holdout")
+    return [Image.open(f).convert("RGB") for f in files]
+
+
+def measure_latency(models: dict, images: list, warmup: int = None) -> dict:
+    """
+    CPU-латентность predict каждой модели. models: {имя: YOLO}.
+    -> {имя: {"imgsz", "p50_ms", "p95_ms", "mean_ms"}}.
+    """
+    warmup = config.PROMOTE_LATENCY_WARMUP if warmup is None else warmup
+    sizes = {name: production_imgsz(m) for name, m in models.items()}
+
+    def predict(name, img):
+        models[name].predict(source=img, imgsz=sizes[name], conf=config.YOLO_CONFIDENCE,
+                             device="cpu", verbose=False, retina_masks=True)
+
+    for name in models:
+        for k in range(warmup):
+            predict(name, images[k % len(images)])
+
+    times = {name: [] for name in models}
+    names = list(models)
+    for i, img in enumerate(images):
+        for name in (names if i % 2 == 0 else names[::-1]):
+            t0 = time.perf_counter()
+            predict(name, img)
+            times[name].append((time.perf_counter() - t0) * 1000)
+
+    return {name: {"imgsz": sizes[name],
+                   "p50_ms": float(np.percentile(t, 50)),
+                   "p95_ms": float(np.percentile(t, 95)),
+                   "mean_ms": float(np.mean(t))} for name, t in times.items()}
+
+
+def measure_accuracy(model, imgsz: int) -> dict:
+    """mAP масок на holdout. -> {"map50_95", "map50", "precision", "recall"}."""
+    with tempfile.TemporaryDirectory() as tmp:
+        metrics = model.val(data=str(DATA_YAML), split="val", imgsz=imgsz, batch=config.TRAIN_BATCH,
+                            workers=config.TRAIN_WORKERS, plots=False, verbose=False,
+                            project=tmp, name="val", device=0 if config.DEVICE == "cuda" else "cpu")
+    seg = metrics.seg
+    return {"map50_95": float(seg.map), "map50": float(seg.map50),
+            "precision": float(seg.mp), "recall": float(seg.mr)}
+
+
+def evaluate(candidate: Path, deployed: Path = None) -> dict:
+    """
+    Метрики кандидата и (если есть) текущей модели на holdout.
+    -> {"holdout": {"hash", "deployed_hash"}, "candidate": {...}, "deployed": {...} | None}.
+    deployed_hash — holdout, на котором продвигали текущую модель (из ее best.json; None — нет записи).
+    """
+    from ultralytics import YOLO
+
+    paths = {"candidate": Path(candidate), "deployed": Path(deployed or config.YOLO_MODEL_PATH)}
+    if not paths["deployed"].exists():
+        logger.warning(f"⚠️ Текущей модели нет ({paths['deployed']}): сравнивать не с чем, только абсолютные пороги")
+        del paths["deployed"]
+    models = {name: YOLO(path) for name, path in paths.items()}
+
+    deployed_hash = None
+    if "deployed" in paths and record_path(paths["deployed"]).exists():
+        deployed_hash = json.loads(record_path(paths["deployed"]).read_text(encoding="utf-8")).get("holdout")
+    report = {"holdout": {"hash": holdout_hash(), "deployed_hash": deployed_hash}, "candidate": None, "deployed": None}
+    for name, model in models.items():
+        logger.info(f"🎯 Качество ({name}) на holdout...")
+        report[name] = {"path": str(paths[name]), "accuracy": measure_accuracy(model, production_imgsz(model))}
+
+    logger.info("⏱️ Латентность на CPU...")
+    for name, lat in measure_latency(models, latency_images()).items():
+        report[name]["latency"] = lat
+    return report
+
+
+def check(report: dict) -> list:
+    """Пороги config.PROMOTE_*. -> [(название, прошел, пояснение)]."""
+    cand, dep = report["candidate"], report["deployed"]
+    cand_map, cand_p95 = cand["accuracy"]["map50_95"], cand["latency"]["p95_ms"]
+    checks = []
+
+    if config.PROMOTE_MIN_MAP is not None:
+        checks.append(("mAP50-95 >= минимума", cand_map >= config.PROMOTE_MIN_MAP,
+                       f"{cand_map:.4f} (порог {config.PROMOTE_MIN_MAP})"))
+    if config.PROMOTE_MAX_P95_MS is not None:
+        checks.append(("p95 <= потолка", cand_p95 <= config.PROMOTE_MAX_P95_MS,
+                       f"{cand_p95:.1f} мс (потолок {config.PROMOTE_MAX_P95_MS} мс)"))
+    holdout = report["holdout"]
+    if holdout["deployed_hash"] is not None:
+        checks.append(("holdout тот же, что при продвижении текущей", holdout["hash"] == holdout["deployed_hash"],
+                       f"{holdout['hash']} против {holdout['deployed_hash']}"))
+    if dep is not None:
+        dep_map, dep_p95 = dep["accuracy"]["map50_95"], dep["latency"]["p95_ms"]
+        checks.append(("mAP50-95 не хуже текущей", cand_map >= dep_map - config.PROMOTE_MAX_MAP_DROP,
+                       f"{cand_map:.4f} против {dep_map:.4f} (допуск -{config.PROMOTE_MAX_MAP_DROP})"))
+        ratio = cand_p95 / dep_p95 if dep_p95 else float("inf")
+        checks.append(("p95 не медленнее текущей", ratio <= config.PROMOTE_MAX_P95_RATIO,
+                       f"{cand_p95:.1f} мс против {dep_p95:.1f} мс (x{ratio:.2f}, допуск x{config.PROMOTE_MAX_P95_RATIO})"))
+    return checks
+
+
+def _copy_atomic(src: Path, dst: Path):
+    tmp = dst.with_name(dst.name + ".tmp")
+    shutil.copyfile(src, tmp)
+    with open(tmp, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, dst)
+
+
+def _write_record(path: Path, data: dict):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def promote(candidate: Path, report: dict = None, target: Path = None) -> Path:
+    """
+    Кандидат -> target (по умолчанию config.YOLO_MODEL_PATH). Текущая модель -> best.prev.pt.
+    Каждый шаг — os.replace, target ни на момент не пропадает и не бывает недописанным.
+    """
+    target = Path(target or config.YOLO_MODEL_PATH)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    prev, record = prev_path(target), record_path(target)
+
+    # Сначала кандидат рядом с target (тот же диск — os.replace атомарен), потом ротация
+    staged = target.with_name(target.name + ".new")
+    _copy_atomic(candidate, staged)
+    if target.exists():
+        _copy_atomic(target, prev)
+        if record.exists():
+            _copy_atomic(record, record_path(prev))
+        else:
+            record_path(prev).unlink(missing_ok=True)
+    os.replace(staged, target)
+
+    _write_record(record, {
+        "source": str(candidate),
+        "sha256": file_sha256(target),
+        "promoted_at": datetime.now().isoformat(timespec="seconds"),
+        "holdout": report["holdout"]["hash"] if report else None,
+        "report": report,
+    })
+    return target
+
+
+def rollback(target: Path = None) -> Path:
+    """Поменять target и best.prev.pt местами (вместе с .json)."""
+    target = Path(target or config.YOLO_MODEL_PATH)
+    prev = prev_path(target)
+    if not prev.exists():
+        raise FileNotFoundError(f"Нет предыдущей модели: {prev}")
+    for cur, old in ((target, prev), (record_path(target), record_path(prev))):
+        swap = cur.with_name(cur.name + ".swap")
+        if cur.exists():
+            _copy_atomic(cur, swap)
+        if old.exists():
+            os.replace(old, cur)
+        else:
+            cur.unlink(missing_ok=True)
+        if swap.exists():
+            os.replace(swap, old)
+    return target
@@ -0,0 +1,443 @@
+"""
+Пул процессов-реплик моделей для API на CPU-хостах (config.API_REPLICAS > 0).
+
+Зачем: в одном процессе модели упираются в GIL и один пул потоков torch,
+большая часть ядер простаивает. Здесь FastAPI — только фронт (прием, очередь, ответ),
+а decode -> детекция -> очистка -> encode идут в N отдельных процессах:
+* каждый процесс получает свой срез ядер (sched_setaffinity) и torch.set_num_threads по нему;
+* запрос уходит в наименее загруженную реплику (меньше всего фото в работе);
+* упавшая реплика перезапускается (с растущей паузой; после config.API_REPLICA_MAX_RESTARTS
+  неудач подряд — больше нет, пул not ready), ее запросы завершаются ошибкой (а не висят вечно);
+* внутри реплики ожидающие фото собираются в батч (get_masks / clean_batch), как в BatchScheduler;
+* клиент ушел или истек дедлайн — фронт шлет реплике отмену, запрос снимается с ее очереди
+  (или не идет в LaMa, если уже в батче). LaMa, которая заведомо не успеет к дедлайну, не запускается.
+
+Логи реплик пересылаются в родительский процесс (общие pipeline.log / errors.log),
+метрики и трейс пишет фронт по таймингам, которые возвращает реплика.
+"""
+
+import os
+import time
+import queue
+from collections import deque
+import asyncio
+import logging
+import threading
+import itertools
+import multiprocessing as mp
+import logging.handlers
+
+import config
+from core import metrics
+from core.scheduler import InferenceQueue, QueueFullError, DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+REPLICA_RESTARTS = metrics.Counter("wm_replica_restarts_total", "Model replica processes restarted after a crash.")
+
+
+class InvalidInputError(ValueError):
+    """Реплика не смогла декодировать картинку."""
+
+
+class ReplicaCrashedError(RuntimeError):
+    """Реплика упала, пока обрабатывала запрос."""
+
+
+def core_slices(n: int) -> list:
+    """Делим доступные ядра на n непрерывных срезов (при n > ядер срезы повторяются)."""
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except AttributeError:  # macOS / Windows
+        cpus = list(range(os.cpu_count() or 1))
+
+    if n >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(n)]
+    size, extra = divmod(len(cpus), n)
+    slices, start = [], 0
+    for i in range(n):
+        end = start + size + (1 if i < extra else 0)
+        slices.append(cpus[start:end])
+        start = end
+    return slices
+
+
+# ---------------------------------------------------------------------------
+# Дочерний процесс
+# ---------------------------------------------------------------------------
+
+class _ParentLogHandler(logging.handlers.QueueHandler):
+    """Записи лога реплики -> общая очередь ответов -> логгер родителя."""
+
+    def enqueue(self, record):
+        self.queue.put(("log", None, record))
+
+
+class _Inbox:
+    """
+    Очередь запросов реплики. Сообщения фронта: ("run", item), ("cancel", req_id), None — стоп.
+    Запросы копятся локально, отмены снимают их сразу — в том числе пока идет текущий батч.
+    """
+
+    def __init__(self, requests):
+        self.requests = requests
+        self.pending = deque()
+        self.cancelled = set()
+        self.stopped = False
+
+    def poll(self, block: bool = False):
+        """Забрать все, что пришло (block — ждать хотя бы одно сообщение)."""
+        while not self.stopped:
+            try:
+                msg = self.requests.get() if block else self.requests.get_nowait()
+            except queue.Empty:
+                break
+            block = False
+            if msg is None:
+                self.stopped = True
+            elif msg[0] == "cancel":
+                self.cancelled.add(msg[1])
+            else:
+                self.pending.append(msg[1])
+        if self.cancelled:
+            self.pending = deque(item for item in self.pending if item[0] not in self.cancelled)
+
+    def take(self, n: int) -> list:
+        """Следующий батч. Отмена приходит после своего запроса, так что старые id больше не нужны."""
+        batch = [self.pending.popleft() for _ in range(min(n, len(self.pending)))]
+        self.cancelled.clear()
+        return batch
+
+    def withdrawn(self) -> set:
+        """Отмененные с момента take() (проверка перед LaMa)."""
+        self.poll()
+        return self.cancelled
+
+
+# Оценка стоимости LaMa в реплике (сек на мегапиксель, EWMA) — как clean_cost в 4_api_pipeline.py
+_clean_cost = {"per_mp": None}
+
+
+def _run_models(detector, cleaner, decoded, withdrawn=set):
+    """
+    Детекция + очистка + encode для [(req_id, (fmt, quality), image, stats, deadline), ...]
+    -> {req_id: ("result", (bytes, статус, stats)) | ("late", None)}. Отмененные перед LaMa (withdrawn()) — без ответа.
+    """
+    from core import codecs
+
+    n = len(decoded)
+    images = [image for _, _, image, _, _ in decoded]
+
+    t1 = time.perf_counter()
+    masks = detector.get_masks(images, stats=[stats for _, _, _, stats, _ in decoded])
+    t2 = time.perf_counter()
+
+    # LaMa — самая дорогая стадия: не запускаем для ушедших клиентов и для тех, кто к дедлайну не успеет
+    cancelled = withdrawn()
+    per_mp = _clean_cost["per_mp"]
+    now = time.monotonic()
+    dropped, late, found = set(), set(), []
+    for i, (req_id, _, image, _, deadline) in enumerate(decoded):
+        if req_id in cancelled:
+            dropped.add(i)
+        elif not masks[i].getbbox():
+            continue
+        elif per_mp is not None and deadline is not None and now + per_mp * image.width * image.height / 1e6 > deadline:
+            late.add(i)
+        else:
+            found.append(i)
+
+    results = [(image, "skipped") for image in images]
+    if found:
+        cleaned = cleaner.clean_batch([images[i] for i in found], [masks[i] for i in found])
+        elapsed = time.perf_counter() - t2
+        sample = elapsed / max(sum(images[i].width * images[i].height / 1e6 for i in found), 0.01)
+        _clean_cost["per_mp"] = sample if per_mp is None else per_mp * 0.8 + sample * 0.2
+        clean_s = elapsed / len(found)
+        for i, result_image in zip(found, cleaned):
+            results[i] = (result_image, "cleaned")
+            decoded[i][3]["timings"]["clean"] = clean_s
+            decoded[i][3]["mask_area"] = round(metrics.mask_area_ratio(masks[i]), 5)
+
+    out = {}
+    for i, ((req_id, (fmt, quality), _, stats, _), (result_image, status)) in enumerate(zip(decoded, results)):
+        if i in dropped:
+            continue
+        if i in late:
+            out[req_id] = ("late", None)
+            continue
+        stats["timings"]["detect"] = (t2 - t1) / n
+        stats["batch_size"] = n
+        stats.setdefault("mask_area", 0.0)
+        t3 = time.perf_counter()
+        buf = codecs.encode(result_image, fmt, quality)
+        stats["timings"]["encode"] = time.perf_counter() - t3
+        out[req_id] = ("result", (buf.getvalue(), status, stats))
+    return out
+
+
+def _process_items(detector, cleaner, items, withdrawn=set):
+    """
+    [(req_id, contents, (fmt, quality), deadline), ...] -> [(kind, req_id, payload), ...]. Битое фото не роняет батч.
+    Просроченные запросы не обрабатываются (time.monotonic() общий для процессов), отмененные — без ответа.
+    """
+    from core import codecs
+
+    out = {}
+    decoded = []
+    now = time.monotonic()
+    for req_id, contents, output, deadline in items:
+        if deadline is not None and deadline <= now:
+            out[req_id] = ("expired", req_id, None)
+            continue
+        t0 = time.perf_counter()
+        try:
+            image = codecs.decode(contents)
+        except Exception:
+            out[req_id] = ("invalid", req_id, "File is not a valid image.")
+            continue
+        stats = {"width": image.width, "height": image.height, "timings": {"decode": time.perf_counter() - t0}}
+        decoded.append((req_id, output, image, stats, deadline))
+
+    if decoded:
+        try:
+            for req_id, (kind, payload) in _run_models(detector, cleaner, decoded, withdrawn).items():
+                out[req_id] = (kind, req_id, payload)
+        except Exception as e:
+            for req_id, *_ in decoded:
+                out[req_id] = ("error", req_id, str(e))
+
+    return [out[item[0]] for item in items if item[0] in out]
+
+
+def _replica_main(index, cpus, requests, responses, max_batch):
+    """Точка входа процесса-реплики (spawn)."""
+    # Логи — только в родителя (файлы логов пишет один процесс)
+    from core.pipeline_logger import shutdown_logger
+    shutdown_logger()
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(_ParentLogHandler(responses))
+    root.setLevel(logging.INFO)
+    log = logging.getLogger(f"replica.{index}")
+
+    try:
+        os.sched_setaffinity(0, cpus)
+    except (AttributeError, OSError):
+        pass
+
+    import torch
+    torch.set_num_threads(len(cpus))
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+    from core.detector import YourClassDetector
+    from core.cleaner import ImageInpainter
+    detector = YourClassDetector()
+    cleaner = ImageInpainter()
+    log.info(f"🧩 Реплика {index} готова (pid {os.getpid()}, ядра {cpus})")
+    responses.put(("ready", index, os.getpid()))
+
+    inbox = _Inbox(requests)
+    while True:
+        inbox.poll(block=not inbox.pending)
+        if inbox.stopped and not inbox.pending:
+            break
+        items = inbox.take(max_batch)
+        for response in _process_items(detector, cleaner, items, inbox.withdrawn):
+            responses.put(response)
+
+
+# ---------------------------------------------------------------------------
+# Родительский процесс (фронт API)
+# ---------------------------------------------------------------------------
+
+class _Replica:
+    def __init__(self, index, cpus):
+        self.index = index
+        self.cpus = cpus
+        self.process = None
+        self.requests = None
+        self.inflight = {}   # req_id -> future
+        self.assigned = 0    # Для равномерного распределения при равной загрузке
+        self.ready = False
+        self.restarts = 0    # Перезапусков подряд без успешной загрузки моделей
+        self.restart_at = None  # time.monotonic() следующего перезапуска (реплика упала и ждет паузу)
+        self.failed = False  # Лимит перезапусков исчерпан — реплика больше не поднимается
+
+
+class ReplicaPool(InferenceQueue):
+    """
+    Бэкенд инференса из N процессов. Интерфейс допуска (pending / is_full / retry_after)
+    тот же, что у InferenceQueue, поэтому /ready и 503 работают без изменений.
+    submit(contents, fmt, deadline, quality) -> (bytes, статус, stats) — stats с таймингами стадий из реплики.
+    """
+
+    def __init__(self, replicas=None, max_batch=None, **kwargs):
+        replicas = replicas or config.API_REPLICAS
+        super().__init__(workers=replicas, name="replicas", **kwargs)
+        self.max_batch = max_batch or config.API_MAX_BATCH
+        self._ctx = mp.get_context("spawn")  # fork + torch/CUDA = зависания
+        self._responses = self._ctx.Queue()
+        self._replicas = [_Replica(i, cpus) for i, cpus in enumerate(core_slices(replicas))]
+        self._ids = itertools.count()
+        self._owner = {}     # req_id -> _Replica
+        self._loop = None
+        self._reader = None
+        self._monitor = None
+        self._stopping = False
+
+    @property
+    def ready(self) -> bool:
+        # Исчерпанный лимит перезапусков — почти всегда общая причина (веса, память): пусть оркестратор увидит
+        return not self.failed and any(r.ready for r in self._replicas)
+
+    @property
+    def failed(self) -> bool:
+        return any(r.failed for r in self._replicas)
+
+    def _spawn(self, replica):
+        replica.requests = self._ctx.Queue()
+        replica.ready = False
+        replica.process = self._ctx.Process(
+            target=_replica_main,
+            args=(replica.index, replica.cpus, replica.requests, self._responses, self.max_batch),
+            name=f"replica-{replica.index}",
+            daemon=True,
+        )
+        replica.process.start()
+
+    async def start(self, wait_ready=True):
+        """Запуск реплик (из lifespan). wait_ready — дождаться загрузки моделей хотя бы в одной."""
+        self._loop = asyncio.get_running_loop()
+        for replica in self._replicas:
+            self._spawn(replica)
+        self._reader = threading.Thread(target=self._read_responses, name="replica-reader", daemon=True)
+        self._reader.start()
+        self._monitor = asyncio.create_task(self._watch())
+
+        while wait_ready and not self.ready:
+            if not any(r.process.is_alive() for r in self._replicas):
+                raise RuntimeError("All model replicas exited during startup, see errors.log")
+            await asyncio.sleep(0.2)
+
+    async def stop(self):
+        self._stopping = True
+        if self._monitor is not None:
+            self._monitor.cancel()
+        for replica in self._replicas:
+            try:
+                replica.requests.put(None)
+            except Exception:
+                pass
+        for replica in self._replicas:
+            await asyncio.to_thread(replica.process.join, 10)
+            if replica.process.is_alive():
+                replica.process.terminate()
+        self._responses.put(("stop", None, None))
+        self.shutdown()
+
+    async def submit(self, contents: bytes, fmt: str, deadline=None, quality=None):
+        if self.is_full:
+            raise QueueFullError(self.retry_after())
+
+        alive = [r for r in self._replicas if not r.failed]
+        if not alive:
+            raise ReplicaCrashedError("All model replicas failed to start")
+        replica = min(alive, key=lambda r: (not r.ready, r.restart_at is not None, len(r.inflight), r.assigned))
+        req_id = next(self._ids)
+        future = self._loop.create_future()
+        replica.inflight[req_id] = future
+        replica.assigned += 1
+        self._owner[req_id] = replica
+        self.pending += 1
+        try:
+            replica.requests.put(("run", (req_id, contents, (fmt, quality), deadline)))
+            return await future
+        finally:
+            if future.cancelled():
+                # Клиент ушел / дедлайн (wait_for): реплика снимет запрос с очереди или не пустит в LaMa
+                try:
+                    replica.requests.put(("cancel", req_id))
+                except Exception:
+                    pass
+            self.pending -= 1
+            replica.inflight.pop(req_id, None)
+            self._owner.pop(req_id, None)
+
+    def _read_responses(self):
+        """Фоновый поток: ответы/логи реплик -> futures в event loop."""
+        while True:
+            kind, key, payload = self._responses.get()
+            if kind == "stop":
+                return
+            if kind == "log":
+                logging.getLogger(payload.name).handle(payload)
+                continue
+            self._loop.call_soon_threadsafe(self._deliver, kind, key, payload)
+
+    def _deliver(self, kind, key, payload):
+        if kind == "ready":
+            self._replicas[key].ready = True
+            self._replicas[key].restarts = 0
+            return
+
+        replica = self._owner.get(key)
+        future = replica.inflight.get(key) if replica else None
+        if future is None or future.done():
+            return  # Клиент ушел или реплика уже признана упавшей
+        if kind == "result":
+            timings = payload[2]["timings"]
+            dt = sum(timings.values())
+            prev = self._service_ewma
+            self._service_ewma = dt if prev is None else prev * 0.8 + dt * 0.2
+            future.set_result(payload)
+        elif kind == "invalid":
+            future.set_exception(InvalidInputError(payload))
+        elif kind == "expired":
+            metrics.AVOIDED_WORK.labels("expired").inc()
+            future.set_exception(DeadlineExceeded("Deadline expired in queue"))
+        elif kind == "late":
+            metrics.AVOIDED_WORK.labels("clean_skipped").inc()
+            future.set_exception(DeadlineExceeded("Clean stage would miss the deadline"))
+        else:
+            future.set_exception(RuntimeError(payload))
+
+    def _fail_inflight(self, replica):
+        """Запросы упавшей реплики (и отправленные ей, пока она лежит) — ошибкой, а не вечным ожиданием."""
+        code = replica.process.exitcode
+        for future in replica.inflight.values():
+            if not future.done():
+                future.set_exception(ReplicaCrashedError(f"Replica {replica.index} crashed (exit {code})"))
+        replica.inflight.clear()
+
+    async def _watch(self):
+        """Перезапуск упавших реплик: пауза растет вдвое на каждую неудачу подряд, после лимита — отказ."""
+        while not self._stopping:
+            await asyncio.sleep(1)
+            now = time.monotonic()
+            for replica in self._replicas:
+                if self._stopping or replica.failed or replica.process.is_alive():
+                    continue
+                lost = len(replica.inflight)
+                self._fail_inflight(replica)
+                if replica.restart_at is None:
+                    replica.ready = False
+                    code = replica.process.exitcode
+                    if replica.restarts >= config.API_REPLICA_MAX_RESTARTS:
+                        replica.failed = True
+                        logger.critical(f"🛑 Реплика {replica.index} упала (exit {code}), лимит перезапусков "
+                                        f"({config.API_REPLICA_MAX_RESTARTS}) исчерпан. Пул not ready, см. errors.log")
+                        continue
+                    delay = min(config.API_REPLICA_RESTART_DELAY * 2 ** replica.restarts,
+                                config.API_REPLICA_RESTART_MAX_DELAY)
+                    replica.restart_at = now + delay
+                    logger.error(f"💥 Реплика {replica.index} упала (exit {code}), перезапуск через {delay:.1f} с "
+                                 f"({replica.restarts + 1}/{config.API_REPLICA_MAX_RESTARTS}). Потеряно запросов: {lost}")
+                if now >= replica.restart_at:
+                    replica.restarts += 1
+                    replica.restart_at = None
+                    REPLICA_RESTARTS.inc()
+                    self._spawn(replica)
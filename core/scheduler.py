@@ -0,0 +1,244 @@
+"""
+Очередь инференса для API.
+
+Зачем: модели (YOLO, LaMa) синхронные и тяжелые. Если звать их прямо в async-хендлере,
+event loop стоит всю обработку: не принимаются загрузки, не отвечает /ready.
+Здесь:
+* Инференс идет в отдельном пуле потоков (по умолчанию 1 поток = 1 GPU, модели не thread-safe).
+* Очередь ограничена (config.API_MAX_QUEUE). Когда она полна — QueueFullError,
+  хендлер отвечает 503 + Retry-After. Хвост задержек определяет длина очереди,
+  а не заблокированный loop.
+* BatchScheduler собирает ожидающие запросы в микро-батчи (один forward YOLO на батч,
+  LaMa — по корзинам размера). Окно сбора адаптивное: в простое запрос уходит сразу,
+  под нагрузкой окно растет до config.API_BATCH_WINDOW_MS.
+* Мертвая работа не доходит до моделей: запрос, чей клиент ушел (future отменен)
+  или чей дедлайн истек, выбрасывается из очереди при сборке батча (wm_avoided_work_total).
+  Дедлайны — в шкале time.monotonic().
+"""
+
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Очередь инференса переполнена. retry_after — оценка (сек), когда стоит повторить."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Inference queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """Дедлайн запроса истек (или его заведомо не успеть) — результат уже никому не нужен."""
+
+
+def remaining(deadline) -> float:
+    """Сколько секунд осталось до дедлайна (None — без дедлайна)."""
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class InferenceQueue:
+    """
+    Ограниченная очередь + выделенный пул потоков для моделей.
+    pending меняется только из потока event loop, поэтому без локов.
+    """
+
+    def __init__(self, max_pending=None, workers=None, name="inference"):
+        self.max_pending = max_pending or config.API_MAX_QUEUE
+        self.workers = workers or config.API_INFERENCE_THREADS
+        self.name = name
+        self.pending = 0                 # В очереди + в работе
+        self._service_ewma = None        # Среднее время задачи (сек), для Retry-After
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=name)
+        metrics.QUEUE_DEPTH.labels(name).set_function(lambda: self.pending)
+
+    @property
+    def is_full(self) -> bool:
+        return self.pending >= self.max_pending
+
+    def retry_after(self) -> int:
+        """Сколько секунд примерно уйдет на разбор текущей очереди."""
+        per_item = self._service_ewma or 1.0
+        return max(1, math.ceil(per_item * (self.pending + 1) / self.workers))
+
+    async def submit(self, fn, *args):
+        """Поставить задачу в очередь (с контролем допуска) и дождаться результата."""
+        if self.is_full:
+            raise QueueFullError(self.retry_after())
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._timed, fn, args)
+        finally:
+            self.pending -= 1
+
+    async def run_in_worker(self, fn, *args):
+        """Служебные задачи в потоке инференса (прогрев, профайлер) — без лимита очереди."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _timed(self, fn, args):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            dt = time.perf_counter() - t0
+            prev = self._service_ewma
+            self._service_ewma = dt if prev is None else prev * 0.8 + dt * 0.2
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class BatchScheduler(InferenceQueue):
+    """
+    Микро-батчинг поверх InferenceQueue.
+
+    process_batch(items) -> list — синхронная функция, выполняется в потоке инференса.
+    Элемент результата может быть Exception: тогда он уходит в future именно этого запроса,
+    остальные запросы батча не страдают.
+
+    Адаптивное окно: load — скользящее среднее заполненности батчей (0..1).
+    В простое батчи по 1 фото -> load ~0 -> окно ~0 (задержка одиночного запроса не растет).
+    Под нагрузкой батчи полные -> окно растет до max_window.
+    Плюс естественный батчинг: пока модели заняты, новые запросы копятся в очереди.
+    """
+
+    def __init__(self, process_batch, max_batch=None, max_window_ms=None, **kwargs):
+        super().__init__(**kwargs)
+        self.process_batch = process_batch
+        self.max_batch = max_batch or config.API_MAX_BATCH
+        max_window_ms = config.API_BATCH_WINDOW_MS if max_window_ms is None else max_window_ms
+        self.max_window = max_window_ms / 1000.0
+        self.load = 0.0
+        self._items = deque()          # (item, future, deadline)
+        self._wakeup = None
+        self._slots = None             # Сколько батчей может идти параллельно (= workers)
+        self._collector = None
+        self._batch_size = metrics.Histogram(
+            f"wm_{self.name}_batch_size", "Images per scheduled batch.",
+            buckets=tuple(range(1, self.max_batch + 1)),
+        )
+
+    def start(self):
+        """Запуск сборщика батчей (из lifespan, внутри работающего loop)."""
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._collector = asyncio.create_task(self._collect_loop())
+
+    async def stop(self):
+        if self._collector is not None:
+            self._collector.cancel()
+            try:
+                await self._collector
+            except asyncio.CancelledError:
+                pass
+        self.shutdown()
+
+    async def submit(self, item, deadline=None):
+        """
+        Поставить элемент в очередь батчинга и дождаться его результата.
+        deadline (time.monotonic()) — если истечет, пока элемент ждет, он не попадет в батч.
+        """
+        if self.is_full:
+            raise QueueFullError(self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        self._items.append((item, future, deadline))
+        self.pending += 1
+        self._wakeup.set()
+        try:
+            return await future
+        finally:
+            self.pending -= 1
+
+    def _window(self):
+        return self.max_window * self.load
+
+    async def _collect_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._items:
+                continue
+
+            await self._slots.acquire()
+
+            # Добираем батч в пределах окна
+            window = self._window()
+            if window > 0 and len(self._items) < self.max_batch:
+                deadline = loop.time() + window
+                while len(self._items) < self.max_batch:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+
+            batch = []
+            now = time.monotonic()
+            while self._items and len(batch) < self.max_batch:
+                item, future, deadline = self._items.popleft()
+                if future.done():
+                    # Клиент ушел (future отменен) — не тратим на него модели
+                    metrics.AVOIDED_WORK.labels("disconnected").inc()
+                    continue
+                if deadline is not None and deadline <= now:
+                    metrics.AVOIDED_WORK.labels("expired").inc()
+                    future.set_exception(DeadlineExceeded("Deadline expired in queue"))
+                    continue
+                batch.append((item, future))
+
+            if not batch:
+                self._slots.release()
+                continue
+
+            self.load = self.load * 0.7 + (len(batch) / self.max_batch) * 0.3
+            self._batch_size.observe(len(batch))
+            asyncio.create_task(self._run_batch(batch))
+
+            if self._items:
+                self._wakeup.set()  # В очереди остались элементы — следующий круг
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        items = [item for item, _ in batch]
+        try:
+            results = await loop.run_in_executor(self._executor, self._timed_batch, items)
+        except Exception as e:
+            results = [e] * len(batch)
+        finally:
+            self._slots.release()
+            if self._items:
+                self._wakeup.set()
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _timed_batch(self, items):
+        t0 = time.perf_counter()
+        try:
+            return self.process_batch(items)
+        finally:
+            dt = (time.perf_counter() - t0) / len(items)  # Амортизированно на фото
+            prev = self._service_ewma
+            self._service_ewma = dt if prev is None else prev * 0.8 + dt * 0.2
@@ -0,0 +1,39 @@
+"""
+Отчет о холодном старте: сколько заняла каждая фаза (импорты, загрузка моделей, прогрев).
+
+Фазы могут идти параллельно (модели грузятся в потоках), поэтому сумма фаз
+может быть больше общего времени — это и есть выигрыш от параллельной загрузки.
+Каждая фаза дублируется в метрику wm_startup_seconds{phase}.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+
+from core import metrics
+
+
+class StartupReport:
+    def __init__(self, t0: float = None):
+        self.t0 = t0 if t0 is not None else time.perf_counter()
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.phases[name] = seconds
+        metrics.STARTUP_SECONDS.labels(name).set(seconds)
+
+    @contextmanager
+    def phase(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def summary(self) -> str:
+        total = time.perf_counter() - self.t0
+        metrics.STARTUP_SECONDS.labels("total").set(total)
+        parts = " | ".join(f"{name} {seconds:.2f}с" for name, seconds in self.phases.items())
+        return f"⏱️ Старт за {total:.2f}с: {parts}"
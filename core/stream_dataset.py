@@ -0,0 +1,173 @@
+"""
+Обучение на синтетике "на лету" (config.TRAIN_DATA_FORMAT = "stream").
+
+Train-сплит не пишется на диск: наложение ватермарки (core/synth.py) выполняется прямо
+в воркерах даталоадера YOLO. Каждая эпоха видит те же фоны, но с новой ватермаркой
+(сид примера = (GEN_SEED, номер, эпоха)), без JPEG-потерь и без повторного декодирования
+наших же JPEG. Дальше работают обычные аугментации ultralytics (mosaic, HSV и т.д.).
+
+Валидация остается на диске и фиксированной (python 1_image_generator.py --split val):
+метрики между запусками сравнимы. Фоны делятся на train/val по synth.sample_split —
+одинаково в обоих режимах, утечки фонов из val в train нет.
+
+Номер эпохи попадает в воркеры через общую память (RawValue). Воркеры предзагружают
+пару батчей вперед, поэтому начало эпохи может прийти еще со старой ватермаркой — не страшно.
+"""
+
+import math
+import multiprocessing
+
+import cv2
+import numpy as np
+from ultralytics.data.dataset import YOLODataset
+from ultralytics.models.yolo.segment import SegmentationTrainer
+from ultralytics.utils import colorstr
+from ultralytics.utils.torch_utils import unwrap_model
+
+import config
+from core import synth, bg_cache, wm_atlas
+
+MAX_ATTEMPTS = 5  # Попыток наложения на один фон, прежде чем отдать его негативом
+
+
+def _xywh(polygon) -> list:
+    """Нормированный полигон (N, 2) -> bbox YOLO (cx, cy, w, h)."""
+    x1, y1 = polygon.min(axis=0)
+    x2, y2 = polygon.max(axis=0)
+    return [(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1]
+
+
+class StreamingSegmentDataset(YOLODataset):
+    """
+    YOLODataset, у которого вместо файлов — номера примеров генератора.
+    Переопределены только источник картинки и разметки; формат меток и трансформации — родительские.
+    """
+
+    def __init__(self, *args, seed: int = None, epoch_size: int = None, **kwargs):
+        self.seed = config.GEN_SEED if seed is None else seed
+        self.epoch = multiprocessing.RawValue("i", 0)
+        self.bg_files = sorted(config.BACKGROUNDS_DIR.glob("*.jpg"))
+        if not self.bg_files:
+            raise FileNotFoundError(f"Нет фонов в {config.BACKGROUNDS_DIR}. Запусти 0_download_backgrounds.py")
+        self.wm = synth.load_watermark()
+        cache = bg_cache.ensure(self.bg_files)  # memmap: воркеры даталоадера делят страницы
+        self.read_bg = cache.read if cache is not None else None
+        self.atlas = wm_atlas.ensure(self.wm, self.seed)
+
+        total = len(self.bg_files) + int(len(self.bg_files) * config.GEN_EXTRA_SOLID_PERCENT)
+        self.indices = [i for i in range(total) if synth.sample_split(i, self.seed) == "train"]
+        if epoch_size:
+            self.indices = self.indices[:epoch_size]
+        self._samples = {}  # i -> (epoch, img, hw0, polygons): для mosaic, пока i в буфере
+        super().__init__(*args, **kwargs)
+
+    # --- Вместо файлов ---------------------------------------------------------
+
+    def get_img_files(self, img_path):
+        return [f"synthetic/syn_{i:06d}.jpg" for i in self.indices]
+
+    def get_labels(self):
+        # Заглушки: реальная разметка появляется вместе с картинкой в get_image_and_label
+        return [{
+            "im_file": f,
+            "shape": (self.imgsz, self.imgsz),
+            "cls": np.zeros((0, 1), dtype=np.float32),
+            "bboxes": np.zeros((0, 4), dtype=np.float32),
+            "segments": [],
+            "keypoints": None,
+            "normalized": True,
+            "bbox_format": "xywh",
+        } for f in self.im_files]
+
+    # --- Генерация -------------------------------------------------------------
+
+    def _sample(self, i: int):
+        """Пример i текущей эпохи: (картинка BGR в масштабе imgsz, исходный (h, w), полигоны)."""
+        epoch = self.epoch.value
+        cached = self._samples.get(i)
+        if cached is not None and cached[0] == epoch:
+            return cached[1:]
+
+        index = self.indices[i]
+        rng = synth.sample_rng(index, self.seed, epoch)
+        bg = synth.make_background(index, self.bg_files, rng, self.read_bg)
+        if bg is None:
+            raise FileNotFoundError(f"Не читается фон {self.bg_files[index]}")
+        for _ in range(MAX_ATTEMPTS):
+            # None — неудачный пример (мелко / нет контуров): бросаем кости еще раз на чистом фоне
+            img, polygons = synth.compose_sample(bg.copy(), self.wm, rng, self.atlas)
+            if img is not None:
+                break
+        else:
+            img, polygons = bg.copy(), []  # Пусть будет негативом
+
+        h0, w0 = img.shape[:2]
+        r = self.imgsz / max(h0, w0)
+        if r != 1:
+            size = (min(math.ceil(w0 * r), self.imgsz), min(math.ceil(h0 * r), self.imgsz))
+            img = cv2.resize(img, size, interpolation=cv2.INTER_LINEAR)
+
+        # Буфер для mosaic, как у BaseDataset.load_image
+        self._samples[i] = (epoch, img, (h0, w0), polygons)
+        self.buffer.append(i)
+        if 1 < len(self.buffer) >= self.max_buffer_length:
+            self._samples.pop(self.buffer.pop(0), None)
+        return img, (h0, w0), polygons
+
+    def load_image(self, i, rect_mode=True):
+        img, hw0, _ = self._sample(i)
+        return img, hw0, img.shape[:2]
+
+    def get_image_and_label(self, index):
+        img, (h0, w0), polygons = self._sample(index)
+        n = len(polygons)
+        label = {
+            "im_file": self.im_files[index],
+            "cls": np.zeros((n, 1), dtype=np.float32),
+            "bboxes": np.array([_xywh(p) for p in polygons], dtype=np.float32).reshape(n, 4),
+            "segments": [p.astype(np.float32) for p in polygons],
+            "keypoints": None,
+            "normalized": True,
+            "bbox_format": "xywh",
+            "img": img,
+            "ori_shape": (h0, w0),
+            "resized_shape": img.shape[:2],
+        }
+        label["ratio_pad"] = (img.shape[0] / h0, img.shape[1] / w0)
+        return self.update_labels_info(label)
+
+
+class StreamingSegmentationTrainer(SegmentationTrainer):
+    """SegmentationTrainer, у которого train — StreamingSegmentDataset, а val — обычные файлы."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.add_callback("on_train_epoch_start", self._set_epoch)
+
+    def build_dataset(self, img_path, mode="train", batch=None):
+        if mode != "train":
+            return super().build_dataset(img_path, mode, batch)
+        gs = max(int(unwrap_model(self.model).stride.max() if self.model else 0), 32)
+        return StreamingSegmentDataset(
+            img_path=img_path,
+            imgsz=self.args.imgsz,
+            batch_size=batch,
+            augment=True,
+            hyp=self.args,
+            rect=False,
+            cache=None,
+            single_cls=self.args.single_cls or False,
+            stride=gs,
+            pad=0.0,
+            prefix=colorstr("train (stream): "),
+            task=self.args.task,
+            classes=self.args.classes,
+            data=self.data,
+            epoch_size=config.TRAIN_STREAM_EPOCH_SIZE,
+        )
+
+    @staticmethod
+    def _set_epoch(trainer):
+        dataset = getattr(trainer.train_loader, "dataset", None)
+        if isinstance(dataset, StreamingSegmentDataset):
+            dataset.epoch.value = trainer.epoch
@@ -0,0 +1,367 @@
+"""
+Ядра синтетики: наложение ватермарки на фон и разметка (полигоны YOLO-seg).
+
+Общие для 1_image_generator.py (запись на диск) и обучения "на лету".
+Все ядра работают только с областью ватермарки (ROI), а не со всем кадром:
+* blend_roi — альфа-смешивание (cv2.blendLinear, веса float32), in-place в фон.
+* colorize — перекраска через таблицу (cv2.LUT), без цикла по каналам и float64 кадров.
+* roi_polygons — findContours по маске размера ROI, потом сдвиг на (x, y).
+
+Вся случайность — из переданного np.random.Generator: пример однозначно задается (сид, номер).
+Сверка с прежней реализацией и замер на пример: benchmarks/7_bench_generator_kernels.py
+"""
+
+import json
+import hashlib
+
+import cv2
+import numpy as np
+
+import config
+
+MIN_CONTOUR_AREA = 50       # Меньше — шум, не размечаем
+MASK_ALPHA_THRESHOLD = 10   # Пиксель ватермарки = альфа выше порога
+
+# Поднять, если при тех же настройках ядра начинают выдавать другой результат:
+# иначе инкрементальная генерация (манифест) не узнает, что примеры устарели
+SYNTH_VERSION = 1
+
+# Решения compose_sample (пишутся в trace) -> GEN_*, которые на этом пути читаются.
+# Хэш примера — только от них: ручка, которую пример не трогал, его не инвалидирует.
+# GEN_WM_ATLAS сам не читается, но выбирает путь (генератор передает atlas только с ним)
+_TRACE_KNOBS = {
+    "negative": ("GEN_PROB_NEGATIVE",),
+    "watermark": ("GEN_PROB_NEGATIVE", "GEN_WM_ATLAS", "GEN_PROB_EASY_MODE", "GEN_ROTATION_PROB", "GEN_SCALE_RANGE"),
+    "easy": (),
+    "hard": ("GEN_INVERT_PROB", "GEN_COLOR_PROB", "GEN_BLUR_PROB", "GEN_PROB_EDGE_CORRUPTION", "GEN_OPACITY_RANGE"),
+    "atlas-easy": (),  # Остальное — в ключе банка
+    "atlas-hard": ("GEN_COLOR_PROB", "GEN_OPACITY_RANGE"),
+}
+
+
+# Независимые потоки случайности одного примера (длина ключа SeedSequence их и разводит)
+_SPLIT_STREAM = 1
+_EPOCH_STREAM = 2
+
+
+def sample_rng(index: int, seed: int = None, epoch: int = None) -> np.random.Generator:
+    """
+    Генератор случайных чисел примера: зависит только от мастер-сида и индекса.
+    epoch — для обучения "на лету": тот же фон, но новая ватермарка на каждой эпохе.
+    """
+    key = [config.GEN_SEED if seed is None else seed, index]
+    if epoch is not None:
+        key += [_EPOCH_STREAM, epoch]
+    return np.random.default_rng(np.random.SeedSequence(key))
+
+
+def sample_split(index: int, seed: int = None) -> str:
+    """
+    "train" / "val" для примера. Отдельный поток: сплит известен до чтения фона,
+    и фон (по индексу) всегда попадает в один и тот же сплит — в любом режиме обучения.
+    """
+    key = [config.GEN_SEED if seed is None else seed, index, _SPLIT_STREAM]
+    return "train" if np.random.default_rng(np.random.SeedSequence(key)).random() < config.GEN_TRAIN_RATIO else "val"
+
+
+def knobs_hash(names, *extra) -> str:
+    """Хэш значений настроек names (+ версия ядер и extra: байты или строки)."""
+    params = {k: getattr(config, k) for k in sorted(set(names))}
+    h = hashlib.sha256(json.dumps([SYNTH_VERSION, params], sort_keys=True, default=str).encode())
+    for e in extra:
+        h.update(e if isinstance(e, bytes) else str(e).encode())
+    return h.hexdigest()[:16]
+
+
+def watermark_hash(wm_original) -> str:
+    """Хэш пикселей ватермарки (после load_watermark — "лечение" краев уже учтено)."""
+    return hashlib.sha256(wm_original.tobytes()).hexdigest()[:16]
+
+
+def sample_hash(trace, photo: bool, wm_hash: str, atlas_key: str = "") -> str:
+    """
+    Хэш всего, от чего зависит пример при фиксированных (сид, номер, фон), по его trace из compose_sample:
+    только прочитанные на этом пути GEN_*, GEN_BG_MAX_SIDE для фото, ватермарка и банк — если они использовались.
+    GEN_TRAIN_RATIO сюда не входит: сплит не меняет содержимое примера.
+    """
+    names = ["GEN_BG_MAX_SIDE"] if photo else []
+    for decision in trace:
+        names += _TRACE_KNOBS[decision]
+    return knobs_hash(names, wm_hash if "watermark" in trace else "",
+                      atlas_key if any(d.startswith("atlas") for d in trace) else "")
+
+
+def load_watermark():
+    """Исходник ватермарки (BGRA) с "лечением" краев."""
+    wm_original = cv2.imread(str(config.WATERMARK_SOURCE), cv2.IMREAD_UNCHANGED)
+    if wm_original.shape[2] == 3:
+        b, g, r = cv2.split(wm_original)
+        alpha = np.ones_like(b) * 255
+        wm_original = cv2.merge((b, g, r, alpha))
+
+    # Лечение исходника
+    dil_size = getattr(config, 'GEN_SOURCE_REPAIR_DILATION', 0)
+    if dil_size > 0:
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (dil_size, dil_size))
+        wm_original = cv2.dilate(wm_original, kernel, iterations=1)  # Все 4 канала разом
+    return wm_original
+
+
+def generate_gradient(w, h, rng):
+    """
+    Генерирует случайный градиент.
+    ИСПРАВЛЕННАЯ ВЕРСИЯ: Явно растягиваем массивы (np.tile),
+    чтобы не получать полоски 1px шириной.
+    """
+    # 1. Выбор цветов
+    if rng.random() < 0.5:
+        c1 = rng.integers(200, 256, (3,))  # Светлый 1
+        c2 = rng.integers(150, 230, (3,))  # Светлый 2
+    else:
+        c1 = rng.integers(50, 120, (3,))  # Темный 1
+        c2 = rng.integers(10, 80, (3,))   # Темный 2
+
+    # 2. Создаем маску смешивания alpha (h, w, 1)
+    rnd_type = rng.random()
+
+    if rnd_type < 0.7:
+        # Линейный
+        if rng.random() < 0.5:
+            # Вертикальный (меняется по высоте)
+            # Создаем столбец (h, 1) и дублируем его w раз вправо
+            col = np.linspace(0, 1, h).reshape(h, 1)
+            alpha = np.tile(col, (1, w)) # -> (h, w)
+        else:
+            # Горизонтальный (меняется по ширине)
+            # Создаем строку (1, w) и дублируем её h раз вниз
+            row = np.linspace(0, 1, w).reshape(1, w)
+            alpha = np.tile(row, (h, 1)) # -> (h, w)
+    else:
+        # Диагональный
+        Y = np.linspace(0, 1, h).reshape(h, 1)
+        X = np.linspace(0, 1, w).reshape(1, w)
+        # Тут broadcasting работает корректно, создавая матрицу (h, w)
+        alpha = (Y + X) / 2.0
+
+    # Превращаем (h, w) в (h, w, 1) для умножения на RGB
+    alpha = alpha.reshape(h, w, 1)
+
+    # 3. Смешиваем цвета
+    # c1 и c2 имеют форму (3,), они растянутся на всю картинку
+    img = (1.0 - alpha) * c1 + alpha * c2
+
+    return img.astype(np.uint8)
+
+
+def read_background(path):
+    """Фото-фон с диска (BGR), уменьшенный до GEN_BG_MAX_SIDE. None — не читается."""
+    img = cv2.imread(str(path))
+    if img is None or not config.GEN_BG_MAX_SIDE:
+        return img
+    h, w = img.shape[:2]
+    r = config.GEN_BG_MAX_SIDE / max(h, w)
+    if r >= 1:
+        return img
+    return cv2.resize(img, (max(1, round(w * r)), max(1, round(h * r))), interpolation=cv2.INTER_AREA)
+
+
+def make_background(index: int, bg_files: list, rng, read=None):
+    """
+    Фон примера: index < len(bg_files) — реальное фото, дальше — градиент случайного размера.
+    read(path) -> BGR или None (по умолчанию read_background; кэш — core/bg_cache.py).
+    Фон из кэша — read-only вид на общую память: перед compose_sample его нужно скопировать.
+    """
+    if index < len(bg_files):
+        return (read or read_background)(bg_files[index])
+    h = int(rng.integers(600, 1025))
+    w = int(rng.integers(600, 1025))
+    return generate_gradient(w, h, rng)
+
+
+def smart_resize(img, w, h):
+    h_orig, w_orig = img.shape[:2]
+    if w > w_orig or h > h_orig: return cv2.resize(img, (w, h), interpolation=cv2.INTER_LANCZOS4)
+    else: return cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+
+
+def colorize(img_rgba, color):
+    """
+    Перекраска: яркость (серый) * цвет / 255. Таблица на 256 значений считается той же
+    формулой, что и раньше, а кадр проходит один cv2.LUT по всем 4 каналам (альфа — тождественно).
+    """
+    table = np.empty((1, 256, 4), dtype=np.uint8)
+    table[0, :, :3] = (np.arange(256)[:, None] / 255.0 * np.asarray(color)).astype(np.uint8)
+    table[0, :, 3] = np.arange(256)
+    gray = cv2.cvtColor(img_rgba, cv2.COLOR_BGRA2GRAY)
+    return cv2.LUT(cv2.merge((gray, gray, gray, img_rgba[:, :, 3])), table)
+
+
+def apply_random_color(img_rgba, rng):
+    if rng.random() < config.GEN_COLOR_PROB:
+        return colorize(img_rgba, rng.integers(0, 256, (3,), dtype=np.uint8))
+    return img_rgba
+
+
+def apply_edge_corruption(img_rgba, rng):
+    if rng.random() > getattr(config, 'GEN_PROB_EDGE_CORRUPTION', 0.5): return img_rgba
+    a = img_rgba[:, :, 3]
+    ksize = int(rng.choice([3, 5]))
+    kernel = np.ones((ksize, ksize), np.uint8)
+    if rng.random() < 0.5: a = cv2.erode(a, kernel, iterations=1)
+    else: a = cv2.dilate(a, kernel, iterations=1)
+    if rng.random() < 0.5: a = cv2.GaussianBlur(a, (3, 3), 0)
+    result = img_rgba.copy()
+    result[:, :, 3] = a
+    return result
+
+
+def blend_roi(bg, wm_rgba, opacity, x, y):
+    """
+    Альфа-смешивание ватермарки в bg[y:y+h, x:x+w] (in-place, только ROI).
+    cv2.blendLinear с попиксельными весами float32 — один проход в C вместо цикла по каналам.
+    """
+    h, w = wm_rgba.shape[:2]
+    roi = bg[y:y + h, x:x + w]
+    alpha = wm_rgba[:, :, 3].astype(np.float32)
+    alpha *= np.float32(opacity / 255.0)
+    blended = cv2.blendLinear(roi, cv2.cvtColor(wm_rgba, cv2.COLOR_BGRA2BGR), 1.0 - alpha, alpha)
+    np.copyto(roi, blended)
+    return bg
+
+
+def blend_premultiplied_roi(bg, wm_premul, opacity, x, y):
+    """
+    Смешивание варианта из банка (core/wm_atlas.py, BGR уже умножен на альфу), in-place:
+    roi = roi - roi * A * opacity + BGR * opacity — три прохода uint8 без float кадров.
+    """
+    h, w = wm_premul.shape[:2]
+    roi = bg[y:y + h, x:x + w]
+    a = wm_premul[:, :, 3]
+    cv2.subtract(roi, cv2.multiply(roi, cv2.merge((a, a, a)), scale=opacity / 255.0), dst=roi)
+    cv2.addWeighted(roi, 1.0, cv2.cvtColor(wm_premul, cv2.COLOR_BGRA2BGR), opacity, 0.0, dst=roi)
+    return bg
+
+
+def roi_polygons(roi_mask, x, y, img_w, img_h):
+    """
+    Контуры маски размера ROI -> полигоны в координатах кадра, нормированные в 0..1 (список (N, 2)).
+    Рамка в 1px нулей — чтобы контуры у края ROI совпадали с контурами на полном кадре.
+    """
+    padded = cv2.copyMakeBorder(roi_mask, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+    contours, _ = cv2.findContours(padded, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x - 1, y - 1))
+    scale = np.array([img_w, img_h], dtype=np.float64)
+    polygons = []
+    for cnt in contours:
+        if cv2.contourArea(cnt) < MIN_CONTOUR_AREA: continue
+        epsilon = 0.002 * cv2.arcLength(cnt, True)
+        approx = cv2.approxPolyDP(cnt, epsilon, True)
+        if len(approx) < 4: continue
+        polygons.append(np.clip(approx.reshape(-1, 2) / scale, 0, 1))
+    return polygons
+
+
+def format_polygon(polygon) -> str:
+    """(N, 2) в 0..1 -> "x1 y1 x2 y2 ..." для строки разметки YOLO."""
+    return " ".join(f"{x:.6f} {y:.6f}" for x, y in polygon)
+
+
+def compose_sample(bg, wm_original, rng, atlas=None, trace: list = None):
+    """
+    Наложение ватермарки на bg (bg меняется in-place).
+    atlas — банк готовых вариантов (core/wm_atlas.py) вместо трансформаций исходника на каждый пример.
+    trace — список, куда дописываются принятые решения (ключи _TRACE_KNOBS, для sample_hash).
+    -> (img, polygons): негатив — (bg, []), неудачный пример (мелко / нет контуров) — (None, []).
+    """
+    trace = [] if trace is None else trace
+    h_bg, w_bg = bg.shape[:2]
+
+    # === NEGATIVE SAMPLE ===
+    if rng.random() < config.GEN_PROB_NEGATIVE:
+        trace.append("negative")
+        return bg, []
+    trace.append("watermark")
+    if atlas is not None:
+        return _compose_from_atlas(bg, wm_original, rng, atlas, trace)
+
+    wm_curr = wm_original
+    is_hard_mode = rng.random() > config.GEN_PROB_EASY_MODE
+    trace.append("hard" if is_hard_mode else "easy")
+
+    # Трансформации
+    if rng.random() < config.GEN_ROTATION_PROB:
+        wm_curr = cv2.rotate(wm_curr, cv2.ROTATE_90_CLOCKWISE)
+
+    if is_hard_mode and rng.random() < config.GEN_INVERT_PROB:
+        wm_curr = wm_curr.copy()
+        np.invert(wm_curr[:, :, :3], out=wm_curr[:, :, :3])
+
+    scale_ratio = rng.uniform(*config.GEN_SCALE_RANGE)
+    h_wm, w_wm = wm_curr.shape[:2]
+    new_w = int(w_bg * scale_ratio)
+    new_h = int(h_wm * (new_w / w_wm))
+
+    if new_h > h_bg: new_h = int(h_bg * 0.9); new_w = int(w_wm * (new_h / h_wm))
+    if new_w < 10: return None, []
+
+    wm_resized = smart_resize(wm_curr, new_w, new_h)
+
+    if is_hard_mode:
+        wm_resized = apply_random_color(wm_resized, rng)
+        if rng.random() < config.GEN_BLUR_PROB:
+            k = int(rng.choice([3, 5]))
+            wm_resized = cv2.GaussianBlur(wm_resized, (k, k), 0)
+        wm_resized = apply_edge_corruption(wm_resized, rng)
+        opacity = rng.uniform(*config.GEN_OPACITY_RANGE)
+    else:
+        opacity = rng.uniform(0.7, 1.0)
+
+    y_off = int(rng.integers(0, h_bg - new_h + 1))
+    x_off = int(rng.integers(0, w_bg - new_w + 1))
+
+    # Наложение и разметка — только в пределах ROI
+    blend_roi(bg, wm_resized, opacity, x_off, y_off)
+    roi_mask = (wm_resized[:, :, 3] > MASK_ALPHA_THRESHOLD).view(np.uint8) * np.uint8(255)
+    polygons = roi_polygons(roi_mask, x_off, y_off, w_bg, h_bg)
+
+    if not polygons:
+        return None, []
+    return bg, polygons
+
+
+def _compose_from_atlas(bg, wm_original, rng, atlas, trace):
+    """
+    compose_sample по банку: размер считается как в обычном пути, вариант — одна из двух соседних
+    ступеней (в среднем нужного размера), влезающая в фон; на пример остаются только перекраска и прозрачность.
+    """
+    h_bg, w_bg = bg.shape[:2]
+    is_hard_mode = rng.random() > config.GEN_PROB_EASY_MODE
+    trace.append("atlas-hard" if is_hard_mode else "atlas-easy")
+    rotated = rng.random() < config.GEN_ROTATION_PROB
+    h_wm, w_wm = wm_original.shape[:2]
+    if rotated: h_wm, w_wm = w_wm, h_wm
+
+    scale_ratio = rng.uniform(*config.GEN_SCALE_RANGE)
+    new_w = int(w_bg * scale_ratio)
+    new_h = int(h_wm * (new_w / w_wm))
+    if new_h > h_bg: new_h = int(h_bg * 0.9); new_w = int(w_wm * (new_h / h_wm))
+
+    wm = atlas.pick(rotated, is_hard_mode, new_w, w_bg, h_bg, rng)
+    if wm is None: return None, []
+    new_h, new_w = wm.shape[:2]
+
+    if is_hard_mode:
+        wm = apply_random_color(wm, rng)  # Перекраска линейна по яркости — с предумноженной альфой тоже верна
+        opacity = rng.uniform(*config.GEN_OPACITY_RANGE)
+    else:
+        opacity = rng.uniform(0.7, 1.0)
+
+    y_off = int(rng.integers(0, h_bg - new_h + 1))
+    x_off = int(rng.integers(0, w_bg - new_w + 1))
+
+    blend_premultiplied_roi(bg, wm, opacity, x_off, y_off)
+    roi_mask = (wm[:, :, 3] > MASK_ALPHA_THRESHOLD).view(np.uint8) * np.uint8(255)
+    polygons = roi_polygons(roi_mask, x_off, y_off, w_bg, h_bg)
+
+    if not polygons:
+        return None, []
+    return bg, polygons
@@ -0,0 +1,94 @@
+"""
+Структурированный трейс обработки (JSONL).
+
+Одна строка JSON на каждое фото — в отличие от pipeline.log, это можно агрегировать.
+Файл: logs/traces.jsonl (config.TRACE_LOG_PATH).
+Разбор: benchmarks/5_analyze_traces.py
+
+Пример строки:
+{"ts": 1730000000.1, "source": "pipeline", "file": "a.jpg", "input_bytes": 812345,
+ "width": 4000, "height": 3000, "megapixels": 12.0, "status": "cleaned",
+ "backend": "cuda", "mask_area": 0.031, "components": 1,
+ "timings_ms": {"decode": 41.2, "detect": 18.9, "clean": 210.4, "encode": 96.0},
+ "total_ms": 366.5, "output_bytes": 1034567}
+"""
+
+import json
+import time
+import logging
+import threading
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def new_record(source: str, file_name: str, input_bytes: int = None) -> dict:
+    """Заготовка записи. Остальные поля дописываются по ходу обработки."""
+    return {
+        "ts": round(time.time(), 3),
+        "source": source,
+        "file": file_name,
+        "input_bytes": input_bytes,
+        "backend": config.DEVICE,
+        "timings_ms": {},
+    }
+
+
+def set_image(record: dict, image):
+    """Разрешение после декодирования."""
+    set_size(record, *image.size)
+
+
+def set_size(record: dict, w: int, h: int):
+    record["width"] = w
+    record["height"] = h
+    record["megapixels"] = round(w * h / 1e6, 3)
+
+
+def add_timing(record: dict, stage: str, seconds: float):
+    record["timings_ms"][stage] = round(seconds * 1000, 2)
+
+
+class TraceWriter:
+    """
+    Потокобезопасная запись JSONL (пишут I/O потоки пайплайна и event loop API).
+    Построчная буферизация: при падении процесса теряется максимум одна строка.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.TRACE_LOG_PATH
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+
+    def write(self, record: dict):
+        record["total_ms"] = round(sum(record.get("timings_ms", {}).values()), 2)
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        try:
+            with self._lock:
+                self._file.write(line + "\n")
+        except Exception as e:
+            # Трейс не должен ронять обработку
+            logger.error(f"⚠️ Ошибка записи трейса: {e}")
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+class _NullWriter:
+    """Заглушка, когда трейсы выключены (config.TRACE_ENABLED = False)."""
+
+    def write(self, record: dict):
+        pass
+
+    def close(self):
+        pass
+
+
+def open_writer():
+    if not config.TRACE_ENABLED:
+        return _NullWriter()
+    return TraceWriter()
@@ -1,43 +1,25 @@
-import requests
 from pathlib import Path
-from tqdm import tqdm
 import logging
 
+from core.downloader import ensure_file, is_verified
+
 logger = logging.getLogger(__name__)
 
-def ensure_model(file_path: Path, url: str):
+def ensure_model(file_path: Path, url: str, sha256: str = None):
     """
-    Проверяет наличие файла. Если нет — качает с прогресс-баром.
+    Проверяет наличие файла (и SHA-256, если он закреплен в config.py).
+    Если нет или хэш не совпал — качает (core/downloader.py: докачка, параллельные куски, атомарная подмена).
     """
-    if file_path.exists():
-        # Можно добавить проверку хэша, но пока просто по наличию
+    if is_verified(file_path, sha256):
         return
 
-    logger.info(f"📥 Модель не найдена: {file_path.name}")
+    logger.info(f"📥 Модель не найдена или не прошла проверку: {file_path.name}")
     logger.info(f"   Скачивание с {url}...")
-    
-    file_path.parent.mkdir(parents=True, exist_ok=True)
-    
-    try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        total_size = int(response.headers.get('content-length', 0))
 
-        with open(file_path, "wb") as file, tqdm(
-            desc=file_path.name,
-            total=total_size,
-            unit='iB',
-            unit_scale=True,
-            unit_divisor=1024,
-        ) as bar:
-            for data in response.iter_content(chunk_size=1024):
-                size = file.write(data)
-                bar.update(size)
-                
+    try:
+        ensure_file(file_path, url, sha256)
         logger.info("✅ Скачивание завершено.")
-        
     except Exception as e:
+        # Недокачанное остается в .part — следующий запуск продолжит с места обрыва
         logger.critical(f"❌ Ошибка скачивания {file_path.name}: {e}")
-        if file_path.exists():
-            file_path.unlink() # Удаляем битый файл
-        raise e
\ No newline at end of file
+        raise e
@@ -0,0 +1,298 @@
+"""
+Видео (MP4/MOV/MKV/WebM/AVI) и анимации (GIF / animated WebP).
+
+Ватермарка на всех кадрах одна и та же, поэтому YOLO гоняется не на каждом кадре:
+* MaskTracker детектит на первом кадре, потом минимум раз в config.VIDEO_DETECT_EVERY кадров,
+  а между детекциями переиспользует маску. Внеочередная детекция — при смене сцены
+  (миниатюра кадра сильно отличается от последнего кейфрейма).
+* Если новая маска не совпала со старой (IoU < config.VIDEO_MASK_IOU) или сменилась сцена —
+  интервал сбрасывается до 1 и дальше удваивается, пока маска стабильна.
+* LaMa получает кадры пачками по config.VIDEO_BATCH (clean_batch: кадры одного размера = одна корзина).
+
+Видео идет потоком через ffmpeg (rawvideo rgb24 по пайпам): в памяти только текущая пачка.
+Результат сначала кодируется без звука, потом перемуксивается с дорожками и метаданными
+исходника (звук копируется без перекодирования, если контейнер не принимает — AAC / Opus для WebM).
+VFR-видео приводится к постоянной частоте (средней), длительность и синхронизация звука сохраняются.
+
+Анимации читаются через PIL (кадры с длительностями и loop). Их кадры держатся в памяти до
+записи: PIL пишет анимацию одним save(), а GIF/WebP на практике небольшие.
+"""
+
+import json
+import logging
+import subprocess
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+import config
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+ANIMATION_SUFFIXES = {".gif", ".webp"}
+_THUMB_SIZE = (64, 36)
+
+
+class FFmpegError(RuntimeError):
+    pass
+
+
+def is_video(path: Path) -> bool:
+    return path.suffix.lower() in config.VIDEO_SUFFIXES
+
+
+def is_animation(path: Path) -> bool:
+    """GIF / WebP больше чем из одного кадра. Статичные идут обычным путем как фото."""
+    if path.suffix.lower() not in ANIMATION_SUFFIXES:
+        return False
+    try:
+        with Image.open(path) as img:
+            return bool(getattr(img, "is_animated", False))
+    except Exception:
+        return False
+
+
+def _mask_iou(a: np.ndarray, b: np.ndarray) -> float:
+    union = np.count_nonzero(a | b)
+    if union == 0:
+        return 1.0  # Обе пустые — совпадают
+    return np.count_nonzero(a & b) / union
+
+
+class MaskTracker:
+    """Решает, на каких кадрах детектить, и отдает маску для каждого кадра."""
+
+    def __init__(self, detector, every=None, scene_threshold=None, mask_iou=None):
+        self.detector = detector
+        self.every = max(1, every or config.VIDEO_DETECT_EVERY)
+        self.scene_threshold = scene_threshold if scene_threshold is not None else config.VIDEO_SCENE_THRESHOLD
+        self.mask_iou = mask_iou if mask_iou is not None else config.VIDEO_MASK_IOU
+
+        self.mask = None
+        self.mask_bits = None
+        self._thumb = None
+        self._since = 0
+        self._interval = 1
+        self.detections = 0
+        self.frames = 0
+
+    def mask_for(self, frame: Image.Image) -> Image.Image:
+        self.frames += 1
+        thumb = np.asarray(frame.convert("L").resize(_THUMB_SIZE, Image.BILINEAR), dtype=np.int16)
+        scene = self._thumb is not None and np.abs(thumb - self._thumb).mean() > self.scene_threshold
+
+        if self.mask is not None and not scene and self._since < self._interval:
+            self._since += 1
+            metrics.VIDEO_FRAMES_TOTAL.labels("reused").inc()
+            return self.mask
+
+        mask = self.detector.get_mask(frame)
+        bits = np.asarray(mask) > 0
+        changed = scene or (self.mask_bits is not None and _mask_iou(bits, self.mask_bits) < self.mask_iou)
+        self._interval = 1 if changed else min(self.every, self._interval * 2)
+
+        self.mask, self.mask_bits, self._thumb, self._since = mask, bits, thumb, 1
+        self.detections += 1
+        metrics.VIDEO_FRAMES_TOTAL.labels("detected").inc()
+        return mask
+
+
+def clean_frames(frames, detector, cleaner, emit, stats: dict = None):
+    """
+    Общий цикл: кадр -> маска (трекер) -> пачка -> clean_batch -> emit(кадр) в исходном порядке.
+    stats дополняется: frames, detections, cleaned (кадров с непустой маской).
+    """
+    tracker = MaskTracker(detector)
+    batch, masks = [], []
+    cleaned = 0
+    batch_size = max(1, config.VIDEO_BATCH)
+
+    def flush():
+        for result in cleaner.clean_batch(batch, masks):
+            emit(result)
+        batch.clear()
+        masks.clear()
+
+    for frame in frames:
+        mask = tracker.mask_for(frame)
+        if tracker.mask_bits.any():
+            cleaned += 1
+        batch.append(frame)
+        masks.append(mask)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    if stats is not None:
+        stats.update(frames=tracker.frames, detections=tracker.detections, cleaned=cleaned)
+    return stats
+
+
+# ==============================================================================
+# Видео (ffmpeg)
+# ==============================================================================
+
+def probe(path: Path) -> dict:
+    """ffprobe -> {width, height, fps, has_audio} (размер уже с учетом поворота)."""
+    cmd = [config.FFPROBE_BIN, "-v", "error", "-print_format", "json", "-show_streams", str(path)]
+    try:
+        out = subprocess.run(cmd, capture_output=True, check=True).stdout
+    except FileNotFoundError:
+        raise FFmpegError(f"{config.FFPROBE_BIN} не найден (нужен ffmpeg в PATH)")
+    except subprocess.CalledProcessError as e:
+        raise FFmpegError(f"ffprobe {path.name}: {e.stderr.decode(errors='replace').strip()}")
+
+    streams = json.loads(out).get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    if video is None:
+        raise FFmpegError(f"В {path.name} нет видеодорожки")
+
+    fps = video.get("avg_frame_rate") or "0/0"
+    if fps in ("0/0", "0"):
+        fps = video.get("r_frame_rate") or "25/1"
+
+    rotation = int(float(video.get("tags", {}).get("rotate", 0)))
+    for side_data in video.get("side_data_list", []):
+        if "rotation" in side_data:
+            rotation = int(side_data["rotation"])
+
+    w, h = int(video["width"]), int(video["height"])
+    if rotation % 180:  # ffmpeg поворачивает кадры при декодировании
+        w, h = h, w
+    return {"width": w, "height": h, "fps": fps,
+            "has_audio": any(s.get("codec_type") == "audio" for s in streams)}
+
+
+def _read_frames(proc, w, h):
+    frame_bytes = w * h * 3
+    while True:
+        buf = proc.stdout.read(frame_bytes)
+        if len(buf) < frame_bytes:
+            return
+        yield Image.frombytes("RGB", (w, h), buf)
+
+
+def _video_codec_args(suffix):
+    if suffix == ".webm":
+        return ["-c:v", "libvpx-vp9", "-crf", str(config.VIDEO_CRF), "-b:v", "0", "-row-mt", "1"]
+    return ["-c:v", "libx264", "-crf", str(config.VIDEO_CRF), "-preset", config.VIDEO_PRESET]
+
+
+def _finish(proc, name):
+    """Дождаться ffmpeg и поднять ошибку с его stderr."""
+    _, err = proc.communicate()
+    if proc.returncode != 0:
+        raise FFmpegError(f"ffmpeg ({name}): {err.decode(errors='replace').strip()[-500:]}")
+
+
+def _remux(video_only: Path, source: Path, out_path: Path):
+    """Склеить новую видеодорожку со звуком и метаданными исходника."""
+    base = [config.FFMPEG_BIN, "-v", "error", "-y", "-i", str(video_only), "-i", str(source),
+            "-map", "0:v:0", "-map", "1:a?", "-map_metadata", "1", "-c:v", "copy"]
+    if out_path.suffix.lower() in (".mp4", ".mov"):
+        base += ["-movflags", "+faststart"]
+    fallback = "libopus" if out_path.suffix.lower() == ".webm" else "aac"
+    for audio in (["-c:a", "copy"], ["-c:a", fallback, "-b:a", "192k"]):
+        result = subprocess.run(base + audio + [str(out_path)], capture_output=True)
+        if result.returncode == 0:
+            return
+        logger.warning(f"⚠️ Ремукс {source.name} с {audio[1]} не удался, пробую дальше")
+    raise FFmpegError(f"ffmpeg (remux): {result.stderr.decode(errors='replace').strip()[-500:]}")
+
+
+def process_video(path: Path, out_path: Path, detector, cleaner, stats: dict = None) -> dict:
+    """
+    Очистка видео потоком. Пишет out_path атомарно (через временные файлы рядом).
+    Возвращает stats: width, height, fps, frames, detections, cleaned.
+    """
+    stats = {} if stats is None else stats
+    info = probe(path)
+    w, h, fps = info["width"], info["height"], info["fps"]
+    stats.update(width=w, height=h, fps=fps)
+
+    suffix = out_path.suffix.lower()
+    video_only = out_path.with_name(f".{out_path.stem}.video{suffix}")
+    muxed = out_path.with_name(f".{out_path.stem}.tmp{suffix}")
+
+    decoder = subprocess.Popen(
+        [config.FFMPEG_BIN, "-v", "error", "-i", str(path), "-map", "0:v:0",
+         "-vsync", "cfr", "-r", fps, "-f", "rawvideo", "-pix_fmt", "rgb24", "-"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    encoder = subprocess.Popen(
+        [config.FFMPEG_BIN, "-v", "error", "-y",
+         "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{w}x{h}", "-framerate", fps, "-i", "-",
+         *_video_codec_args(suffix),
+         "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",  # yuv420p требует четные стороны
+         "-pix_fmt", "yuv420p", str(video_only)],
+        stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+
+    try:
+        clean_frames(_read_frames(decoder, w, h), detector, cleaner,
+                     lambda frame: encoder.stdin.write(frame.tobytes()), stats)
+        encoder.stdin.close()
+        _finish(decoder, "decode")
+        _finish(encoder, "encode")
+
+        if info["has_audio"] or suffix in (".mp4", ".mov"):
+            _remux(video_only, path, muxed)
+            muxed.replace(out_path)
+        else:
+            video_only.replace(out_path)
+    except BaseException:
+        for proc in (decoder, encoder):
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+        out_path.unlink(missing_ok=True)
+        raise
+    finally:
+        video_only.unlink(missing_ok=True)
+        muxed.unlink(missing_ok=True)
+    return stats
+
+
+# ==============================================================================
+# Анимации (PIL)
+# ==============================================================================
+
+def process_animation(path: Path, out_path: Path, detector, cleaner, stats: dict = None) -> dict:
+    """Очистка GIF / animated WebP с сохранением длительностей кадров и loop."""
+    stats = {} if stats is None else stats
+    durations, results = [], []
+
+    with Image.open(path) as img:
+        stats.update(width=img.width, height=img.height)
+        loop = img.info.get("loop", 0)
+
+        def frames():
+            for frame in ImageSequence.Iterator(img):
+                durations.append(frame.info.get("duration", img.info.get("duration", 100)))
+                yield frame.convert("RGB")
+
+        clean_frames(frames(), detector, cleaner, results.append, stats)
+
+    save_kwargs = {"save_all": True, "append_images": results[1:], "duration": durations, "loop": loop}
+    if out_path.suffix.lower() == ".webp":
+        save_kwargs.update(quality=config.API_WEBP_QUALITY, method=config.API_WEBP_METHOD)
+    else:
+        save_kwargs.update(disposal=1)
+
+    tmp = out_path.with_name(f".{out_path.stem}.tmp{out_path.suffix}")
+    try:
+        results[0].save(tmp, **save_kwargs)
+        tmp.replace(out_path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return stats
+
+
+def process(path: Path, out_path: Path, detector, cleaner, stats: dict = None) -> dict:
+    """Видео или анимация — по расширению."""
+    if is_video(path):
+        return process_video(path, out_path, detector, cleaner, stats)
+    return process_animation(path, out_path, detector, cleaner, stats)
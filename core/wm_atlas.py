@@ -0,0 +1,201 @@
+"""
+Банк готовых вариантов ватермарки для генератора (config.GEN_WM_ATLAS).
+
+Обычный путь (synth.compose_sample) на каждый пример заново поворачивает, инвертирует,
+ресайзит (Lanczos/area), размывает и портит края исходника. Банк делает это один раз:
+* масштабы — геометрическая лестница длинной стороны от ~10px до GEN_WM_ATLAS_MAX_SIDE
+  с шагом GEN_WM_ATLAS_STEP (пример берет одну из двух соседних ступеней вокруг своего размера — в среднем размер тот же);
+* 2 ориентации (как есть / поворот на 90°);
+* на каждую ступень: 1 "легкий" вариант (только ресайз) и GEN_WM_ATLAS_VARIANTS "сложных" —
+  инверсия, размытие и рваные края выпадают с теми же вероятностями GEN_*, что и в обычном пути;
+* цвет хранится с предумноженной альфой (BGR * A / 255) — смешивание без деления.
+На пример остаются дешевые операции: перекраска (LUT) и прозрачность.
+
+Хранение — как у кэша фонов: один файл uint8 + индекс, чтение через np.memmap без копий.
+Ключ — хэш настроек банка (ATLAS_KNOBS + пиксели ватермарки) и сид: поменяли их — банк пересоберется.
+Сравнение разнообразия с обычным путем: python benchmarks/8_report_wm_atlas.py
+"""
+
+import json
+import logging
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import config
+from core import synth
+
+logger = logging.getLogger(__name__)
+
+ATLAS_VERSION = 1
+MIN_SIDE = 10       # Меньше — compose_sample все равно бросает пример
+_ATLAS_STREAM = 3   # Поток случайности банка (spawn_key: не пересекается с потоками примеров)
+# GEN_*, которые читает build(): от них зависит содержимое банка
+ATLAS_KNOBS = ("GEN_WM_ATLAS_STEP", "GEN_WM_ATLAS_VARIANTS", "GEN_WM_ATLAS_MAX_SIDE",
+               "GEN_INVERT_PROB", "GEN_BLUR_PROB", "GEN_PROB_EDGE_CORRUPTION")
+
+
+def premultiply(wm_rgba):
+    """BGRA -> BGRA с BGR, умноженным на альфу (/255)."""
+    a = wm_rgba[:, :, 3]
+    bgr = cv2.multiply(cv2.cvtColor(wm_rgba, cv2.COLOR_BGRA2BGR), cv2.merge((a, a, a)), scale=1 / 255.0)
+    return cv2.merge((*cv2.split(bgr), a))
+
+
+def _hard_variant(wm, w, h, rng):
+    """Сложный вариант ступени: те же шаги и вероятности, что в compose_sample, кроме цвета."""
+    if rng.random() < config.GEN_INVERT_PROB:
+        wm = wm.copy()
+        np.invert(wm[:, :, :3], out=wm[:, :, :3])
+    wm = synth.smart_resize(wm, w, h)
+    if rng.random() < config.GEN_BLUR_PROB:
+        k = int(rng.choice([3, 5]))
+        wm = cv2.GaussianBlur(wm, (k, k), 0)
+    return synth.apply_edge_corruption(wm, rng)
+
+
+def _ladder(w, h):
+    """Размеры ступеней (w, h) по возрастанию для исходника w x h."""
+    sizes = []
+    long_side = float(MIN_SIDE * max(w, h) / w)  # Ширина не меньше MIN_SIDE, как в compose_sample
+    while True:
+        s = min(long_side, config.GEN_WM_ATLAS_MAX_SIDE) / max(w, h)
+        size = (max(1, round(w * s)), max(1, round(h * s)))
+        if not sizes or size != sizes[-1]:
+            sizes.append(size)
+        if long_side >= config.GEN_WM_ATLAS_MAX_SIDE:
+            return sizes
+        long_side *= config.GEN_WM_ATLAS_STEP
+
+
+class WatermarkAtlas:
+    """
+    Чтение вариантов из банка. Как и BackgroundCache, переживает pickle в воркеры:
+    memmap заново открывается на месте.
+    """
+
+    def __init__(self, data_path: Path, index: dict):
+        self.data_path = Path(data_path)
+        self.key = index["key"]
+        # orientation -> (ширины ступеней, [[(offset, h, w), ...] на ступень])
+        self.levels = {int(o): (np.array([lv["w"] for lv in levels]), [lv["variants"] for lv in levels])
+                       for o, levels in index["levels"].items()}
+        self._data = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    @property
+    def data(self) -> np.ndarray:
+        if self._data is None:
+            self._data = np.memmap(self.data_path, dtype=np.uint8, mode="r")
+        return self._data
+
+    def __len__(self):
+        return sum(len(v) for _, levels in self.levels.values() for v in levels)
+
+    def _view(self, offset, h, w):
+        return self.data[offset:offset + h * w * 4].reshape(h, w, 4)
+
+    def pick(self, rotated: bool, hard: bool, target_w: int, max_w: int, max_h: int, rng):
+        """
+        Вариант (BGRA, альфа предумножена, read-only) для ширины target_w, не больше max_w x max_h.
+        Между двумя соседними ступенями выбор случайный, с весом по близости к target_w:
+        в среднем ширина равна target_w (округление всегда вниз давало систематически мелкие ватермарки).
+        None — target_w меньше самой мелкой ступени или ничего не влезает.
+        """
+        widths, levels = self.levels[int(rotated)]
+        i = int(np.searchsorted(widths, target_w, side="right")) - 1
+        if i < 0:
+            return None
+        if i + 1 < len(widths) and rng.random() < (target_w - widths[i]) / (widths[i + 1] - widths[i]):
+            i += 1
+        while i >= 0 and (widths[i] > max_w or levels[i][0][1] > max_h):
+            i -= 1
+        if i < 0:
+            return None
+        variants = levels[i]
+        j = 1 + int(rng.integers(len(variants) - 1)) if hard and len(variants) > 1 else 0
+        return self._view(*variants[j])
+
+    def variants(self):
+        """Все варианты: (rotated, (w, h) ступени, hard, вид). Для отчетов."""
+        for o, (_, levels) in self.levels.items():
+            for variants in levels:
+                for j, (offset, h, w) in enumerate(variants):
+                    yield bool(o), (w, h), j > 0, self._view(offset, h, w)
+
+
+def atlas_key(wm_original, seed: int = None) -> str:
+    seed = config.GEN_SEED if seed is None else seed
+    return f"v{ATLAS_VERSION}-{synth.knobs_hash(ATLAS_KNOBS, wm_original.tobytes())}-s{seed}"
+
+
+def build(wm_original, seed: int = None, atlas_dir: Path = None) -> WatermarkAtlas:
+    """Собрать банк (детерминированно по сиду) и сохранить атомарно: данные, потом индекс."""
+    seed = config.GEN_SEED if seed is None else seed
+    atlas_dir = Path(atlas_dir or config.WM_ATLAS_DIR)
+    atlas_dir.mkdir(parents=True, exist_ok=True)
+    key = atlas_key(wm_original, seed)
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(_ATLAS_STREAM,)))
+
+    levels = {}
+    offset = 0
+    data_path = atlas_dir / f"{key}.u8"
+    tmp = data_path.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        for o, src in enumerate((wm_original, cv2.rotate(wm_original, cv2.ROTATE_90_CLOCKWISE))):
+            levels[o] = []
+            for w, h in _ladder(src.shape[1], src.shape[0]):
+                images = [synth.smart_resize(src, w, h)]
+                images += [_hard_variant(src, w, h, rng) for _ in range(config.GEN_WM_ATLAS_VARIANTS)]
+                variants = []
+                for img in images:
+                    img = np.ascontiguousarray(premultiply(img))
+                    f.write(img.data)
+                    variants.append([offset, h, w])
+                    offset += img.nbytes
+                levels[o].append({"w": w, "variants": variants})
+    tmp.replace(data_path)
+
+    index = {"key": key, "levels": levels}
+    index_path = atlas_dir / f"{key}.json"
+    tmp = index_path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    tmp.replace(index_path)
+
+    # Банки от прежних настроек больше не нужны
+    for old in atlas_dir.iterdir():
+        if old.suffix in (".u8", ".json") and old.stem != key:
+            old.unlink(missing_ok=True)
+    logger.info(f"💾 Банк ватермарок собран: {offset / 2**20:.0f} МБ")
+    return WatermarkAtlas(data_path, index)
+
+
+def load(wm_original, seed: int = None, atlas_dir: Path = None):
+    """Готовый банк под текущие настройки и эту ватермарку или None."""
+    atlas_dir = Path(atlas_dir or config.WM_ATLAS_DIR)
+    key = atlas_key(wm_original, seed)
+    try:
+        with open(atlas_dir / f"{key}.json", encoding="utf-8") as f:
+            index = json.load(f)
+        if not (atlas_dir / f"{key}.u8").exists():
+            return None
+        return WatermarkAtlas(atlas_dir / f"{key}.u8", index)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def ensure(wm_original, seed: int = None, atlas_dir: Path = None):
+    """Банк для генератора: готовый или собранный заново. None — выключен (config.GEN_WM_ATLAS)."""
+    if not config.GEN_WM_ATLAS:
+        return None
+    atlas = load(wm_original, seed, atlas_dir)
+    if atlas is None:
+        print("🧩 Собираю банк вариантов ватермарки (один раз на настройки)...")
+        atlas = build(wm_original, seed, atlas_dir)
+    return atlas